@@ -1,5 +1,6 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
 from django.shortcuts import redirect
-from django.contrib.auth import logout
+from django.contrib.auth import alogout, logout
 from .models import AccountStatus
 
 
@@ -7,14 +8,31 @@ class SuspendedUserMiddleware:
     """
     Se o usuário estiver autenticado e suspenso, faz logout e redireciona para
     a página de bloqueio com mensagem genérica.
+    Atende WSGI e ASGI: sob ASGI não força as views async para uma thread.
     """
+    sync_capable = True
+    async_capable = True
+
     def __init__(self, get_response):
         self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
 
     def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
         if request.user.is_authenticated:
             status = AccountStatus.objects.filter(user=request.user).only('suspended_until').first()
             if status and status.is_suspended_now:
                 logout(request)
                 return redirect('accounts:blocked')
-        return self.get_response(request)
\ No newline at end of file
+        return self.get_response(request)
+
+    async def __acall__(self, request):
+        user = await request.auser()
+        if user.is_authenticated:
+            status = await AccountStatus.objects.filter(user=user).only('suspended_until').afirst()
+            if status and status.is_suspended_now:
+                await alogout(request)
+                return redirect('accounts:blocked')
+        return await self.get_response(request)
@@ -0,0 +1,208 @@
+""" accounts/ratelimit.py """
+
+"""
+Limite de requisições por cliente, compartilhado entre processos via cache.
+
+- Janela deslizante aproximada (dois contadores): o total estimado é o da janela
+  atual somado ao da anterior, ponderado pelo quanto dela ainda cabe nos
+  últimos `período` segundos. Não há "reset" a cada acesso nem rajada dupla
+  na virada da janela.
+- A contagem é atômica em qualquer backend de cache:
+  * Memcached/Redis/LocMem: add + incr (incr nativo e atômico);
+  * FileBasedCache: add/get/set sob flock num arquivo do diretório do cache;
+  * DatabaseCache e demais: cada acesso reserva uma "vaga" com add(), que no
+    banco depende da chave primária (dois processos nunca levam a mesma vaga).
+- Tentativas recusadas não contam.
+
+Uso: @ratelimit('login') em views (função, async ou as_view()), ou
+check_ratelimit() dentro da view para contar só depois de validar. As taxas ficam
+em settings.RATELIMITS ({'escopo': 'N/período'}, ex.: '5/m', '20/h', '10/30s').
+"""
+
+import math
+import os
+import re
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.base import BaseCache
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.template.loader import render_to_string
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem flock, o FileBasedCache fica sem trava entre processos
+    fcntl = None
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+RATE_RE = re.compile(r"^\s*(\d+)\s*/\s*(\d*)\s*([smhd])\w*\s*$")
+
+
+def parse_rate(rate):
+    """Converte 'N/período' (ex.: '5/m', '100/h', '10/30s') em (limite, segundos)."""
+    match = RATE_RE.match(str(rate or ""))
+    if not match:
+        raise ImproperlyConfigured(f"Taxa inválida: {rate!r}. Use 'N/s', 'N/m', 'N/h', 'N/d' ou 'N/30s'.")
+    limit, multiplier, unit = match.groups()
+    return int(limit), int(multiplier or 1) * PERIODS[unit]
+
+
+class RateLimiter:
+    """Limitador de um escopo: `limit` acessos a cada `period` segundos por identidade."""
+
+    def __init__(self, scope, limit, period, cache_alias="default"):
+        self.scope = scope
+        self.limit = limit
+        self.period = period
+        self.cache_alias = cache_alias
+
+    def hit(self, ident, now=None):
+        """
+        Registra um acesso de `ident`. Retorna (permitido, retry_after_segundos).
+        Acessos recusados não são contabilizados.
+        """
+        cache = caches[self.cache_alias]
+        now = time.time() if now is None else now
+        window, elapsed = divmod(now, self.period)
+        window = int(window)
+        key = f"rl:{self.scope}:{ident}:{window}"
+        previous_key = f"rl:{self.scope}:{ident}:{window - 1}"
+        counts = cache.get_many([previous_key, key])
+        # A janela anterior pesa o quanto dela ainda está nos últimos `period` segundos
+        allowed = self.limit - counts.get(previous_key, 0) * (1 - elapsed / self.period)
+        # Mantém a chave até o fim da próxima janela, quando ela é a "anterior"
+        timeout = math.ceil(2 * self.period - elapsed) + 1
+
+        if allowed < 1:
+            ok = False
+        elif type(cache).incr is not BaseCache.incr:
+            ok = self._hit_incr(cache, key, allowed, timeout)
+        elif isinstance(cache, FileBasedCache):
+            ok = self._hit_locked(cache, key, allowed, timeout)
+        else:
+            ok = self._hit_slots(cache, key, counts.get(key, 0), allowed, timeout)
+        return ok, (0 if ok else math.ceil(self.period - elapsed))
+
+    def _hit_incr(self, cache, key, allowed, timeout):
+        cache.add(key, 0, timeout)
+        try:
+            count = cache.incr(key)
+        except ValueError:  # expirou entre o add e o incr
+            cache.add(key, 1, timeout)
+            count = 1
+        if count > allowed:
+            cache.decr(key)
+            return False
+        return True
+
+    def _hit_locked(self, cache, key, allowed, timeout):
+        with _file_lock(os.path.join(cache._dir, ".ratelimit.lock")):
+            count = cache.get(key, 0) + 1
+            if count > allowed:
+                return False
+            cache.set(key, count, timeout)
+            return True
+
+    def _hit_slots(self, cache, key, taken, allowed, timeout):
+        # `key` guarda quantas vagas já foram tomadas: só um ponto de partida (não precisa ser exato),
+        # quem garante a atomicidade é o add() de cada vaga
+        for slot in range(taken, math.floor(allowed)):
+            if cache.add(f"{key}:{slot}", 1, timeout):
+                cache.set(key, slot + 1, timeout)
+                return True
+        return False
+
+
+@contextmanager
+def _file_lock(path):
+    if fcntl is None:
+        yield
+        return
+    with open(path, "a") as fh:
+        fcntl.flock(fh, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def get_limiter(scope, rate=None):
+    """Limitador do escopo, com a taxa de `rate` ou de settings.RATELIMITS[scope]."""
+    rate = rate or getattr(settings, "RATELIMITS", {}).get(scope)
+    if not rate:
+        raise ImproperlyConfigured(f"Sem taxa para o escopo {scope!r} em settings.RATELIMITS.")
+    limit, period = parse_rate(rate)
+    return RateLimiter(scope, limit, period, getattr(settings, "RATELIMIT_CACHE", "default"))
+
+
+def client_ip(request):
+    """IP do cliente (REMOTE_ADDR; atrás de proxy, o proxy deve repassá-lo)."""
+    return request.META.get("REMOTE_ADDR") or "unknown"
+
+
+def default_ratelimited_response(request, retry_after):
+    return HttpResponse(
+        render_to_string("accounts/ratelimited.html", {"retry_after": retry_after}, request=request),
+        status=429,
+    )
+
+
+def check_ratelimit(request, user, scope, rate=None, key=None, response=None):
+    """
+    Conta um acesso de `user` (ou do IP, se anônimo) no `scope`, com `key`
+    (string) como discriminador. Devolve a resposta 429 se passou do limite,
+    senão None. Para views que só contam depois de validar a requisição.
+    """
+    if not getattr(settings, "RATELIMIT_ENABLED", True):
+        return None
+    limiter = get_limiter(scope, rate)
+    ident = f"u{user.pk}" if user.is_authenticated else f"ip{client_ip(request)}"
+    if key:
+        ident = f"{ident}:{key}"
+    ok, retry_after = limiter.hit(ident)
+    if ok:
+        return None
+    resp = (response or default_ratelimited_response)(request, retry_after)
+    resp["Retry-After"] = str(retry_after)
+    return resp
+
+
+def ratelimit(scope, rate=None, key=None, methods=("POST",), response=None):
+    """
+    Decorator de view. Conta por usuário autenticado (ou IP, se anônimo) no
+    `scope`; `key(request)` acrescenta um discriminador (ex.: o canal).
+    Só métodos em `methods` são limitados. Acima do limite responde 429 com
+    Retry-After, via `response(request, retry_after)` ou o template
+    accounts/ratelimited.html.
+    """
+    def decorator(view):
+        def check(request, user):
+            if request.method not in methods:
+                return None
+            return check_ratelimit(request, user, scope, rate, key(request) if key else None, response)
+
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def _async_view(request, *args, **kwargs):
+                user = await request.auser()
+                limited = await sync_to_async(check)(request, user)
+                if limited is not None:
+                    return limited
+                return await view(request, *args, **kwargs)
+            return _async_view
+
+        @wraps(view)
+        def _view(request, *args, **kwargs):
+            limited = check(request, request.user)
+            if limited is not None:
+                return limited
+            return view(request, *args, **kwargs)
+        return _view
+
+    return decorator
@@ -2,12 +2,13 @@ from django.urls import path
 from django.contrib.auth.views import LoginView
 from .views import SignupView, BlockedView
 from .forms import LoginForm
+from .ratelimit import ratelimit
 
 app_name = 'accounts'
 
 urlpatterns = [
-    # Login usando nosso formulário que valida bloqueios
-    path('login/', LoginView.as_view(authentication_form=LoginForm), name='login'),
-    path('signup/', SignupView.as_view(), name='signup'),
+    # Login usando nosso formulário que valida bloqueios; POSTs limitados por IP (força bruta)
+    path('login/', ratelimit('login')(LoginView.as_view(authentication_form=LoginForm)), name='login'),
+    path('signup/', ratelimit('signup')(SignupView.as_view()), name='signup'),
     path('blocked/', BlockedView.as_view(), name='blocked'),
 ]
\ No newline at end of file
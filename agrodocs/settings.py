@@ -64,6 +64,17 @@ DATABASES = {
     }
 }
 
+# Cache (também guarda os contadores do limite de requisições). Com mais de um processo use um
+# backend compartilhado: arquivo (FileBasedCache + diretório), banco (DatabaseCache + nome da
+# tabela, criada com `python manage.py createcachetable`), Memcached ou Redis.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', '10000'))},
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
     {'NAME': 'django.contrib.auth.password_validation.MinimumLengthValidator'},
@@ -96,14 +107,53 @@ EMAIL_USE_TLS = os.getenv('EMAIL_USE_TLS', 'False').lower() == 'true'
 EMAIL_USE_SSL = os.getenv('EMAIL_USE_SSL', 'False').lower() == 'true'
 DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'AgroDocs <no-reply@example.com>')
 EMAIL_TIMEOUT = int(os.getenv('EMAIL_TIMEOUT', '30'))
+# Envios simultâneos do endpoint de teste de notificações (pool próprio, fora do event loop)
+NOTIFICATION_TEST_CONCURRENCY = int(os.getenv('NOTIFICATION_TEST_CONCURRENCY', '4'))
+# Máximo de mensagens enviadas por conexão SMTP nos envios em lote
+NOTIFICATION_EMAIL_BATCH_SIZE = int(os.getenv('NOTIFICATION_EMAIL_BATCH_SIZE', '50'))
 
 # Twilio (WhatsApp)
 TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID', '')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN', '')
 TWILIO_WHATSAPP_FROM = os.getenv('TWILIO_WHATSAPP_FROM', 'whatsapp:+14155238886')
+# Cliente HTTP compartilhado (keep-alive): timeout em segundos, tentativas de conexão e tamanho do pool
+TWILIO_TIMEOUT = float(os.getenv('TWILIO_TIMEOUT', '10'))
+TWILIO_MAX_RETRIES = int(os.getenv('TWILIO_MAX_RETRIES', '0'))
+TWILIO_POOL_SIZE = int(os.getenv('TWILIO_POOL_SIZE', '4'))
+# Opcional: URL base alternativa da API (ex.: stand-in local para testes)
+TWILIO_API_BASE_URL = os.getenv('TWILIO_API_BASE_URL', '')
+
+# Limite de envio por canal (mensagens/segundo; 0 = sem limite). A taxa é reduzida
+# automaticamente quando o provedor responde com throttling (429/Retry-After, SMTP 421/45x).
+NOTIFICATION_RATE_LIMITS = {
+    'email': {'rate': float(os.getenv('NOTIFICATION_EMAIL_RATE', '10'))},
+    'whatsapp': {'rate': float(os.getenv('NOTIFICATION_WHATSAPP_RATE', '10'))},
+}
+NOTIFICATION_THROTTLE_MAX_RETRIES = int(os.getenv('NOTIFICATION_THROTTLE_MAX_RETRIES', '3'))
+# Dias de NotificationLog mantidos na tabela principal (compact_notification_logs arquiva o resto)
+NOTIFICATION_LOG_RETENTION_DAYS = int(os.getenv('NOTIFICATION_LOG_RETENTION_DAYS', '400'))
+# Relatório JSON e arquivo .prom (textfile collector) gravados a cada execução; vazio = desligado
+NOTIFICATION_METRICS_DIR = os.getenv('NOTIFICATION_METRICS_DIR', '')
+# Circuit breaker por canal: abre após N falhas consecutivas e testa de novo após reset_timeout (s)
+NOTIFICATION_CIRCUIT_BREAKER = {
+    'failure_threshold': int(os.getenv('NOTIFICATION_BREAKER_THRESHOLD', '5')),
+    'reset_timeout': float(os.getenv('NOTIFICATION_BREAKER_RESET', '60')),
+}
+
+# Limite de requisições por cliente (accounts/ratelimit.py): 'N/período' por escopo
+RATELIMIT_ENABLED = os.getenv('RATELIMIT_ENABLED', 'True').lower() == 'true'
+RATELIMITS = {
+    'login': os.getenv('RATELIMIT_LOGIN', '10/m'),  # POSTs por IP
+    'signup': os.getenv('RATELIMIT_SIGNUP', '5/h'),  # POSTs por IP
+    'notification_test': os.getenv('RATELIMIT_NOTIFICATION_TEST', '5/m'),  # por usuário e canal
+}
 
 CRONJOBS = [
     ('0 8 * * *', 'django.core.management.call_command', ['send_due_notifications']),
+    # Drena a fila: canais adiados pelo circuit breaker, falhas parciais e entradas do --enqueue
+    ('*/10 * * * *', 'django.core.management.call_command', ['process_notification_outbox']),
+    # Retenção do log e limpeza das entradas já enviadas da fila
+    ('30 3 * * *', 'django.core.management.call_command', ['compact_notification_logs']),
 ]
 
 SIGNUP_ENABLED = True
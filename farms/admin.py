@@ -1,5 +1,7 @@
 from django.contrib import admin
-from .models import Farm, Document, DocumentReminder, NotificationLog
+from .models import (
+    Farm, Document, DocumentReminder, NotificationDailyRollup, NotificationLog, NotificationLogArchive, NotificationOutbox,
+)
 
 class DocumentReminderInline(admin.TabularInline):
     model = DocumentReminder
@@ -13,12 +15,35 @@ class FarmAdmin(admin.ModelAdmin):
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('nome', 'farm', 'created_by', 'tipo', 'data_emissao', 'data_vencimento')
-    list_filter = ('tipo', 'data_vencimento')
+    list_display = ('nome', 'farm', 'owner', 'tipo', 'data_emissao', 'data_vencimento')
+    list_filter = ('tipo', 'data_vencimento', 'owner')
+    list_select_related = ('farm', 'owner')
     search_fields = ('nome', 'farm__nome')
     inlines = [DocumentReminderInline]
 
 @admin.register(NotificationLog)
 class NotificationLogAdmin(admin.ModelAdmin):
     list_display = ('document', 'days_before', 'sent_on')
-    list_filter = ('days_before', 'sent_on')
\ No newline at end of file
+    list_filter = ('days_before',)
+    # Navegação por data usa o índice de sent_on em vez de agrupar a tabela inteira
+    date_hierarchy = 'sent_on'
+    list_select_related = ('document',)
+    raw_id_fields = ('document',)
+
+@admin.register(NotificationLogArchive)
+class NotificationLogArchiveAdmin(admin.ModelAdmin):
+    list_display = ('document_id', 'days_before', 'sent_on', 'archived_at')
+    date_hierarchy = 'sent_on'
+    show_full_result_count = False
+
+@admin.register(NotificationDailyRollup)
+class NotificationDailyRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'days_before', 'reminders', 'email', 'whatsapp')
+    list_filter = ('days_before',)
+    date_hierarchy = 'day'
+
+@admin.register(NotificationOutbox)
+class NotificationOutboxAdmin(admin.ModelAdmin):
+    list_display = ('document', 'days_before', 'sent_on', 'status', 'attempts', 'available_at', 'locked_by')
+    list_filter = ('status', 'sent_on')
+    raw_id_fields = ('document',)
\ No newline at end of file
@@ -2,4 +2,8 @@ from django.apps import AppConfig
 
 class FarmsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'farms'
\ No newline at end of file
+    name = 'farms'
+
+    def ready(self):
+        # Índice de busca mantido por sinais de save/delete
+        from . import signals  # noqa: F401
@@ -4,7 +4,7 @@
 Forms e filtros do app Farms.
 
 Melhorias:
-- Helpers utilitários (only_digits).
+- Helpers utilitários (only_digits e normalize_car, de farms/normalization.py).
 - Validações robustas de CPF/CNPJ e CAR (com normalização).
 - Normalização de WhatsApp para E.164 (assumindo +55 se ausente) via serviço compartilhado.
 - save() do DocumentForm idempotente e atômico ao sincronizar lembretes.
@@ -22,24 +22,21 @@ from django.db import transaction
 from django.utils.translation import gettext_lazy as _
 
 from .models import Document, DocumentReminder, Farm
+from .normalization import normalize_car, only_digits
 from .services.notifications import normalize_phone_to_e164, NotificationError
 
 User = get_user_model()
 
+REMINDER_OPTION_DAYS = {days for days, _label in DocumentReminder.OPTIONS}
+
 # -----------------------------
 # Regex e utilitários
 # -----------------------------
 
-ONLY_DIGITS_RE = re.compile(r"\D+")
 # Aceita qualquer UF (2 letras), 7 dígitos, 32 alfanum maiúsculos
 CAR_PATTERN = re.compile(r"^[A-Z]{2}-\d{7}-[A-Z0-9]{32}$")
 
 
-def only_digits(value: str) -> str:
-    """Remove tudo que não é dígito."""
-    return ONLY_DIGITS_RE.sub("", value or "")
-
-
 def validate_cpf(digits: str) -> bool:
     """Valida CPF (apenas dígitos)."""
     if len(digits) != 11 or digits == digits[0] * 11:
@@ -261,7 +258,7 @@ class DocumentForm(forms.ModelForm):
         # Inicializa lembretes atuais para edição
         if self.instance and self.instance.pk:
             existing = list(self.instance.reminders.values_list("days_before", flat=True))
-            self.fields["lembretes"].initial = existing
+            self.fields["lembretes"].initial = [d for d in existing if d in REMINDER_OPTION_DAYS]
 
         # Placeholders curtos
         self.fields["nome"].widget.attrs.setdefault("placeholder", "Ex.: Certidão, Licença, Contrato...")
@@ -298,17 +295,26 @@ class DocumentForm(forms.ModelForm):
         if commit:
             doc.save()
 
-        # Sincroniza lembretes de forma idempotente
+        # Sincroniza lembretes de forma idempotente (offsets personalizados,
+        # fora de DocumentReminder.OPTIONS, não são tocados pelo formulário)
         selected_days = list(map(int, self.cleaned_data.get("lembretes", [])))
         selected_set = set(selected_days)
         current_set = set(doc.reminders.values_list("days_before", flat=True))
 
         to_add = selected_set - current_set
-        to_remove = current_set - selected_set
+        to_remove = (current_set & REMINDER_OPTION_DAYS) - selected_set
 
         if to_add:
+            # bulk_create não chama save(): fire_on é calculado aqui
             DocumentReminder.objects.bulk_create(
-                [DocumentReminder(document=doc, days_before=d) for d in sorted(to_add)]
+                [
+                    DocumentReminder(
+                        document=doc,
+                        days_before=d,
+                        fire_on=DocumentReminder.fire_date(doc.data_vencimento, d),
+                    )
+                    for d in sorted(to_add)
+                ]
             )
         if to_remove:
             doc.reminders.filter(days_before__in=to_remove).delete()
@@ -344,6 +350,10 @@ class FarmFilterForm(forms.Form):
         v = self.cleaned_data.get("proprietario_cpf", "") or ""
         return only_digits(v)
 
+    def clean_car_recibo(self) -> str:
+        # Mesma forma de Farm.car_recibo_norm: filtro por prefixo, com ou sem traços
+        return normalize_car(self.cleaned_data.get("car_recibo"))
+
 
 class DocumentFilterForm(forms.Form):
     # Filtros principais (email e whatsapp REMOVIDOS)
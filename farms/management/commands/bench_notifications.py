@@ -0,0 +1,231 @@
+""" Como usar:
+Benchmark padrão (1000 documentos, provedores locais):   python manage.py bench_notifications
+Com latência e falhas simuladas:   python manage.py bench_notifications --docs 5000 --smtp-latency 0.02 --twilio-latency 0.05 --error-rate 0.01
+Linha de base e checagem de regressão:   python manage.py bench_notifications --save bench.json
+                                         python manage.py bench_notifications --baseline bench.json
+Roda o send_due_notifications de ponta a ponta contra um SMTP local e um stand-in
+da API do Twilio, num banco de teste descartável (o banco configurado não é tocado). """
+
+import io
+import json
+import logging
+import time
+from datetime import timedelta
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+from django.utils import timezone
+from farms.models import Document, DocumentReminder, Farm, NotificationLog
+from farms.services.fake_providers import FakeTwilioServer, SmtpSink
+from farms.services.metrics import PERCENTILES, metrics
+
+# Offset usado nos lembretes semeados (todos disparam hoje)
+BENCH_DAYS_BEFORE = 7
+
+
+class QueryCounter:
+    """execute_wrapper que conta as consultas da conexão (sem o limite do CaptureQueriesContext)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def seed(docs, batch_size=5000):
+    """Cria `docs` documentos com um lembrete cada, disparando hoje, nos dois canais."""
+    today = timezone.localdate()
+    user = get_user_model().objects.create(username='bench')
+    farm = Farm.objects.create(
+        owner=user, nome='Fazenda Benchmark', matricula='BENCH-1',
+        proprietario_nome='Benchmark', proprietario_cpf='00000000000',
+    )
+    due = today + timedelta(days=BENCH_DAYS_BEFORE)
+    Document.objects.bulk_create(
+        (
+            Document(
+                farm=farm, owner=user, created_by=user, nome=f'Documento {i}', tipo=Document.TIPO_OUTRO,
+                data_emissao=today - timedelta(days=365), data_vencimento=due,
+                notify_email=f'bench{i}@example.com',
+                # bulk_create não chama save(): owner e E.164 vão preenchidos
+                notify_whatsapp=f'+55119{i:08d}', notify_whatsapp_e164=f'+55119{i:08d}',
+            )
+            for i in range(docs)
+        ),
+        batch_size=batch_size,
+    )
+    DocumentReminder.objects.bulk_create(
+        (
+            DocumentReminder(document_id=pk, days_before=BENCH_DAYS_BEFORE, fire_on=today)
+            for pk in Document.objects.filter(farm=farm).values_list('pk', flat=True).iterator()
+        ),
+        batch_size=batch_size,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Benchmark de ponta a ponta do envio de notificações com provedores falsos locais (SMTP e Twilio).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--docs', type=int, default=1000, help='Documentos semeados, um lembrete cada (padrão: 1000).')
+        parser.add_argument('--smtp-latency', type=float, default=0.0, help='Latência simulada do SMTP por mensagem, em segundos (padrão: 0).')
+        parser.add_argument('--twilio-latency', type=float, default=0.0, help='Latência simulada do Twilio por mensagem, em segundos (padrão: 0).')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fração de mensagens recusadas pelos provedores, 0-1 (padrão: 0).')
+        parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fração de respostas de throttling (SMTP 451 / HTTP 429), 0-1 (padrão: 0).')
+        parser.add_argument('--workers', type=int, default=4, help='Concorrência por canal repassada ao send_due_notifications (padrão: 4).')
+        parser.add_argument('--flush-size', type=int, default=100, help='--flush-size do send_due_notifications (padrão: 100).')
+        parser.add_argument(
+            '--rate-limits', action='store_true',
+            help='Mantém settings.NOTIFICATION_RATE_LIMITS (por padrão o limite de saída é desligado para medir o pipeline).'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Semente do sorteio de falhas/throttling (padrão: 0).')
+        parser.add_argument('--save', metavar='ARQUIVO', help='Grava o resultado em JSON (linha de base).')
+        parser.add_argument('--baseline', metavar='ARQUIVO', help='Compara com um resultado salvo e falha se houver regressão.')
+        parser.add_argument(
+            '--tolerance', type=float, default=0.2,
+            help='Regressão aceita contra a linha de base: vazão e consultas por lembrete (padrão: 0.2 = 20%%).'
+        )
+
+    def handle(self, *args, **options):
+        if options['docs'] < 1 or options['workers'] < 1:
+            raise CommandError('--docs e --workers devem ser >= 1.')
+        for name in ('error_rate', 'throttle_rate'):
+            if not 0 <= options[name] <= 1:
+                raise CommandError(f'--{name.replace("_", "-")} deve estar entre 0 e 1.')
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as fh:
+                    baseline = json.load(fh)
+            except (OSError, ValueError) as e:
+                raise CommandError(f'--baseline: não foi possível ler {options["baseline"]} ({e}).')
+
+        fault = {'error_rate': options['error_rate'], 'throttle_rate': options['throttle_rate'], 'seed': options['seed']}
+        with SmtpSink(latency=options['smtp_latency'], **fault) as sink, \
+                FakeTwilioServer(latency=options['twilio_latency'], **fault) as twilio:
+            old_name = connection.settings_dict['NAME']
+            self.stdout.write(f'Criando banco de teste e semeando {options["docs"]} documento(s)...')
+            connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                result = self.run_benchmark(options, sink, twilio)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.report(result)
+        if options['save']:
+            with open(options['save'], 'w', encoding='utf-8') as fh:
+                json.dump(result, fh, indent=2)
+            self.stdout.write(f'Resultado gravado em {options["save"]}.')
+        if baseline:
+            self.compare(result, baseline, options['tolerance'])
+
+    def run_benchmark(self, options, sink, twilio):
+        started = time.perf_counter()
+        seed(options['docs'])
+        seed_seconds = time.perf_counter() - started
+
+        overrides = {
+            'EMAIL_BACKEND': 'django.core.mail.backends.smtp.EmailBackend',
+            'EMAIL_HOST': '127.0.0.1',
+            'EMAIL_PORT': sink.port,
+            'EMAIL_HOST_USER': '',
+            'EMAIL_HOST_PASSWORD': '',
+            'EMAIL_USE_TLS': False,
+            'EMAIL_USE_SSL': False,
+            'TWILIO_ACCOUNT_SID': 'AC' + '0' * 32,
+            'TWILIO_AUTH_TOKEN': 'bench',
+            'TWILIO_API_BASE_URL': twilio.url,
+            'NOTIFICATION_METRICS_DIR': '',
+        }
+        if not options['rate_limits']:
+            overrides['NOTIFICATION_RATE_LIMITS'] = {}
+
+        queries = QueryCounter()
+        output = io.StringIO()
+        # As falhas simuladas gerariam um traceback de log por mensagem; o resumo já as conta
+        logging.disable(logging.CRITICAL)
+        try:
+            with override_settings(**overrides), connection.execute_wrapper(queries):
+                started = time.perf_counter()
+                call_command(
+                    'send_due_notifications', workers=options['workers'], flush_size=options['flush_size'],
+                    stdout=output, stderr=output,
+                )
+                elapsed = time.perf_counter() - started
+        finally:
+            logging.disable(logging.NOTSET)
+
+        snapshot = metrics.snapshot()
+        reminders = NotificationLog.objects.count()
+        messages = sink.stats.messages + twilio.stats.messages
+        return {
+            'docs': options['docs'],
+            'workers': options['workers'],
+            'flush_size': options['flush_size'],
+            'smtp_latency': options['smtp_latency'],
+            'twilio_latency': options['twilio_latency'],
+            'error_rate': options['error_rate'],
+            'throttle_rate': options['throttle_rate'],
+            'rate_limits': options['rate_limits'],
+            'seed_seconds': round(seed_seconds, 3),
+            'elapsed_seconds': round(elapsed, 3),
+            'reminders_sent': reminders,
+            'messages': messages,
+            'messages_per_second': round(messages / elapsed, 1) if elapsed else None,
+            'reminders_per_second': round(reminders / elapsed, 1) if elapsed else None,
+            'queries': queries.count,
+            'queries_per_reminder': round(queries.count / options['docs'], 3),
+            'latency': {
+                channel: {f'p{p}': stats.get(f'p{p}') for p in PERCENTILES}
+                for channel, stats in snapshot['latency'].items()
+            },
+            'phases': snapshot['phases'],
+            'counters': snapshot['counters'],
+            'providers': {'smtp': sink.stats.as_dict(), 'twilio': twilio.stats.as_dict()},
+        }
+
+    def report(self, result):
+        self.stdout.write(self.style.SUCCESS(
+            f'{result["reminders_sent"]}/{result["docs"]} lembrete(s), {result["messages"]} mensagem(ns) '
+            f'em {result["elapsed_seconds"]:.2f}s: {result["messages_per_second"]} msg/s '
+            f'({result["reminders_per_second"]} lembretes/s)'
+        ))
+        self.stdout.write(f'Consultas ao banco: {result["queries"]} ({result["queries_per_reminder"]} por lembrete)')
+        for channel, stats in result['latency'].items():
+            quantiles = ' '.join(f'{name} {value * 1000:.1f}ms' for name, value in stats.items() if value is not None)
+            self.stdout.write(f'Latência {channel}: {quantiles}')
+        if result['phases']:
+            self.stdout.write('Fases: ' + ' | '.join(f'{name} {secs:.2f}s' for name, secs in result['phases'].items()))
+        for name, stats in result['providers'].items():
+            self.stdout.write(
+                f'{name}: {stats["messages"]} aceita(s), {stats["errors"]} falha(s), '
+                f'{stats["throttled"]} throttling, {stats["connections"]} conexão(ões)'
+            )
+        self.stdout.write(f'(semeadura: {result["seed_seconds"]:.2f}s)')
+
+    def compare(self, result, baseline, tolerance):
+        """Falha (CommandError) se a vazão cair ou as consultas por lembrete subirem além da tolerância."""
+        params = ('docs', 'workers', 'flush_size', 'smtp_latency', 'twilio_latency', 'error_rate', 'throttle_rate', 'rate_limits')
+        different = [name for name in params if name in baseline and baseline[name] != result[name]]
+        if different:
+            self.stdout.write(self.style.WARNING(
+                'Parâmetros diferentes da linha de base (comparação pouco confiável): ' + ', '.join(different)
+            ))
+        regressions = []
+        base_rate, rate = baseline.get('messages_per_second'), result['messages_per_second']
+        if base_rate and rate is not None and rate < base_rate * (1 - tolerance):
+            regressions.append(f'vazão {rate} msg/s < {base_rate} msg/s da linha de base')
+        base_queries, queries = baseline.get('queries_per_reminder'), result['queries_per_reminder']
+        if base_queries is not None and queries > base_queries * (1 + tolerance):
+            regressions.append(f'{queries} consultas por lembrete > {base_queries} da linha de base')
+        for channel, stats in result['latency'].items():
+            base_p99 = baseline.get('latency', {}).get(channel, {}).get('p99')
+            if base_p99 and stats.get('p99') is not None:
+                self.stdout.write(f'p99 {channel}: {stats["p99"] * 1000:.1f}ms (linha de base {base_p99 * 1000:.1f}ms)')
+        if regressions:
+            raise CommandError('Regressão detectada: ' + '; '.join(regressions))
+        self.stdout.write(self.style.SUCCESS(f'Sem regressão em relação à linha de base (tolerância {tolerance:.0%}).'))
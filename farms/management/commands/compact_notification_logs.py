@@ -0,0 +1,138 @@
+""" Como usar:
+Arquivar em tabela (padrão):   python manage.py compact_notification_logs
+Arquivar em JSONL compactado:  python manage.py compact_notification_logs --archive jsonl --archive-dir /var/backups/agrodocs
+Simular:                       python manage.py compact_notification_logs --dry-run
+Move os NotificationLog mais antigos que a retenção para o arquivo, em lotes
+curtos (cada lote é uma transação), mantendo um resumo diário por offset/canal.
+Remove também as entradas já enviadas da fila (NotificationOutbox) de dias anteriores. """
+
+import gzip
+import json
+import os
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count, F, Q
+from django.utils import timezone
+from farms.models import NotificationDailyRollup, NotificationLog, NotificationLogArchive
+from farms.services.outbox import purge_sent
+
+
+class Command(BaseCommand):
+    help = 'Arquiva e remove NotificationLog antigos em lotes, mantendo um resumo diário (NotificationDailyRollup).'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days', type=int, default=settings.NOTIFICATION_LOG_RETENTION_DAYS,
+            help='Dias de log mantidos na tabela principal (padrão: settings.NOTIFICATION_LOG_RETENTION_DAYS).'
+        )
+        parser.add_argument('--archive', choices=['table', 'jsonl'], default='table', help='Destino: tabela NotificationLogArchive ou arquivo .jsonl.gz (padrão: table).')
+        parser.add_argument('--archive-dir', default='.', help='Diretório do .jsonl.gz no modo --archive jsonl (padrão: diretório atual).')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Linhas por lote/transação (padrão: 5000).')
+        parser.add_argument('--sleep', type=float, default=0.1, help='Pausa, em segundos, entre lotes para não disputar a tabela (padrão: 0.1).')
+        parser.add_argument('--dry-run', action='store_true', help='Só informa quantas linhas seriam arquivadas.')
+
+    def handle(self, *args, **options):
+        if options['retention_days'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--retention-days e --batch-size devem ser >= 1.')
+        cutoff = timezone.localdate() - timedelta(days=options['retention_days'])
+        old = NotificationLog.objects.filter(sent_on__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(self.style.WARNING(f'[DRY-RUN] {old.count()} log(s) anteriores a {cutoff} seriam arquivados.'))
+            return
+
+        archive_file = None
+        if options['archive'] == 'jsonl':
+            path = os.path.join(options['archive_dir'], f'notification_logs_{timezone.now():%Y%m%d%H%M%S}_before_{cutoff}.jsonl.gz')
+            archive_file = gzip.open(path, 'wt', encoding='utf-8')
+
+        moved = batches = 0
+        started = time.perf_counter()
+        try:
+            while True:
+                # Lote pelo índice (sent_on, document): só as linhas mais antigas, sem varrer a tabela
+                rows = list(
+                    old.order_by('sent_on', 'document_id')
+                    .values_list('pk', 'document_id', 'days_before', 'sent_on')[:options['batch_size']]
+                )
+                if not rows:
+                    break
+                pks = [pk for pk, _doc_id, _days, _day in rows]
+                if archive_file:
+                    # Grava antes do DELETE: numa falha, sobra duplicata no arquivo, nunca perda
+                    for _pk, doc_id, days_before, day in rows:
+                        archive_file.write(json.dumps(
+                            {'document_id': doc_id, 'days_before': days_before, 'sent_on': day.isoformat()}
+                        ) + '\n')
+                    archive_file.flush()
+                with transaction.atomic():
+                    # Relê o lote com lock: outra compactação concorrente não soma as mesmas linhas duas vezes
+                    pks = list(NotificationLog.objects.select_for_update().filter(pk__in=pks).values_list('pk', flat=True))
+                    self._rollup(pks)
+                    if not archive_file:
+                        self._copy_to_archive(pks)
+                    NotificationLog.objects.filter(pk__in=pks).delete()
+                moved += len(pks)
+                batches += 1
+                if len(rows) < options['batch_size']:
+                    break
+                time.sleep(options['sleep'])
+        finally:
+            if archive_file:
+                archive_file.close()
+
+        destination = path if archive_file else 'NotificationLogArchive'
+        self.stdout.write(self.style.SUCCESS(
+            f'{moved} log(s) anteriores a {cutoff} arquivados em {destination} '
+            f'({batches} lote(s), {time.perf_counter() - started:.1f}s).'
+        ))
+        # Fila: as entradas enviadas só servem de trava no próprio dia (reservas do --shard)
+        purged = purge_sent(timezone.localdate(), options['batch_size'])
+        if purged:
+            self.stdout.write(self.style.SUCCESS(f'{purged} entrada(s) enviada(s) removida(s) da fila.'))
+
+    def _copy_to_archive(self, pks):
+        """INSERT ... SELECT: as linhas vão direto de uma tabela para a outra, sem passar pelo Python."""
+        qn = connection.ops.quote_name
+        log = NotificationLog._meta
+        archive = NotificationLogArchive._meta
+        columns = ', '.join(qn(name) for name in ('document_id', 'days_before', 'sent_on'))
+        placeholders = ', '.join(['%s'] * len(pks))
+        archived_at = archive.get_field('archived_at').get_db_prep_value(timezone.now(), connection)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {qn(archive.db_table)} ({columns}, {qn("archived_at")}) '
+                f'SELECT {columns}, %s FROM {qn(log.db_table)} WHERE {qn(log.pk.column)} IN ({placeholders})',
+                [archived_at, *pks],
+            )
+
+    def _rollup(self, pks):
+        """
+        Soma as linhas do lote ao resumo diário (por dia e offset). O log não
+        guarda o canal: email/whatsapp são aproximados pelos contatos atuais
+        do documento, não pelos que existiam no envio.
+        """
+        totals = (
+            NotificationLog.objects.filter(pk__in=pks)
+            .values('sent_on', 'days_before')
+            .annotate(
+                total=Count('pk'),
+                email=Count('pk', filter=~Q(document__notify_email='')),
+                whatsapp=Count('pk', filter=~Q(document__notify_whatsapp='')),
+            )
+            .order_by()
+        )
+        for row in totals:
+            # Linha bloqueada (ou criada) pela unique_together (day, days_before): sem resumo duplicado
+            NotificationDailyRollup.objects.update_or_create(
+                day=row['sent_on'], days_before=row['days_before'],
+                defaults={
+                    'reminders': F('reminders') + row['total'],
+                    'email': F('email') + row['email'],
+                    'whatsapp': F('whatsapp') + row['whatsapp'],
+                },
+                create_defaults={'reminders': row['total'], 'email': row['email'], 'whatsapp': row['whatsapp']},
+            )
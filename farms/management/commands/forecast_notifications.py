@@ -0,0 +1,85 @@
+""" Como usar:
+Próximos 90 dias em CSV:   python manage.py forecast_notifications --days 90 > previsao.csv
+Em JSON, a partir de uma data:   python manage.py forecast_notifications --days 30 --start 2025-03-01 --format json """
+
+import csv
+import json
+from datetime import date, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from django.utils import timezone
+from farms.models import DocumentReminder
+from farms.services.notifications import CHANNEL_EMAIL, CHANNEL_WHATSAPP
+
+
+def forecast(start, end):
+    """
+    Quantidade de envios programados entre `start` e `end` (inclusive), por dia
+    de disparo e offset, separados por canal. Uma única consulta agregada
+    (varredura do índice de fire_on), sem carregar lembretes na memória.
+    """
+    return (
+        DocumentReminder.objects
+        .filter(fire_on__range=(start, end))
+        .values('fire_on', 'days_before')
+        .annotate(
+            **{
+                CHANNEL_EMAIL: Count('pk', filter=~Q(document__notify_email='')),
+                CHANNEL_WHATSAPP: Count('pk', filter=~Q(document__notify_whatsapp='')),
+            }
+        )
+        .order_by('fire_on', 'days_before')
+    )
+
+
+class Command(BaseCommand):
+    help = 'Previsão de volume de notificações por dia, canal e offset (planejamento de cota SMTP/Twilio).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=90, help='Horizonte em dias (padrão: 90).')
+        parser.add_argument('--start', metavar='YYYY-MM-DD', help='Primeiro dia da previsão (padrão: hoje).')
+        parser.add_argument('--format', choices=['csv', 'json'], default='csv', help='Formato de saída (padrão: csv).')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days deve ser >= 1.')
+        start = timezone.localdate()
+        if options['start']:
+            try:
+                start = date.fromisoformat(options['start'])
+            except ValueError:
+                raise CommandError('--start: use o formato YYYY-MM-DD.')
+        end = start + timedelta(days=options['days'] - 1)
+        rows = forecast(start, end)
+
+        if options['format'] == 'csv':
+            writer = csv.writer(self.stdout)
+            writer.writerow(['date', 'days_before', CHANNEL_EMAIL, CHANNEL_WHATSAPP])
+            for row in rows.iterator():
+                writer.writerow([row['fire_on'].isoformat(), row['days_before'], row[CHANNEL_EMAIL], row[CHANNEL_WHATSAPP]])
+            return
+
+        days = {}
+        totals = {CHANNEL_EMAIL: 0, CHANNEL_WHATSAPP: 0}
+        for row in rows.iterator():
+            day = days.setdefault(row['fire_on'], {CHANNEL_EMAIL: 0, CHANNEL_WHATSAPP: 0, 'by_offset': {}})
+            day['by_offset'][row['days_before']] = {
+                CHANNEL_EMAIL: row[CHANNEL_EMAIL], CHANNEL_WHATSAPP: row[CHANNEL_WHATSAPP],
+            }
+            for channel in totals:
+                day[channel] += row[channel]
+                totals[channel] += row[channel]
+        peak = {
+            channel: max(((d.isoformat(), v[channel]) for d, v in days.items()), key=lambda item: item[1], default=None)
+            for channel in totals
+        }
+        self.stdout.write(json.dumps(
+            {
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'totals': totals,
+                'peak': {channel: {'date': p[0], 'count': p[1]} if p else None for channel, p in peak.items()},
+                'days': [{'date': d.isoformat(), **v} for d, v in days.items()],
+            },
+            indent=2,
+        ))
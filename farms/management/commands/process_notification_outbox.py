@@ -0,0 +1,106 @@
+""" Como usar:
+Drenar a fila e sair:      python manage.py process_notification_outbox
+Worker contínuo:           python manage.py process_notification_outbox --loop
+Vários processos podem rodar ao mesmo tempo (inclusive em máquinas diferentes). """
+
+import os
+import signal
+import socket
+import threading
+from datetime import timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from farms.services.metrics import metrics, peak_rss_mb, write_run_metrics
+from farms.services.notifications import CHANNEL_EMAIL, CHANNEL_WHATSAPP, NotificationDispatcher, get_circuit_breaker
+from farms.services.outbox import claim_batch, mark_deferred, mark_failed, mark_sent
+from farms.services.reminders import days_left
+
+class Command(BaseCommand):
+    help = 'Consome a fila de notificações (NotificationOutbox) com lease por worker, retentativas e dead-letter.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help='Entradas reservadas por vez (padrão: 50).')
+        parser.add_argument('--lease-seconds', type=int, default=300, help='Duração da reserva de um lote (padrão: 300).')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Tentativas antes do dead-letter (padrão: 5).')
+        parser.add_argument('--backoff-base', type=int, default=60, help='Atraso base, em segundos, do backoff exponencial (padrão: 60).')
+        parser.add_argument('--loop', action='store_true', help='Continua aguardando novas entradas quando a fila esvaziar.')
+        parser.add_argument('--idle-sleep', type=float, default=10, help='Espera, em segundos, com a fila vazia no modo --loop (padrão: 10).')
+        parser.add_argument('--worker-id', help='Identificador do worker (padrão: host:pid).')
+        parser.add_argument('--workers', type=int, default=4, help='Concorrência padrão de cada canal (padrão: 4).')
+        parser.add_argument('--email-concurrency', type=int, help='Envios de e-mail simultâneos (padrão: --workers).')
+        parser.add_argument('--whatsapp-concurrency', type=int, help='Envios de WhatsApp simultâneos (padrão: --workers).')
+
+    def handle(self, *args, **options):
+        worker_id = options['worker_id'] or f'{socket.gethostname()}:{os.getpid()}'
+        batch_size = options['batch_size']
+        if batch_size < 1 or options['max_attempts'] < 1:
+            raise CommandError('--batch-size e --max-attempts devem ser >= 1.')
+        email_concurrency = options['email_concurrency'] or options['workers']
+        whatsapp_concurrency = options['whatsapp_concurrency'] or options['workers']
+
+        # Encerramento gracioso: termina o lote corrente e sai
+        stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGTERM, lambda *a: stop.set())
+
+        metrics.reset()
+        sent = failed = dead = deferred = 0
+        with NotificationDispatcher(email_concurrency, whatsapp_concurrency) as dispatcher:
+            while not stop.is_set():
+                with metrics.phase('db_scan'):
+                    entries = claim_batch(worker_id, batch_size, options['lease_seconds'])
+                if not entries:
+                    if not options['loop']:
+                        break
+                    stop.wait(options['idle_sleep'])
+                    continue
+
+                by_pk = {entry.pk: entry for entry in entries}
+                results = dispatcher.dispatch(
+                    # Entrada de outro dia (--since, novas tentativas): a mensagem traz os dias que faltam hoje
+                    ((entry.pk, entry.document, days_left(entry.document, entry.days_before, entry.sent_on)) for entry in entries),
+                    channels={entry.pk: entry.channel_list for entry in entries if entry.channel_list},
+                )
+
+                delivered = []
+                for pk, deliveries in results.items():
+                    entry = by_pk[pk]
+                    # Próximas tentativas só repetem os canais não entregues
+                    remaining = [d.channel for d in deliveries if not d.ok]
+                    errors = [f'{d.channel}: {d.error}' for d in deliveries if not d.ok and not d.deferred]
+                    if not remaining:
+                        delivered.append(entry)
+                        continue
+                    if not errors:
+                        deferred += 1
+                        retry_at = timezone.now() + timedelta(
+                            seconds=max(get_circuit_breaker(channel).retry_after() for channel in remaining)
+                        )
+                        mark_deferred(entry, remaining, retry_at)
+                        continue
+                    failed += 1
+                    if mark_failed(entry, '; '.join(errors), options['max_attempts'], options['backoff_base'], remaining):
+                        dead += 1
+                        self.stdout.write(self.style.ERROR(
+                            f'Descartado após {entry.attempts + 1} tentativa(s): {entry.days_before}d para "{entry.document.nome}"'
+                        ))
+                with metrics.phase('log_write'):
+                    mark_sent(delivered)
+                sent += len(delivered)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'[{worker_id}] Enviadas: {sent} | Falhas: {failed} | Descartadas: {dead} | Adiadas: {deferred}'
+        ))
+        for channel in (CHANNEL_EMAIL, CHANNEL_WHATSAPP):
+            for when, old, new in get_circuit_breaker(channel).transitions:
+                self.stdout.write(self.style.WARNING(
+                    f'[{worker_id}] Circuito {channel}: {old} -> {new} às {timezone.localtime(when):%H:%M:%S}'
+                ))
+
+        for event, n in (('sent', sent), ('failed', failed), ('dead', dead), ('deferred', deferred)):
+            metrics.incr(event, n=n)
+        peak = peak_rss_mb()
+        write_run_metrics(
+            'process_notification_outbox',
+            extra={'agrodocs_notification_peak_rss_bytes': int(peak * 1024 * 1024)} if peak is not None else None,
+        )
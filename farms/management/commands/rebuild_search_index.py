@@ -0,0 +1,21 @@
+""" Como usar:
+Depois de cargas em massa (bulk_create, update(), loaddata):   python manage.py rebuild_search_index
+Recria as linhas do índice de busca de fazendas e documentos a partir das tabelas. """
+
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from farms import search
+
+
+class Command(BaseCommand):
+    help = 'Reconstrói o índice de busca textual (farms/search.py) de fazendas e documentos.'
+
+    def handle(self, *args, **options):
+        if not search.engine():
+            self.stdout.write(self.style.WARNING('Banco sem suporte ao índice de busca; as listagens usam icontains.'))
+            return
+        started = time.perf_counter()
+        with transaction.atomic():
+            search.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Índice de busca reconstruído em {time.perf_counter() - started:.1f}s.'))
@@ -0,0 +1,222 @@
+""" Como usar:
+Processo residente (alternativa ao cron das 08:00):   python manage.py run_notification_scheduler
+Janela e ritmo:   python manage.py run_notification_scheduler --window 08:00-18:00 --batch-size 20 --tick 30
+Os lembretes do dia são distribuídos ao longo da janela em vez de saírem todos de uma vez.
+Encerra com SIGTERM/SIGINT depois de concluir o envio em andamento. """
+
+import heapq
+import itertools
+import signal
+import threading
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.utils import timezone
+from farms.services.notifications import NotificationDispatcher, get_circuit_breaker
+from farms.services.outbox import defer, retry_channels
+from farms.services.reminders import days_left, due_reminders, record_sent
+
+REFRESH = 'refresh'
+SEND = 'send'
+
+
+def parse_window(value):
+    """Converte 'HH:MM-HH:MM' em (time, time)."""
+    try:
+        start, end = (datetime.strptime(part.strip(), '%H:%M').time() for part in value.split('-'))
+    except (AttributeError, ValueError):
+        raise ValueError('Use o formato HH:MM-HH:MM, ex.: 08:00-18:00.')
+    if start >= end:
+        raise ValueError('O início da janela deve ser anterior ao fim.')
+    return start, end
+
+
+class Command(BaseCommand):
+    help = 'Agendador residente: distribui os lembretes do dia ao longo de uma janela, com novas tentativas.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--window', default='08:00-18:00', help='Janela diária de envio, HH:MM-HH:MM (padrão: 08:00-18:00).')
+        parser.add_argument('--batch-size', type=int, default=20, help='Máximo de lembretes por despertar (padrão: 20).')
+        parser.add_argument('--tick', type=float, default=30, help='Intervalo mínimo, em segundos, entre lotes cheios (padrão: 30).')
+        parser.add_argument('--refresh', type=float, default=300, help='Intervalo, em segundos, para buscar novos lembretes do dia (padrão: 300).')
+        parser.add_argument('--max-attempts', type=int, default=5, help='Tentativas por lembrete no dia (padrão: 5).')
+        parser.add_argument('--backoff-base', type=float, default=60, help='Atraso base, em segundos, do backoff exponencial (padrão: 60).')
+
+    def handle(self, *args, **options):
+        try:
+            self.window = parse_window(options['window'])
+        except ValueError as e:
+            raise CommandError(f'--window: {e}')
+        if options['batch_size'] < 1 or options['max_attempts'] < 1:
+            raise CommandError('--batch-size e --max-attempts devem ser >= 1.')
+        self.options = options
+
+        # Encerramento gracioso: termina o lembrete corrente e sai
+        self.stop = threading.Event()
+        if threading.current_thread() is threading.main_thread():
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(sig, lambda *a: self.stop.set())
+
+        # Fila de prioridade de (quando, seq, tipo, payload); seq desempata e mantém a ordem de inserção
+        self.queue = []
+        self.seq = itertools.count()
+        self.day = None
+        # Chaves (dia, (document_id, days_before)) agendadas e suas tentativas sem nenhum canal entregue
+        self.scheduled = set()
+        self.attempts = {}
+        self.sent = self.failed = 0
+        self.push(timezone.now(), REFRESH)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Agendador iniciado (janela {options["window"]}, até {options["batch_size"]} por lote).'
+        ))
+        with NotificationDispatcher() as self.dispatcher:
+            while not self.stop.is_set():
+                # Processo de longa duração: descarta conexões que caíram ou passaram de CONN_MAX_AGE
+                close_old_connections()
+                now = timezone.now()
+                if self.queue[0][0] > now:
+                    self.stop.wait((self.queue[0][0] - now).total_seconds())
+                    continue
+                if self.queue[0][2] == REFRESH:
+                    heapq.heappop(self.queue)
+                    self.refresh(now)
+                    continue
+                if self.send_batch(now) >= options['batch_size']:
+                    # Lote cheio: respeita o intervalo mínimo antes do próximo
+                    self.stop.wait(options['tick'])
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Agendador encerrado. Enviadas: {self.sent} | Desistências: {self.failed}'
+        ))
+
+    def push(self, when, kind, payload=None):
+        heapq.heappush(self.queue, (when, next(self.seq), kind, payload))
+
+    def refresh(self, now):
+        """Agenda os lembretes do dia ainda não agendados, espalhados pelo restante da janela."""
+        today = timezone.localdate(now)
+        if today != self.day:
+            # Virada do dia: mantém só o estado do que ainda está na fila (lembretes de ontem em espera)
+            self.day = today
+            queued = {entry[3] for entry in self.queue if entry[2] == SEND}
+            self.scheduled &= queued
+            self.attempts = {k: v for k, v in self.attempts.items() if k in queued}
+
+        keys = [
+            key for key in due_reminders(today).values_list('document_id', 'days_before')
+            if (today, key) not in self.scheduled
+        ]
+        start = max(now, timezone.make_aware(datetime.combine(today, self.window[0])))
+        end = max(start, timezone.make_aware(datetime.combine(today, self.window[1])))
+        step = (end - start) / len(keys) if keys else timedelta(0)
+        for i, key in enumerate(keys):
+            self.push(start + step * i, SEND, (today, key))
+        self.scheduled.update((today, key) for key in keys)
+        if keys:
+            self.stdout.write(f'{timezone.localtime(now):%H:%M:%S} {len(keys)} lembrete(s) agendado(s) até {timezone.localtime(end):%H:%M}')
+
+        # Próxima busca: no intervalo configurado, sem passar da virada do dia
+        tomorrow = timezone.make_aware(datetime.combine(today + timedelta(days=1), time.min))
+        self.push(min(now + timedelta(seconds=self.options['refresh']), tomorrow), REFRESH)
+
+    def send_batch(self, now):
+        """Envia até --batch-size lembretes vencidos na fila. Retorna quantos foram retirados."""
+        batch = defaultdict(list)
+        taken = 0
+        while self.queue and self.queue[0][2] == SEND and self.queue[0][0] <= now and taken < self.options['batch_size']:
+            # Cada entrada segue com o seu dia: as de ontem ainda pendentes na virada não se perdem
+            day, key = heapq.heappop(self.queue)[3]
+            batch[day].append(key)
+            taken += 1
+
+        for day, keys in sorted(batch.items()):
+            if self.stop.is_set():
+                # Interrompido: o restante fica para a próxima execução
+                break
+            self.send_day(now, day, keys)
+        return taken
+
+    def send_day(self, now, day, keys):
+        """
+        Envia os lembretes `keys` do dia `day`. Entrega parcial vai já para o
+        log e os canais que faltam para a fila (NotificationOutbox), como no
+        send_due_notifications: um reinício não repete o canal entregue. Só o
+        que não saiu por nenhum canal fica nesta fila, com backoff; ao desistir,
+        os canais vão para a fila do process_notification_outbox.
+        """
+        # Revalida no banco: lembrete ainda existe, dispara em `day`, não está no log nem na fila
+        wanted = set(keys)
+        reminders = [
+            r for r in due_reminders(day).filter(document_id__in={doc_id for doc_id, _days in keys})
+            if (r.document_id, r.days_before) in wanted
+        ]
+        if not reminders:
+            return
+        documents = {(r.document_id, r.days_before): r.document for r in reminders}
+        # Depois da virada do dia, a mensagem traz os dias que faltam hoje (o log fica com a chave original)
+        results = self.dispatcher.dispatch(
+            (key, document, days_left(document, key[1], day)) for key, document in documents.items()
+        )
+
+        delivered = []
+        deferred = {}
+        retry = {}
+        for key, deliveries in results.items():
+            document = documents[key]
+            remaining = [d.channel for d in deliveries if not d.ok]
+            errors = [f'{d.channel}: {d.error}' for d in deliveries if not d.ok and not d.deferred]
+            if not remaining:
+                self.attempts.pop((day, key), None)
+                delivered.append(key)
+                continue
+            if len(remaining) < len(deliveries):
+                # Parte entregue: log agora e fila para o restante
+                self.attempts.pop((day, key), None)
+                if errors:
+                    retry[key] = (remaining, '; '.join(errors))
+                else:
+                    deferred[key] = remaining
+                self.stdout.write(self.style.WARNING(
+                    f'Entrega parcial do lembrete {key[1]}d para "{document.nome}"; '
+                    f'reenfileirado: {", ".join(remaining)}'
+                ))
+                continue
+            if not errors:
+                # Canal fora do ar: tenta de novo quando o circuito puder reabrir, sem contar tentativa
+                retry_after = max(get_circuit_breaker(channel).retry_after() for channel in remaining)
+                self.push(timezone.now() + timedelta(seconds=retry_after), SEND, (day, key))
+                continue
+            attempts = self.attempts.get((day, key), 0) + 1
+            self.attempts[(day, key)] = attempts
+            if attempts >= self.options['max_attempts']:
+                self.failed += 1
+                del self.attempts[(day, key)]
+                # Nada foi entregue: a fila continua tentando, com backoff e dead-letter próprios
+                retry_channels({key: (remaining, '; '.join(errors))}, day, self.options['backoff_base'])
+                self.stdout.write(self.style.ERROR(
+                    f'Desistindo após {attempts} tentativa(s): {key[1]}d para "{document.nome}" '
+                    f'({"; ".join(errors)}); enviado para a fila'
+                ))
+                continue
+            delay = self.options['backoff_base'] * (2 ** (attempts - 1))
+            self.push(timezone.now() + timedelta(seconds=delay), SEND, (day, key))
+            self.stdout.write(self.style.WARNING(
+                f'Falha no lembrete {key[1]}d para "{document.nome}" ({"; ".join(errors)}); nova tentativa em {delay:.0f}s'
+            ))
+
+        # O log impede o reenvio dos canais já entregues; a fila cuida do restante
+        record_sent([*delivered, *deferred, *retry], day)
+        if deferred:
+            retry_at = timezone.now() + timedelta(seconds=max(
+                get_circuit_breaker(channel).retry_after() for channels in deferred.values() for channel in channels
+            ))
+            defer(deferred, day, retry_at)
+        if retry:
+            retry_channels(retry, day, self.options['backoff_base'])
+        self.sent += len(delivered)
+        if delivered:
+            self.stdout.write(self.style.SUCCESS(
+                f'{timezone.localtime(now):%H:%M:%S} Enviados {len(delivered)} lembrete(s)'
+            ))
@@ -1,51 +1,310 @@
-from datetime import timedelta
-from django.core.management.base import BaseCommand
+import os
+import socket
+import tracemalloc
+from datetime import date, timedelta
+from itertools import groupby
+from operator import attrgetter
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
 from django.utils import timezone
-from farms.models import DocumentReminder, NotificationLog
-from farms.services.notifications import notify_document
+from farms.services.notifications import CHANNEL_EMAIL, CHANNEL_WHATSAPP, NotificationDispatcher, get_circuit_breaker
+from farms.services.outbox import (
+    claim_keys, defer, enqueue, mark_deferred, mark_failed, mark_sent, release, retry_channels,
+)
+from farms.services.reminders import chunked, days_left, due_reminders, logged_keys, parse_shard, record_sent
+from farms.services.metrics import PERCENTILES, metrics, peak_rss_mb, write_run_metrics
+from farms.services.throttle import get_rate_limiter
+
+# Lease das reservas do --shard: cobre o envio de um lote de --flush-size
+CLAIM_LEASE_SECONDS = 300
 
 class Command(BaseCommand):
     help = 'Envia notificações de documentos conforme lembretes configurados.'
 
     def add_arguments(self, parser):
         parser.add_argument('--dry-run', action='store_true', help='Mostra o que seria enviado, sem enviar de fato.')
+        parser.add_argument(
+            '--enqueue', action='store_true',
+            help='Apenas enfileira em NotificationOutbox (envio pelo process_notification_outbox).'
+        )
+        parser.add_argument(
+            '--digest', action='store_true',
+            help='Agrupa os lembretes do dia e envia uma única mensagem por destinatário e canal (não combina com --shard).'
+        )
+        parser.add_argument(
+            '--since', metavar='YYYY-MM-DD',
+            help='Recupera dias perdidos: envia também os lembretes que deveriam ter disparado desde essa data e não constam no log.'
+        )
+        parser.add_argument(
+            '--shard', metavar='INDEX/COUNT',
+            help='Processa só a fatia INDEX de COUNT (document_id %% COUNT == INDEX), para rodar em vários nós.'
+        )
+        parser.add_argument(
+            '--flush-size', type=int, default=100,
+            help='Lembretes por lote: checagem de duplicidade e gravação do log a cada lote (padrão: 100).'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=4,
+            help='Concorrência padrão de cada canal (padrão: 4).'
+        )
+        parser.add_argument('--email-concurrency', type=int, help='Envios de e-mail simultâneos (padrão: --workers).')
+        parser.add_argument('--whatsapp-concurrency', type=int, help='Envios de WhatsApp simultâneos (padrão: --workers).')
+        parser.add_argument(
+            '--email-batch-size', type=int,
+            help='Máximo de e-mails por conexão SMTP (padrão: settings.NOTIFICATION_EMAIL_BATCH_SIZE).'
+        )
+        parser.add_argument(
+            '--metrics-dir',
+            help='Diretório do relatório JSON e do arquivo .prom (padrão: settings.NOTIFICATION_METRICS_DIR).'
+        )
+        parser.add_argument('--tracemalloc', action='store_true', help='Mede o pico de memória alocada com tracemalloc (mais lento).')
 
     def handle(self, *args, **options):
         today = timezone.localdate()
         dry_run = options['dry_run']
+        enqueue_only = options['enqueue']
+        flush_size = options['flush_size']
+        email_concurrency = options['email_concurrency'] or options['workers']
+        whatsapp_concurrency = options['whatsapp_concurrency'] or options['workers']
+        if flush_size < 1:
+            raise CommandError('--flush-size deve ser >= 1.')
+        if email_concurrency < 1 or whatsapp_concurrency < 1:
+            raise CommandError('A concorrência de cada canal deve ser >= 1.')
+        shard = None
+        if options['shard']:
+            try:
+                shard = parse_shard(options['shard'])
+            except ValueError as e:
+                raise CommandError(f'--shard: {e}')
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since: use o formato YYYY-MM-DD.')
+            if since > today:
+                raise CommandError('--since não pode ser posterior a hoje.')
+            # Antes disso o log já foi arquivado e não serve mais para evitar reenvio
+            oldest = today - timedelta(days=settings.NOTIFICATION_LOG_RETENTION_DAYS)
+            if since < oldest:
+                raise CommandError(f'--since não pode ser anterior a {oldest} (retenção do log).')
+        digest = options['digest']
+        if digest and shard:
+            # A fatia é por documento: o mesmo destinatário receberia um digest de cada nó
+            raise CommandError('--digest não pode ser combinado com --shard (um digest por fatia para o mesmo destinatário).')
+        worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        metrics.reset()
+        if options['tracemalloc']:
+            tracemalloc.start()
         count = 0
+        failed = 0
+        deferred = 0
+        skipped = 0
+        expired = 0
+        # Modo digest: acumula o dia inteiro para agrupar por destinatário
+        digest_pending = {}
+        # Dia de disparo de cada lembrete acumulado (sent_on do log; difere de hoje com --since)
+        digest_days = {}
 
-        reminders = DocumentReminder.objects.select_related('document', 'document__farm')
-        for reminder in reminders:
-            target_date = today + timedelta(days=reminder.days_before)
-            doc = reminder.document
-            if doc.data_vencimento == target_date:
-                # Evita duplicidade no mesmo dia
-                log_exists = NotificationLog.objects.filter(
-                    document=doc,
-                    days_before=reminder.days_before,
-                    sent_on=today
-                ).exists()
-                if log_exists:
-                    continue
-
-                if dry_run:
-                    self.stdout.write(self.style.NOTICE(
-                        f'[DRY-RUN] Enviaria lembrete {reminder.days_before}d para "{doc.nome}" (vence {doc.data_vencimento})'
-                    ))
-                else:
-                    notify_document(doc, reminder.days_before)
-                    NotificationLog.objects.create(
-                        document=doc,
-                        days_before=reminder.days_before,
-                        sent_on=today
+        with NotificationDispatcher(email_concurrency, whatsapp_concurrency, options['email_batch_size']) as dispatcher:
+            # Apenas os lembretes que disparam hoje (ou desde --since) e ainda não foram registrados no log
+            reminders = due_reminders(today, shard=shard, since=since)
+            # iterator(): lê em blocos (cursor do servidor no PostgreSQL) sem manter o queryset inteiro em memória
+            for chunk in chunked(metrics.timed_iter('db_scan', reminders.iterator(chunk_size=flush_size)), flush_size):
+                # Cada dia de disparo é tratado com o seu sent_on (ordenado por fire_on)
+                for day, group in groupby(chunk, key=attrgetter('fire_on')):
+                    group = list(group)
+                    # Revalida o lote inteiro contra o log com uma consulta (protege contra execuções concorrentes)
+                    with metrics.phase('db_scan'):
+                        already_sent = logged_keys(group, day)
+                    pending = {}
+                    for reminder in group:
+                        key = (reminder.document_id, reminder.days_before)
+                        if key not in already_sent:
+                            pending[key] = reminder.document
+                    metrics.incr('already_logged', n=len(group) - len(pending))
+
+                    if day != today:
+                        # Atrasado (--since): documento que já venceu não recebe o lembrete "vence em N dias"
+                        late_expired = [key for key, doc in pending.items() if doc.data_vencimento < today]
+                        for key in late_expired:
+                            self.stdout.write(self.style.WARNING(
+                                f'Ignorado lembrete {key[1]}d de {day} para "{pending.pop(key).nome}": documento já vencido'
+                            ))
+                        expired += len(late_expired)
+
+                    if dry_run:
+                        late = f' [atrasado de {day}]' if day != today else ''
+                        for (_doc_id, days_before), doc in pending.items():
+                            self.stdout.write(self.style.NOTICE(
+                                f'[DRY-RUN] Enviaria lembrete {days_left(doc, days_before, day, today)}d '
+                                f'para "{doc.nome}" (vence {doc.data_vencimento}){late}'
+                            ))
+                        count += len(pending)
+                        continue
+
+                    if enqueue_only:
+                        with metrics.phase('log_write'):
+                            enqueue(pending.keys(), day)
+                        count += len(pending)
+                        continue
+
+                    claims = {}
+                    if shard is not None:
+                        # Nós com fatias sobrepostas: só envia o que este processo conseguiu reservar
+                        with metrics.phase('log_write'):
+                            claims = claim_keys(pending.keys(), day, worker_id, CLAIM_LEASE_SECONDS)
+                        skipped += len(pending) - len(claims)
+                        pending = {key: doc for key, doc in pending.items() if key in claims}
+
+                    if digest:
+                        digest_pending.update(pending)
+                        digest_days.update(dict.fromkeys(pending, day))
+                        continue
+
+                    # Atrasados: a mensagem traz os dias que faltam hoje; o log fica com a chave original
+                    results = dispatcher.dispatch(
+                        (key, doc, days_left(doc, key[1], day, today)) for key, doc in pending.items()
                     )
-                    self.stdout.write(self.style.SUCCESS(
-                        f'Enviado lembrete {reminder.days_before}d para "{doc.nome}"'
-                    ))
-                count += 1
+                    with metrics.phase('log_write'):
+                        sent, errors, later = self._record_results(results, pending, claims, day)
+                    count += sent
+                    failed += errors
+                    deferred += later
+
+            if digest_pending:
+                results = dispatcher.dispatch_digest(
+                    (key, doc, days_left(doc, key[1], digest_days[key], today)) for key, doc in digest_pending.items()
+                )
+                for keys in chunked(sorted(results, key=digest_days.get), flush_size):
+                    for day, day_keys in groupby(keys, key=digest_days.get):
+                        with metrics.phase('log_write'):
+                            sent, errors, later = self._record_results(
+                                {key: results[key] for key in day_keys}, digest_pending, {}, day
+                            )
+                        count += sent
+                        failed += errors
+                        deferred += later
 
+        prefix = f'[shard {shard[0]}/{shard[1]}] ' if shard else ''
         if dry_run:
-            self.stdout.write(self.style.WARNING(f'[DRY-RUN] Total de notificações simuladas: {count}'))
+            self.stdout.write(self.style.WARNING(f'{prefix}[DRY-RUN] Total de notificações simuladas: {count}'))
+        elif enqueue_only:
+            self.stdout.write(self.style.SUCCESS(f'{prefix}Total de notificações enfileiradas: {count}'))
         else:
-            self.stdout.write(self.style.SUCCESS(f'Total de notificações enviadas: {count}'))
\ No newline at end of file
+            self.stdout.write(self.style.SUCCESS(f'{prefix}Total de notificações enviadas: {count}'))
+            if failed:
+                self.stdout.write(self.style.ERROR(f'{prefix}Total de falhas: {failed}'))
+            if deferred:
+                self.stdout.write(self.style.WARNING(f'{prefix}Adiadas para a fila (circuito aberto): {deferred}'))
+            if skipped:
+                self.stdout.write(self.style.WARNING(f'{prefix}Já reservadas por outro nó: {skipped}'))
+            if expired:
+                self.stdout.write(self.style.WARNING(f'{prefix}Atrasadas ignoradas (documento já vencido): {expired}'))
+            for channel in (CHANNEL_EMAIL, CHANNEL_WHATSAPP):
+                breaker = get_circuit_breaker(channel)
+                for when, old, new in breaker.transitions:
+                    self.stdout.write(self.style.WARNING(
+                        f'{prefix}Circuito {channel}: {old} -> {new} às {timezone.localtime(when):%H:%M:%S}'
+                    ))
+                limiter = get_rate_limiter(channel)
+                if limiter.throttled:
+                    self.stdout.write(self.style.WARNING(
+                        f'{prefix}Throttling em {channel}: {limiter.throttled} resposta(s); '
+                        f'taxa atual {limiter.rate or 0:.1f}/s (máx. {limiter.max_rate or 0:.1f}/s)'
+                    ))
+
+        metrics.incr('simulated' if dry_run else 'enqueued' if enqueue_only else 'sent', n=count)
+        metrics.incr('failed', n=failed)
+        metrics.incr('deferred', n=deferred)
+        metrics.incr('skipped', n=skipped)
+        metrics.incr('expired', n=expired)
+        self._write_metrics(prefix, options['metrics_dir'])
+        if options['tracemalloc']:
+            tracemalloc.stop()
+
+    def _write_metrics(self, prefix, directory):
+        """Resumo de fases/latências no stdout e relatório JSON + .prom do run."""
+        peak = peak_rss_mb()
+        extra = {'agrodocs_notification_peak_rss_bytes': int(peak * 1024 * 1024)} if peak is not None else None
+        data = write_run_metrics('send_due_notifications', directory, extra)
+        if data['phases']:
+            self.stdout.write(f'{prefix}Fases: ' + ' | '.join(f'{name} {secs:.2f}s' for name, secs in data['phases'].items()))
+        for channel, stats in data['latency'].items():
+            quantiles = ' '.join(f'p{p} {stats[f"p{p}"] * 1000:.0f}ms' for p in PERCENTILES)
+            self.stdout.write(f'{prefix}Latência {channel}: {stats["count"]} chamada(s), {quantiles}, total {stats["sum"]:.2f}s')
+        if 'tracemalloc' in data:
+            self.stdout.write(f'{prefix}Pico de memória alocada (tracemalloc): {data["tracemalloc"]["peak_bytes"] / 1024 / 1024:.1f} MB')
+        if peak is not None:
+            self.stdout.write(f'{prefix}Pico de memória (RSS): {peak:.1f} MB')
+
+
+    def _record_results(self, results, pending, claims, day):
+        """
+        Registra no log (ou conclui as reservas) o que foi entregue em todos os
+        canais e libera as reservas em que nada saiu. Se parte dos canais foi
+        entregue, o lembrete entra no log (uma nova execução não repete o canal
+        entregue) e só os demais vão para a fila (NotificationOutbox): os
+        recusados pelo circuit breaker para depois da reabertura, os que
+        falharam com backoff. Retorna (enviadas, falhas, adiadas).
+        """
+        sent = []
+        deferred = {}
+        retry = {}
+        failed = 0
+        for key, deliveries in results.items():
+            doc = pending[key]
+            remaining = [d.channel for d in deliveries if not d.ok]
+            errors = [f'{d.channel}: {d.error}' for d in deliveries if not d.ok and not d.deferred]
+            if not remaining:
+                sent.append(key)
+                self.stdout.write(self.style.SUCCESS(
+                    f'Enviado lembrete {key[1]}d para "{doc.nome}"'
+                ))
+                continue
+            if errors and len(remaining) == len(deliveries):
+                # Nada foi entregue: a próxima execução tenta o lembrete inteiro
+                failed += 1
+                if key in claims:
+                    release([claims[key]])
+                self.stdout.write(self.style.ERROR(
+                    f'Falha no lembrete {key[1]}d para "{doc.nome}" ({"; ".join(errors)})'
+                ))
+                continue
+            if errors:
+                failed += 1
+                retry[key] = (remaining, '; '.join(errors))
+                self.stdout.write(self.style.ERROR(
+                    f'Falha parcial no lembrete {key[1]}d para "{doc.nome}" ({"; ".join(errors)}); '
+                    f'reenfileirado: {", ".join(remaining)}'
+                ))
+                continue
+            deferred[key] = remaining
+            self.stdout.write(self.style.WARNING(
+                f'Adiado lembrete {key[1]}d para "{doc.nome}" (circuito aberto: {", ".join(remaining)})'
+            ))
+
+        if claims:
+            mark_sent([claims[key] for key in sent])
+        else:
+            record_sent(sent, day)
+
+        if deferred or retry:
+            # O log impede o reenvio dos canais já entregues; a fila cuida do restante
+            record_sent([*deferred, *retry], day)
+        if deferred:
+            retry_at = timezone.now() + timedelta(seconds=max(
+                get_circuit_breaker(channel).retry_after() for channels in deferred.values() for channel in channels
+            ))
+            if claims:
+                for key, channels in deferred.items():
+                    mark_deferred(claims[key], channels, retry_at)
+            else:
+                defer(deferred, day, retry_at)
+        if retry:
+            if claims:
+                for key, (channels, error) in retry.items():
+                    mark_failed(claims[key], error, channels=channels)
+            else:
+                retry_channels(retry, day)
+        return len(sent), failed, len(deferred)
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-16 23:39
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0002_alter_farm_proprietario_cpf'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('days_before', models.PositiveIntegerField()),
+                ('sent_on', models.DateField(default=django.utils.timezone.localdate)),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('sent', 'Enviada'), ('dead', 'Descartada')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('available_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('locked_by', models.CharField(blank=True, max_length=100)),
+                ('locked_until', models.DateTimeField(blank=True, null=True)),
+                ('last_error', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='outbox_entries', to='farms.document')),
+            ],
+            options={
+                'verbose_name': 'Notificação na fila',
+                'verbose_name_plural': 'Fila de notificações',
+                'indexes': [models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx')],
+                'unique_together': {('document', 'days_before', 'sent_on')},
+            },
+        ),
+    ]
@@ -0,0 +1,52 @@
+# DocumentReminder.fire_on: data de disparo desnormalizada (vencimento - days_before), preenchida em lotes
+
+from datetime import timedelta
+
+from django.db import migrations, models
+from django.db.models import DateField, Max, OuterRef, Subquery, Value
+from django.db.models.functions import Cast
+
+BATCH_SIZE = 10000
+
+
+def backfill_fire_on(apps, schema_editor):
+    """
+    Preenche fire_on em janelas de pk, com um UPDATE por offset em cada janela
+    (data_vencimento do documento via subconsulta, calculada no banco).
+    """
+    Document = apps.get_model('farms', 'Document')
+    DocumentReminder = apps.get_model('farms', 'DocumentReminder')
+    last_pk = DocumentReminder.objects.aggregate(last=Max('pk'))['last'] or 0
+    due = Document.objects.filter(pk=OuterRef('document_id')).values('data_vencimento')
+    for start in range(0, last_pk, BATCH_SIZE):
+        window = DocumentReminder.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE)
+        for days_before in window.values_list('days_before', flat=True).distinct().order_by():
+            window.filter(days_before=days_before).update(
+                fire_on=Cast(Subquery(due) - Value(timedelta(days=days_before)), DateField())
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0004_notificationoutbox_channels'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentreminder',
+            name='fire_on',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.RunPython(backfill_fire_on, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='documentreminder',
+            name='fire_on',
+            field=models.DateField(db_index=True, editable=False),
+        ),
+        migrations.AlterField(
+            model_name='documentreminder',
+            name='days_before',
+            field=models.PositiveIntegerField(),
+        ),
+    ]
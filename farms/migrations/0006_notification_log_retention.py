@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0005_documentreminder_fire_on'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('days_before', models.PositiveIntegerField()),
+                ('reminders', models.PositiveIntegerField(default=0)),
+                ('email', models.PositiveIntegerField(default=0)),
+                ('whatsapp', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Resumo diário de notificações',
+                'verbose_name_plural': 'Resumos diários de notificações',
+                'ordering': ['-day', 'days_before'],
+            },
+        ),
+        migrations.CreateModel(
+            name='NotificationLogArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('document_id', models.BigIntegerField()),
+                ('days_before', models.PositiveIntegerField()),
+                ('sent_on', models.DateField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Log de Notificação arquivado',
+                'verbose_name_plural': 'Logs de Notificações arquivados',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='notificationlog',
+            index=models.Index(fields=['sent_on', 'document'], name='notiflog_sent_on_doc_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='notificationdailyrollup',
+            unique_together={('day', 'days_before')},
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Índice de busca textual (FTS5 no SQLite, trigram/tsvector no PostgreSQL).
+# O SQL fica copiado aqui, congelado no esquema desta migração: farms/search.py
+# pode mudar depois sem alterar o que a migração cria.
+
+import sqlite3
+
+from django.db import migrations
+
+SQLITE_CREATE = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS farms_farm_search USING fts5("
+    "nome, matricula, car_recibo, proprietario_nome, proprietario_cpf, cpf_digits, tokenize='trigram')",
+    "INSERT INTO farms_farm_search "
+    "(rowid, nome, matricula, car_recibo, proprietario_nome, proprietario_cpf, cpf_digits) "
+    "SELECT src.id, src.nome, src.matricula, COALESCE(src.car_recibo, ''), src.proprietario_nome, src.proprietario_cpf, "
+    "REPLACE(REPLACE(REPLACE(REPLACE(src.proprietario_cpf, '.', ''), '-', ''), '/', ''), ' ', '') "
+    "FROM farms_farm AS src",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS farms_document_search USING fts5("
+    "nome, tipo, farm_nome, farm_matricula, notify_email, notify_whatsapp, farm_id UNINDEXED, tokenize='trigram')",
+    "INSERT INTO farms_document_search "
+    "(rowid, nome, tipo, farm_nome, farm_matricula, notify_email, notify_whatsapp, farm_id) "
+    "SELECT src.id, src.nome, src.tipo, farm.nome, farm.matricula, src.notify_email, src.notify_whatsapp, src.farm_id "
+    "FROM farms_document AS src JOIN farms_farm AS farm ON farm.id = src.farm_id",
+]
+
+POSTGRESQL_CREATE = ["CREATE EXTENSION IF NOT EXISTS pg_trgm"]
+for table, source in (('farms_farm', 'farms_farm'), ('farms_document', 'farms_document')):
+    POSTGRESQL_CREATE += [
+        f"CREATE TABLE IF NOT EXISTS {table}_search ("
+        f"object_id bigint PRIMARY KEY REFERENCES {source} (id) ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+        f"scope_id bigint NULL, body text NOT NULL, digits text NOT NULL, vector tsvector NOT NULL)",
+        f"CREATE INDEX IF NOT EXISTS {table}_search_body_trgm ON {table}_search USING gin (body gin_trgm_ops)",
+        f"CREATE INDEX IF NOT EXISTS {table}_search_digits_trgm ON {table}_search USING gin (digits gin_trgm_ops)",
+        f"CREATE INDEX IF NOT EXISTS {table}_search_vector ON {table}_search USING gin (vector)",
+        f"CREATE INDEX IF NOT EXISTS {table}_search_scope ON {table}_search (scope_id)",
+    ]
+FARM_FIELDS = "src.nome, src.matricula, COALESCE(src.car_recibo, ''), src.proprietario_nome, src.proprietario_cpf"
+DOCUMENT_FIELDS = "src.nome, src.tipo, farm.nome, farm.matricula, src.notify_email, src.notify_whatsapp"
+POSTGRESQL_CREATE += [
+    # chr(31): separador invisível, um termo não casa "atravessando" dois campos
+    "INSERT INTO farms_farm_search (object_id, scope_id, body, digits, vector) "
+    f"SELECT src.id, NULL, concat_ws(chr(31), {FARM_FIELDS}), "
+    "regexp_replace(src.proprietario_cpf, '[^0-9]', '', 'g'), "
+    f"to_tsvector('portuguese', concat_ws(' ', {FARM_FIELDS})) "
+    "FROM farms_farm AS src",
+    "INSERT INTO farms_document_search (object_id, scope_id, body, digits, vector) "
+    f"SELECT src.id, src.farm_id, concat_ws(chr(31), {DOCUMENT_FIELDS}), '', "
+    f"to_tsvector('portuguese', concat_ws(' ', {DOCUMENT_FIELDS})) "
+    "FROM farms_document AS src JOIN farms_farm AS farm ON farm.id = src.farm_id",
+]
+
+DROP = [
+    "DROP TABLE IF EXISTS farms_farm_search",
+    "DROP TABLE IF EXISTS farms_document_search",
+]
+
+
+def _statements(connection, statements):
+    # Mesma regra de farms.search.engine(): FTS5 trigram só a partir do SQLite 3.34
+    if connection.vendor == 'sqlite' and sqlite3.sqlite_version_info >= (3, 34):
+        return statements['sqlite']
+    if connection.vendor == 'postgresql':
+        return statements['postgresql']
+    return []
+
+
+def create_index(apps, schema_editor):
+    for sql in _statements(schema_editor.connection, {'sqlite': SQLITE_CREATE, 'postgresql': POSTGRESQL_CREATE}):
+        schema_editor.execute(sql, params=None)
+
+
+def drop_index(apps, schema_editor):
+    for sql in _statements(schema_editor.connection, {'sqlite': DROP, 'postgresql': DROP}):
+        schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0006_notification_log_retention'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,114 @@
+# Colunas normalizadas de busca (CPF só com dígitos, CAR normalizado, WhatsApp em E.164), preenchidas em lotes.
+# As regras de normalização ficam copiadas aqui, congeladas no esquema desta
+# migração: farms/normalization.py pode mudar depois sem alterar o backfill.
+
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max
+
+BATCH_SIZE = 5000
+
+NON_DIGITS_RE = re.compile(r"\D+")
+NON_ALNUM_RE = re.compile(r"[^A-Z0-9]+")
+E164_RE = re.compile(r"^\+?[1-9]\d{1,14}$")
+
+
+def only_digits(value):
+    return NON_DIGITS_RE.sub("", value or "")
+
+
+def normalize_car(value):
+    return NON_ALNUM_RE.sub("", (value or "").upper())
+
+
+def normalize_whatsapp(value, default_country_code="+55"):
+    # Mesmas regras de normalize_phone_to_e164 na época desta migração; inválido vira ''
+    value = str(value or "").strip()
+    if value.lower().startswith("whatsapp:"):
+        value = value.split(":", 1)[1].strip()
+    value = re.sub(r"[()\s\-]", "", value)
+    if not value:
+        return ""
+    if not value.startswith("+"):
+        value = f"{default_country_code}{value}"
+    return value if E164_RE.match(value) else ""
+
+
+def _backfill(model, fields, connection):
+    """
+    Preenche os campos normalizados em janelas de pk: lê só as colunas de
+    origem e grava apenas as linhas que mudaram, com um UPDATE parametrizado
+    em executemany (o CASE WHEN do bulk_update é bem mais lento em lotes grandes).
+    """
+    quote = connection.ops.quote_name
+    targets = [target for target, _ in fields.values()]
+    sql = 'UPDATE {} SET {} WHERE id = %s'.format(
+        quote(model._meta.db_table), ', '.join(f'{quote(t)} = %s' for t in targets)
+    )
+    last_pk = model.objects.aggregate(last=Max('pk'))['last'] or 0
+    for start in range(0, last_pk, BATCH_SIZE):
+        window = model.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE).values_list('pk', *fields, *targets)
+        changed = []
+        for pk, *values in window:
+            sources, current = values[:len(fields)], values[len(fields):]
+            normalized = [normalize(value) for (_, normalize), value in zip(fields.values(), sources)]
+            if normalized != current:
+                changed.append([*normalized, pk])
+        if changed:
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, changed)
+
+
+def backfill_normalized(apps, schema_editor):
+    # Os modelos históricos não têm Farm.NORMALIZED/Document.NORMALIZED: o mapeamento vem repetido aqui
+    connection = schema_editor.connection
+    _backfill(apps.get_model('farms', 'Farm'), {
+        'proprietario_cpf': ('proprietario_cpf_digits', only_digits),
+        'car_recibo': ('car_recibo_norm', normalize_car),
+    }, connection)
+    _backfill(apps.get_model('farms', 'Document'), {
+        'notify_whatsapp': ('notify_whatsapp_e164', normalize_whatsapp),
+    }, connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0007_search_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='notify_whatsapp_e164',
+            field=models.CharField(blank=True, editable=False, max_length=16),
+        ),
+        migrations.AddField(
+            model_name='farm',
+            name='car_recibo_norm',
+            field=models.CharField(blank=True, editable=False, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='farm',
+            name='proprietario_cpf_digits',
+            field=models.CharField(blank=True, editable=False, max_length=14),
+        ),
+        # Índices só depois do preenchimento: não são mantidos linha a linha durante o backfill
+        migrations.RunPython(backfill_normalized, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='document',
+            name='notify_whatsapp_e164',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=16),
+        ),
+        migrations.AddIndex(
+            model_name='farm',
+            index=models.Index(fields=['owner', 'proprietario_cpf_digits'], name='farm_owner_cpf_digits_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farm',
+            index=models.Index(fields=['owner', 'car_recibo_norm'], name='farm_owner_car_norm_idx'),
+        ),
+    ]
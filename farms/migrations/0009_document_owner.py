@@ -0,0 +1,62 @@
+# Document.owner: dono da fazenda desnormalizado, preenchido em lotes, e os índices compostos das listagens
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+BATCH_SIZE = 10000
+
+
+def backfill_owner(apps, schema_editor):
+    """Preenche Document.owner com o dono da fazenda, um UPDATE por janela de pk."""
+    Document = apps.get_model('farms', 'Document')
+    Farm = apps.get_model('farms', 'Farm')
+    last_pk = Document.objects.aggregate(last=Max('pk'))['last'] or 0
+    owner = Farm.objects.filter(pk=OuterRef('farm_id')).values('owner_id')
+    for start in range(0, last_pk, BATCH_SIZE):
+        Document.objects.filter(pk__gt=start, pk__lte=start + BATCH_SIZE).update(owner_id=Subquery(owner))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('farms', '0008_normalized_search_columns'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='document',
+            name='owner',
+            field=models.ForeignKey(
+                db_index=False, editable=False, null=True,
+                on_delete=django.db.models.deletion.CASCADE, related_name='owned_documents', to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.RunPython(backfill_owner, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='document',
+            name='owner',
+            field=models.ForeignKey(
+                blank=True, db_index=False, editable=False,
+                on_delete=django.db.models.deletion.CASCADE, related_name='owned_documents', to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', 'data_vencimento', 'id'], name='doc_owner_vencimento_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', 'nome', 'id'], name='doc_owner_nome_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='document',
+            index=models.Index(fields=['owner', 'data_emissao', 'id'], name='doc_owner_emissao_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='farm',
+            index=models.Index(fields=['owner', 'nome', 'id'], name='farm_owner_nome_idx'),
+        ),
+    ]
@@ -1,9 +1,13 @@
+from datetime import timedelta
+
 from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator
 from django.db import models
 from django.utils import timezone
 
+from .normalization import normalize_car, normalize_whatsapp, only_digits
+
 User = settings.AUTH_USER_MODEL
 
 PHONE_E164 = RegexValidator(
@@ -11,6 +15,21 @@ PHONE_E164 = RegexValidator(
     message='Informe o número em formato internacional E.164. Ex: +5511999999999'
 )
 
+
+def normalize_fields(instance, update_fields=None):
+    """
+    Preenche os campos de `instance.NORMALIZED` a partir dos de origem e
+    devolve `update_fields` com os normalizados correspondentes incluídos.
+    bulk_create/update() não passam por aqui: normalize os valores antes.
+    """
+    for source, (target, normalize) in instance.NORMALIZED.items():
+        setattr(instance, target, normalize(getattr(instance, source)))
+    if update_fields is None:
+        return None
+    update_fields = set(update_fields)
+    return update_fields | {target for source, (target, _) in instance.NORMALIZED.items() if source in update_fields}
+
+
 class Farm(models.Model):
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='farms')
     nome = models.CharField(max_length=200)
@@ -19,6 +38,17 @@ class Farm(models.Model):
     proprietario_nome = models.CharField(max_length=200)
     # Agora aceita CPF (11) ou CNPJ (14) — salvamos apenas dígitos
     proprietario_cpf = models.CharField('CPF/CNPJ', max_length=14)
+    # Formas normalizadas para os filtros (igualdade/prefixo com índice), mantidas por save()
+    proprietario_cpf_digits = models.CharField(max_length=14, blank=True, editable=False)
+    car_recibo_norm = models.CharField(max_length=100, blank=True, editable=False)
+
+    # Campo de origem -> (campo normalizado, função)
+    NORMALIZED = {
+        'proprietario_cpf': ('proprietario_cpf_digits', only_digits),
+        'car_recibo': ('car_recibo_norm', normalize_car),
+    }
+    # Campos repetidos no índice de busca dos documentos (farms/search.py, DOCUMENT_INDEX)
+    DOCUMENT_INDEXED_FIELDS = ('nome', 'matricula')
 
     class Meta:
         verbose_name = 'Fazenda'
@@ -26,10 +56,37 @@ class Farm(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['owner', 'matricula'], name='uniq_owner_matricula')
         ]
+        indexes = [
+            models.Index(fields=['owner', 'proprietario_cpf_digits'], name='farm_owner_cpf_digits_idx'),
+            models.Index(fields=['owner', 'car_recibo_norm'], name='farm_owner_car_norm_idx'),
+            # Listagem ordenada por nome (matrícula usa a uniq_owner_matricula)
+            models.Index(fields=['owner', 'nome', 'id'], name='farm_owner_nome_idx'),
+        ]
 
     def __str__(self):
         return f'{self.nome} ({self.matricula})'
 
+    def save(self, *args, **kwargs):
+        kwargs['update_fields'] = normalize_fields(self, kwargs.get('update_fields'))
+        # Dono anterior (None se nova) e se nome/matrícula mudaram: usados aqui e pelos sinais
+        # (contagens das listagens; índice de busca dos documentos, que repete esses campos)
+        self._previous_owner_id = None
+        self._documents_reindex = False
+        update_fields = kwargs['update_fields']
+        watched = {'owner', *self.DOCUMENT_INDEXED_FIELDS}
+        if not self._state.adding and self.pk and (update_fields is None or watched & set(update_fields)):
+            previous = (
+                Farm._base_manager.using(self._state.db).filter(pk=self.pk)
+                .values_list('owner_id', *self.DOCUMENT_INDEXED_FIELDS).first()
+            )
+            if previous is not None:
+                self._previous_owner_id = previous[0]
+                self._documents_reindex = [getattr(self, f) for f in self.DOCUMENT_INDEXED_FIELDS] != list(previous[1:])
+        super().save(*args, **kwargs)
+        if self._previous_owner_id is not None and self._previous_owner_id != self.owner_id:
+            # Fazenda mudou de dono: os documentos acompanham (Document.owner é desnormalizado)
+            self.documents.exclude(owner_id=self.owner_id).update(owner_id=self.owner_id)
+
 class Document(models.Model):
     TIPO_CERTIDAO = 'certidao'
     TIPO_CONTRATO = 'contrato'
@@ -43,6 +100,12 @@ class Document(models.Model):
     ]
 
     farm = models.ForeignKey(Farm, on_delete=models.CASCADE, related_name='documents')
+    # Dono da fazenda, desnormalizado para filtrar/ordenar sem junção (índices compostos abaixo).
+    # Mantido por save() e por Farm.save() quando a fazenda muda de dono; blank: preenchido no save()
+    owner = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name='owned_documents',
+        blank=True, editable=False, db_index=False,
+    )
     created_by = models.ForeignKey(User, on_delete=models.CASCADE, related_name='documents')
     nome = models.CharField(max_length=200)
     data_emissao = models.DateField()
@@ -50,15 +113,30 @@ class Document(models.Model):
     tipo = models.CharField(max_length=20, choices=TIPOS)
     notify_email = models.EmailField()
     notify_whatsapp = models.CharField(max_length=20, validators=[PHONE_E164])
+    # WhatsApp em E.164 ('' se inválido), mantido por save(); busca exata por telefone
+    notify_whatsapp_e164 = models.CharField(max_length=16, blank=True, editable=False, db_index=True)
+
+    NORMALIZED = {
+        'notify_whatsapp': ('notify_whatsapp_e164', normalize_whatsapp),
+    }
 
     class Meta:
         ordering = ['data_vencimento', 'nome']
         verbose_name = 'Documento'
         verbose_name_plural = 'Documentos'
+        indexes = [
+            # Um por coluna de DocumentListView.SORT_MAP (exceto farm__nome, da outra tabela);
+            # o id no fim atende o desempate e a paginação por cursor
+            models.Index(fields=['owner', 'data_vencimento', 'id'], name='doc_owner_vencimento_idx'),
+            models.Index(fields=['owner', 'nome', 'id'], name='doc_owner_nome_idx'),
+            models.Index(fields=['owner', 'data_emissao', 'id'], name='doc_owner_emissao_idx'),
+        ]
 
     def clean(self):
         if self.farm_id and self.created_by_id:
-            if self.farm.owner_id != self.created_by_id:
+            # Documento existente segue o dono atual (a fazenda pode ter mudado de mãos)
+            expected_owner_id = self.owner_id if self.pk and self.owner_id else self.created_by_id
+            if self.farm.owner_id != expected_owner_id:
                 raise ValidationError('Você só pode vincular documentos às suas próprias fazendas.')
         if self.data_emissao and self.data_vencimento and self.data_vencimento < self.data_emissao:
             raise ValidationError('Data de vencimento não pode ser anterior à emissão.')
@@ -66,7 +144,31 @@ class Document(models.Model):
     def __str__(self):
         return f'{self.nome} ({self.get_tipo_display()})'
 
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        kwargs['update_fields'] = normalize_fields(self, kwargs.get('update_fields'))
+        if self.farm_id:
+            self.owner_id = self.farm.owner_id
+            if kwargs['update_fields'] is not None and 'farm' in kwargs['update_fields']:
+                kwargs['update_fields'] = {*kwargs['update_fields'], 'owner'}
+        super().save(*args, **kwargs)
+        if not adding:
+            # Vencimento pode ter mudado: recalcula a data de disparo dos lembretes
+            self.sync_reminders()
+
+    def sync_reminders(self):
+        """Atualiza DocumentReminder.fire_on dos lembretes desatualizados (um bulk_update)."""
+        stale = []
+        for reminder in self.reminders.only('pk', 'days_before', 'fire_on'):
+            fire_on = DocumentReminder.fire_date(self.data_vencimento, reminder.days_before)
+            if reminder.fire_on != fire_on:
+                reminder.fire_on = fire_on
+                stale.append(reminder)
+        if stale:
+            DocumentReminder.objects.bulk_update(stale, ['fire_on'])
+
 class DocumentReminder(models.Model):
+    # Offsets oferecidos no formulário; pelo admin é possível cadastrar outros
     OPTIONS = (
         (1, '1 dia antes'),
         (3, '3 dias antes'),
@@ -74,7 +176,11 @@ class DocumentReminder(models.Model):
         (30, '1 mês antes'),
     )
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='reminders')
-    days_before = models.PositiveIntegerField(choices=OPTIONS)
+    days_before = models.PositiveIntegerField()
+    # Desnormalizado (data_vencimento - days_before) para o job diário usar índice.
+    # Mantido por save(), Document.save() e DocumentForm.save(); update() em massa
+    # de data_vencimento precisa chamar Document.sync_reminders().
+    fire_on = models.DateField(db_index=True, editable=False)
 
     class Meta:
         unique_together = ('document', 'days_before')
@@ -84,6 +190,20 @@ class DocumentReminder(models.Model):
     def __str__(self):
         return f'{self.days_before} dia(s) antes de {self.document}'
 
+    @staticmethod
+    def fire_date(data_vencimento, days_before):
+        return data_vencimento - timedelta(days=days_before)
+
+    def save(self, *args, data_vencimento=None, **kwargs):
+        # Quem já tem o vencimento em mãos o repassa; sem ele, usa o documento em cache
+        # (inline do admin, reminders do documento) e só consulta o banco se não houver
+        if data_vencimento is None:
+            data_vencimento = self.document.data_vencimento
+        self.fire_on = self.fire_date(data_vencimento, self.days_before)
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'fire_on'}
+        super().save(*args, **kwargs)
+
 class NotificationLog(models.Model):
     document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='notification_logs')
     days_before = models.PositiveIntegerField()
@@ -91,8 +211,94 @@ class NotificationLog(models.Model):
 
     class Meta:
         unique_together = ('document', 'days_before', 'sent_on')
+        indexes = [
+            # Filtro por data (admin, logged_keys) e varredura da retenção
+            models.Index(fields=['sent_on', 'document'], name='notiflog_sent_on_doc_idx'),
+        ]
         verbose_name = 'Log de Notificação'
         verbose_name_plural = 'Logs de Notificações'
 
     def __str__(self):
-        return f'Notificação {self.days_before}d para {self.document} em {self.sent_on}'
\ No newline at end of file
+        return f'Notificação {self.days_before}d para {self.document} em {self.sent_on}'
+
+class NotificationLogArchive(models.Model):
+    """
+    Logs antigos movidos por compact_notification_logs. Sem FK nem índices
+    únicos: inserção barata e independente do ciclo de vida do documento.
+    """
+    document_id = models.BigIntegerField()
+    days_before = models.PositiveIntegerField()
+    sent_on = models.DateField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Log de Notificação arquivado'
+        verbose_name_plural = 'Logs de Notificações arquivados'
+
+    def __str__(self):
+        return f'Notificação {self.days_before}d para o documento {self.document_id} em {self.sent_on}'
+
+class NotificationDailyRollup(models.Model):
+    """
+    Totais diários dos logs compactados, por offset. O log não guarda o canal:
+    email/whatsapp contam os documentos com o contato preenchido na compactação.
+    """
+    day = models.DateField()
+    days_before = models.PositiveIntegerField()
+    reminders = models.PositiveIntegerField(default=0)
+    email = models.PositiveIntegerField(default=0)
+    whatsapp = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('day', 'days_before')
+        ordering = ['-day', 'days_before']
+        verbose_name = 'Resumo diário de notificações'
+        verbose_name_plural = 'Resumos diários de notificações'
+
+    def __str__(self):
+        return f'{self.day}: {self.reminders} lembrete(s) de {self.days_before}d'
+
+class NotificationOutbox(models.Model):
+    """
+    Fila durável de notificações. O send_due_notifications (modo --enqueue)
+    insere as entradas e o process_notification_outbox as consome, com lease
+    por worker, novas tentativas com backoff exponencial e dead-letter.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_SENT = 'sent'
+    STATUS_DEAD = 'dead'
+    STATUSES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_SENT, 'Enviada'),
+        (STATUS_DEAD, 'Descartada'),
+    ]
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='outbox_entries')
+    days_before = models.PositiveIntegerField()
+    # Dia de referência do lembrete; é o sent_on gravado em NotificationLog
+    sent_on = models.DateField(default=timezone.localdate)
+    status = models.CharField(max_length=10, choices=STATUSES, default=STATUS_PENDING)
+    # Canais ainda pendentes, separados por vírgula (vazio = todos)
+    channels = models.CharField(max_length=50, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=100, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('document', 'days_before', 'sent_on')
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='outbox_status_available_idx'),
+        ]
+        verbose_name = 'Notificação na fila'
+        verbose_name_plural = 'Fila de notificações'
+
+    def __str__(self):
+        return f'Fila {self.days_before}d para {self.document} ({self.get_status_display()})'
+
+    @property
+    def channel_list(self):
+        return [c for c in self.channels.split(',') if c] or None
@@ -0,0 +1,63 @@
+""" farms/normalization.py """
+
+"""
+Formas normalizadas dos identificadores usados em filtros e buscas.
+
+Gravadas em colunas próprias (Farm.proprietario_cpf_digits,
+Farm.car_recibo_norm, Document.notify_whatsapp_e164) no save() e pela
+migração 0008, para que os filtros usem índice com igualdade/prefixo em vez
+de normalizar a coluna em cada consulta (prefix_q). As funções de
+normalização nunca levantam erro: valor que não normaliza vira ''.
+"""
+
+import re
+
+from django.db.models import Q
+
+from .services.notifications import NotificationError, normalize_phone_to_e164
+
+NON_DIGITS_RE = re.compile(r"\D+")
+NON_ALNUM_RE = re.compile(r"[^A-Z0-9]+")
+# Um telefone digitado na busca: dígitos, +, parênteses, hífen, ponto e espaço
+PHONE_QUERY_RE = re.compile(r"^\+?[\d\s().-]+$")
+# DDD + número: abaixo disso o termo é um pedaço do telefone, não o número todo
+MIN_PHONE_DIGITS = 10
+
+
+def only_digits(value):
+    """CPF/CNPJ (ou qualquer número) só com dígitos."""
+    return NON_DIGITS_RE.sub("", value or "")
+
+
+def normalize_car(value):
+    """Recibo do CAR em maiúsculas, só letras e dígitos (PA-1506187-ab12... -> PA1506187AB12...)."""
+    return NON_ALNUM_RE.sub("", (value or "").upper())
+
+
+def normalize_whatsapp(value, default_country_code="+55"):
+    """WhatsApp em E.164 (mesmas regras do envio), ou '' se vazio/inválido."""
+    if not value:
+        return ""
+    try:
+        return normalize_phone_to_e164(value, default_country_code=default_country_code)
+    except NotificationError:
+        return ""
+
+
+def phone_query(text):
+    """E.164 do termo de busca se ele for um telefone completo, senão ''."""
+    text = (text or "").strip()
+    if not PHONE_QUERY_RE.match(text) or len(only_digits(text)) < MIN_PHONE_DIGITS:
+        return ""
+    return normalize_whatsapp(text.replace(".", ""))
+
+
+def prefix_q(field, prefix):
+    """
+    Q de "`field` começa com `prefix`" como intervalo (>= prefix, < prefixo
+    seguinte). Usa o índice B-tree em qualquer banco: o LIKE 'x%' do
+    startswith não usa no SQLite (LIKE sem distinção de maiúsculas) nem no
+    PostgreSQL fora da collation C. Serve para as colunas normalizadas (ASCII).
+    """
+    upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+    return Q(**{f"{field}__gte": prefix, f"{field}__lt": upper})
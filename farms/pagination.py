@@ -0,0 +1,439 @@
+""" farms/pagination.py """
+
+"""
+Paginação por cursor (keyset) para as listagens.
+
+Em vez de OFFSET + COUNT(*), cada página parte da última linha da anterior:
+WHERE (ordem) > (valores da última linha) ... LIMIT n+1 (a linha extra diz
+se há próxima página). O custo de uma página não depende da profundidade.
+
+- A ordenação precisa terminar em `pk` (desempate único), como os
+  get_ordering() das views, e só usar campos do modelo ou de relações
+  (ex.: farm__nome) sem nulos. Ordenações por anotação/extra (relevância da
+  busca) caem na paginação por número de página.
+- O cursor (parâmetro `cursor`) é opaco e assinado: carrega a ordenação, os
+  valores da linha-limite, a direção e o número da página. Cursor inválido ou
+  de outra ordenação volta à primeira página.
+
+Total de resultados ("Página X de Y"), nos dois modos, via ResultCount:
+- em cache por (usuário, view, filtros normalizados), invalidado por versão:
+  os sinais de Farm/Document trocam a versão do dono (bump_count_version).
+  A versão vive no cache, então só vale com um cache compartilhado entre os
+  processos (arquivo, banco, Memcached, Redis); com LocMem/Dummy a contagem
+  não é guardada (um worker não veria a troca de versão feita por outro);
+- com `count_limit`, conta no máximo N+1 linhas; acima disso usa a estimativa
+  do planejador (PostgreSQL, com `count_estimate`) ou mostra "mais de N".
+"""
+
+import hashlib
+import json
+import math
+import time
+from functools import reduce
+from operator import or_
+
+from django.core import signing
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import FieldDoesNotExist
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_SALT = "farms.pagination.cursor"
+NEXT = "n"
+PREVIOUS = "p"
+
+COUNT_EXACT = "exact"
+COUNT_ESTIMATED = "estimated"
+COUNT_CAPPED = "capped"
+
+# Caches visíveis só no próprio processo: não servem para a versão das contagens
+PROCESS_LOCAL_CACHES = (LocMemCache, DummyCache)
+
+
+class _CursorSerializer(signing.JSONSerializer):
+    """JSONSerializer que aceita datas (valores de ordenação como data_vencimento)."""
+
+    def dumps(self, obj):
+        return DjangoJSONEncoder(separators=(",", ":")).encode(obj).encode("latin-1")
+
+
+def encode_cursor(ordering, values, direction, number):
+    return signing.dumps(
+        {"o": list(ordering), "v": values, "d": direction, "n": number},
+        salt=CURSOR_SALT,
+        serializer=_CursorSerializer,
+    )
+
+
+def decode_cursor(cursor, ordering):
+    """(valores, direção, número) do cursor, ou None se ausente, adulterado ou de outra ordenação."""
+    if not cursor:
+        return None
+    try:
+        data = signing.loads(cursor, salt=CURSOR_SALT)
+    except signing.BadSignature:
+        return None
+    if data.get("o") != list(ordering) or data.get("d") not in (NEXT, PREVIOUS):
+        return None
+    values = data.get("v")
+    if not isinstance(values, list) or len(values) != len(ordering):
+        return None
+    return values, data["d"], max(int(data.get("n") or 1), 1)
+
+
+def keyset_ordering(queryset):
+    """
+    Ordenação do queryset se ela servir para keyset (campos não nulos do
+    modelo ou de relações, terminando em pk/id), senão None.
+    """
+    ordering = tuple(queryset.query.order_by)
+    if not ordering or not all(isinstance(name, str) for name in ordering):
+        return None
+    if ordering[-1].lstrip("-") not in ("pk", "id"):
+        return None
+    computed = {*queryset.query.annotations, *queryset.query.extra_select}
+    for name in ordering[:-1]:
+        path = name.lstrip("-")
+        if path in computed or path.startswith("?"):
+            return None
+        opts = queryset.model._meta
+        for part in path.split("__"):
+            try:
+                field = opts.get_field(part)
+            except FieldDoesNotExist:
+                return None
+            if field.null:
+                return None
+            if field.is_relation:
+                opts = field.related_model._meta
+    return ordering
+
+
+def _after(ordering, values, reverse=False):
+    """
+    Q das linhas depois de `values` na `ordering` (antes, com `reverse`):
+    a >= x AND ((a > x) OR (a = x AND b > y) OR ...), com as comparações
+    invertidas nas colunas descendentes. O primeiro termo, isolado, deixa o
+    banco fazer uma busca por intervalo no índice da coluna de ordenação.
+    """
+    clauses, equal = [], Q()
+    for name, value in zip(ordering, values):
+        field = name.lstrip("-")
+        lookup = "lt" if name.startswith("-") != reverse else "gt"
+        clauses.append(equal & Q(**{f"{field}__{lookup}": value}))
+        equal &= Q(**{field: value})
+    first = ordering[0].lstrip("-")
+    bound = "lte" if ordering[0].startswith("-") != reverse else "gte"
+    return Q(**{f"{first}__{bound}": values[0]}) & reduce(or_, clauses)
+
+
+def _row_values(obj, ordering):
+    values = []
+    for name in ordering:
+        value = obj
+        for part in name.lstrip("-").split("__"):
+            value = getattr(value, part)
+        values.append(value)
+    return values
+
+
+# ---------- Contagem ----------
+
+
+def count_cache_enabled():
+    """Se as contagens podem ir para o cache (cache padrão compartilhado entre processos)."""
+    return not isinstance(caches["default"], PROCESS_LOCAL_CACHES)
+
+
+def _version_key(user_id):
+    return f"listcount:v:{user_id}"
+
+
+def count_version(user_id):
+    return cache.get(_version_key(user_id), 0)
+
+
+def bump_count_version(user_id):
+    """Invalida as contagens em cache das listagens de `user_id` (chamado pelos sinais)."""
+    if user_id is not None and count_cache_enabled():
+        cache.set(_version_key(user_id), time.time_ns(), None)
+
+
+def count_cache_key(user_id, scope, filters):
+    """Chave da contagem: usuário, versão atual dele, listagem e filtros normalizados."""
+    normalized = sorted((k, v) for k, v in (filters or {}).items() if v not in (None, "", [], ()))
+    digest = hashlib.sha1(json.dumps(normalized, cls=DjangoJSONEncoder).encode("utf-8")).hexdigest()
+    return f"listcount:{user_id}:{count_version(user_id)}:{scope}:{digest}"
+
+
+def planner_estimate(queryset):
+    """Linhas estimadas pelo planejador (PostgreSQL), ou None em outros bancos."""
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+    sql, params = queryset.order_by().query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN (FORMAT JSON) " + sql, params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class ResultCount:
+    """
+    Total de um queryset para a paginação: (valor, tipo), tipo COUNT_EXACT,
+    COUNT_ESTIMATED ou COUNT_CAPPED (valor = limite, há mais linhas).
+    Com `cache_key`, o resultado fica em cache por `timeout` segundos.
+    """
+
+    def __init__(self, queryset, cache_key=None, limit=None, estimate=False, timeout=300):
+        self.queryset = queryset
+        self.cache_key = cache_key
+        self.limit = limit
+        self.estimate = estimate
+        self.timeout = timeout
+
+    @cached_property
+    def result(self):
+        if self.cache_key:
+            cached = cache.get(self.cache_key)
+            if cached is not None:
+                return tuple(cached)
+        result = self._compute()
+        if self.cache_key:
+            cache.set(self.cache_key, result, self.timeout)
+        return result
+
+    def _compute(self):
+        queryset = self.queryset.order_by()
+        if not self.limit:
+            return queryset.count(), COUNT_EXACT
+        # COUNT sobre uma subconsulta com LIMIT: para de ler em N+1 linhas
+        bounded = queryset[: self.limit + 1].count()
+        if bounded <= self.limit:
+            return bounded, COUNT_EXACT
+        estimated = planner_estimate(queryset) if self.estimate else None
+        if estimated and estimated > self.limit:
+            return estimated, COUNT_ESTIMATED
+        return self.limit, COUNT_CAPPED
+
+
+class CountedMixin:
+    """Atributos de total para os templates, a partir de um ResultCount (`self.counter`)."""
+
+    counter = None
+
+    @property
+    def count_kind(self):
+        return self.counter.result[1] if self.counter else COUNT_EXACT
+
+    @property
+    def count_exact(self):
+        return self.count_kind == COUNT_EXACT
+
+    @property
+    def count_estimated(self):
+        return self.count_kind == COUNT_ESTIMATED
+
+    @property
+    def count_capped(self):
+        return self.count_kind == COUNT_CAPPED
+
+
+class CachedCountPaginator(CountedMixin, Paginator):
+    """Paginator cujo count vem de um ResultCount (cache/limite/estimativa)."""
+
+    def __init__(self, object_list, per_page, counter=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.counter = counter
+
+    @cached_property
+    def count(self):
+        if self.counter is None:
+            return super().count
+        return self.counter.result[0]
+
+    def validate_number(self, number):
+        # Total aproximado: não recusa páginas além dele (a página apenas vem vazia)
+        if self.count_exact:
+            return super().validate_number(number)
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise InvalidPage("Número de página inválido.")
+        if number < 1:
+            raise InvalidPage("Número de página inválido.")
+        return number
+
+    def page(self, number):
+        if self.count_exact:
+            return super().page(number)
+        # Total aproximado: has_next vem de uma linha a mais, não de num_pages
+        number = self.validate_number(number)
+        bottom = (number - 1) * self.per_page
+        rows = list(self.object_list[bottom:bottom + self.per_page + 1])
+        return OpenEndedPage(rows[: self.per_page], number, self, has_next=len(rows) > self.per_page)
+
+
+class OpenEndedPage(Page):
+    """Página de CachedCountPaginator com total estimado ou limitado."""
+
+    def __init__(self, object_list, number, paginator, has_next):
+        super().__init__(object_list, number, paginator)
+        self._has_next = has_next
+
+    def has_next(self):
+        return self._has_next
+
+    def end_index(self):
+        return (self.number - 1) * self.paginator.per_page + len(self.object_list)
+
+
+class CursorPage:
+    """Página de CursorPaginator, com a interface de Page usada pelos templates."""
+
+    is_cursor = True
+
+    def __init__(self, paginator, object_list, number, has_next, has_previous):
+        self.paginator = paginator
+        self.object_list = object_list
+        self.number = number
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __repr__(self):
+        return f"<CursorPage {self.number}>"
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    @property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return None
+        values = _row_values(self.object_list[-1], self.paginator.ordering)
+        return encode_cursor(self.paginator.ordering, values, NEXT, self.number + 1)
+
+    @property
+    def previous_cursor(self):
+        # Da página 2 volta-se à primeira sem cursor (link canônico, como o da listagem)
+        if not self._has_previous or not self.object_list or self.number <= 2:
+            return None
+        values = _row_values(self.object_list[0], self.paginator.ordering)
+        return encode_cursor(self.paginator.ordering, values, PREVIOUS, self.number - 1)
+
+
+class CursorPaginator(CountedMixin):
+    """
+    Pagina `queryset` (já ordenado, ver keyset_ordering) em páginas de
+    `per_page`. Total (count/num_pages) só se houver `counter`.
+    """
+
+    def __init__(self, queryset, per_page, ordering=None, counter=None):
+        self.queryset = queryset
+        self.per_page = int(per_page)
+        self.ordering = tuple(ordering or keyset_ordering(queryset) or ())
+        self.counter = counter
+        if not self.ordering:
+            raise ValueError("CursorPaginator: ordenação incompatível com keyset (deve terminar em pk).")
+
+    @property
+    def count(self):
+        return self.counter.result[0] if self.counter else None
+
+    @property
+    def num_pages(self):
+        count = self.count
+        if count is None:
+            return None
+        return max(math.ceil(count / self.per_page), 1)
+
+    def page(self, cursor=None):
+        decoded = decode_cursor(cursor, self.ordering)
+        if decoded is None:
+            rows = list(self.queryset[: self.per_page + 1])
+            return CursorPage(self, rows[: self.per_page], 1, len(rows) > self.per_page, False)
+
+        values, direction, number = decoded
+        if direction == NEXT:
+            rows = list(self.queryset.filter(_after(self.ordering, values))[: self.per_page + 1])
+            return CursorPage(self, rows[: self.per_page], number, len(rows) > self.per_page, True)
+
+        # Página anterior: percorre a ordem invertida a partir da primeira linha e desinverte
+        reversed_qs = self.queryset.filter(_after(self.ordering, values, reverse=True)).reverse()
+        rows = list(reversed_qs[: self.per_page + 1])
+        has_previous = len(rows) > self.per_page
+        rows = rows[: self.per_page][::-1]
+        return CursorPage(self, rows, number if has_previous else 1, True, has_previous)
+
+
+class CursorPaginationMixin:
+    """
+    Para ListView: pagina por cursor quando a ordenação do queryset permite
+    (keyset_ordering), senão usa a paginação padrão por número de página.
+    Links antigos com `page` (sem `cursor`) continuam na paginação padrão.
+
+    Total nos dois modos via ResultCount, em cache por usuário e filtros
+    (get_count_filters). `count_limit` = None conta sempre exato; com limite,
+    acima dele usa a estimativa do planejador (`count_estimate`, PostgreSQL)
+    ou "mais de N".
+    """
+
+    cursor_param = "cursor"
+    count_limit = None
+    count_estimate = False
+    count_cache_timeout = 300
+
+    def get_count_filters(self):
+        """Filtros que definem o conjunto (não a ordem nem a página), já normalizados."""
+        form = getattr(self, "filter_form", None)
+        if form is not None and form.is_bound and form.is_valid():
+            return dict(form.cleaned_data)
+        ignored = {self.page_kwarg, self.cursor_param, "sort", "dir"}
+        return {k: self.request.GET.getlist(k) for k in self.request.GET if k not in ignored}
+
+    def get_counter(self, queryset):
+        user = self.request.user
+        cache_key = None
+        if user.is_authenticated and count_cache_enabled():
+            scope = f"{self.__class__.__module__}.{self.__class__.__name__}"
+            # O limite entra no escopo: o resultado guardado depende dele
+            scope = f"{scope}:{self.count_limit or 0}"
+            cache_key = count_cache_key(user.pk, scope, self.get_count_filters())
+        return ResultCount(
+            queryset, cache_key=cache_key, limit=self.count_limit,
+            estimate=self.count_estimate, timeout=self.count_cache_timeout,
+        )
+
+    def get_paginator(self, queryset, per_page, orphans=0, allow_empty_first_page=True, **kwargs):
+        return CachedCountPaginator(
+            queryset, per_page, counter=self.get_counter(queryset), orphans=orphans,
+            allow_empty_first_page=allow_empty_first_page, **kwargs,
+        )
+
+    def paginate_queryset(self, queryset, page_size):
+        ordering = keyset_ordering(queryset)
+        legacy = self.page_kwarg in self.request.GET and self.cursor_param not in self.request.GET
+        if ordering is None or legacy:
+            return super().paginate_queryset(queryset, page_size)
+        paginator = CursorPaginator(queryset, page_size, ordering, counter=self.get_counter(queryset))
+        page = paginator.page(self.request.GET.get(self.cursor_param))
+        return paginator, page, page.object_list, page.has_other_pages()
@@ -0,0 +1,281 @@
+""" farms/search.py """
+
+"""
+Índice de busca textual das listagens (filtro `q` de fazendas e documentos).
+
+- SQLite (>= 3.34): tabelas virtuais FTS5 com tokenizer trigram. Casam
+  substrings sem diferenciar maiúsculas, como o icontains, mas pelo índice.
+- PostgreSQL: tabela auxiliar com o texto concatenado (GIN trigram, usado
+  pelo ILIKE) e um tsvector (GIN) para a ordenação por relevância.
+- Outros bancos, ou buscas com menos de 3 caracteres: filter() devolve None
+  e as views usam o icontains de antes.
+
+As linhas são montadas no banco (INSERT ... SELECT), então indexar um
+objeto, os documentos de uma fazenda ou a tabela inteira custa o mesmo
+número de comandos. Os sinais de farms/signals.py mantêm o índice em
+save/delete; cargas em massa (bulk_create, update()) precisam de
+`python manage.py rebuild_search_index`.
+"""
+
+import sqlite3
+
+from django.db import connection as default_connection, connections
+from django.db.models.expressions import RawSQL
+
+from .models import Document, Farm
+from .normalization import only_digits
+
+# O trigram não casa termos com menos de 3 caracteres
+MIN_QUERY_LENGTH = 3
+# Caracteres de um CPF/CNPJ digitado com pontuação
+DOCUMENT_NUMBER_CHARS = "0123456789.-/ "
+# Configuração do to_tsvector/plainto_tsquery no PostgreSQL
+PG_TS_CONFIG = "portuguese"
+
+SQLITE = "sqlite"
+POSTGRESQL = "postgresql"
+
+
+def engine(connection=None):
+    """Motor de busca disponível no banco da conexão: SQLITE, POSTGRESQL ou None."""
+    connection = connection or default_connection
+    if connection.vendor == "sqlite" and sqlite3.sqlite_version_info >= (3, 34):
+        return SQLITE
+    if connection.vendor == "postgresql":
+        return POSTGRESQL
+    return None
+
+
+class SearchIndex:
+    """
+    Índice de um modelo. `columns` mapeia coluna do índice -> expressão SQL
+    sobre `source` (alias `src` para a tabela do modelo); `digits` é
+    (coluna do índice, coluna de origem) só com dígitos, buscada com os
+    dígitos do termo (CPF com ou sem pontuação); `scope` é uma coluna de
+    origem guardada para reindexar por grupo.
+    """
+
+    def __init__(self, model, table, columns, source=None, digits=None, scope=None):
+        self.model = model
+        self.table = table
+        self.columns = columns
+        self.source = source or f"{model._meta.db_table} AS src"
+        self.digits, self.digits_source = digits or (None, None)
+        self.scope = scope
+
+    # ---------- DDL ----------
+
+    def create(self, connection):
+        kind = engine(connection)
+        with connection.cursor() as cursor:
+            if kind == SQLITE:
+                columns = [*self.columns, *([self.digits] if self.digits else [])]
+                if self.scope:
+                    columns.append(f"{self.scope} UNINDEXED")
+                cursor.execute(
+                    f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} "
+                    f"USING fts5({', '.join(columns)}, tokenize='trigram')"
+                )
+            elif kind == POSTGRESQL:
+                cursor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                cursor.execute(
+                    f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                    f"object_id bigint PRIMARY KEY REFERENCES {self.model._meta.db_table} (id) "
+                    f"ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED, "
+                    f"scope_id bigint NULL, body text NOT NULL, digits text NOT NULL, vector tsvector NOT NULL)"
+                )
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_body_trgm ON {self.table} USING gin (body gin_trgm_ops)")
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_digits_trgm ON {self.table} USING gin (digits gin_trgm_ops)")
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_vector ON {self.table} USING gin (vector)")
+                cursor.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_scope ON {self.table} (scope_id)")
+
+    def drop(self, connection):
+        if engine(connection):
+            with connection.cursor() as cursor:
+                cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    # ---------- Escrita ----------
+
+    def _key(self, kind):
+        return "rowid" if kind == SQLITE else "object_id"
+
+    def _insert_sql(self, kind, where):
+        expressions = list(self.columns.values())
+        if kind == SQLITE:
+            targets = ["rowid", *self.columns]
+            values = ["src.id", *expressions]
+            if self.digits:
+                targets.append(self.digits)
+                values.append(self._digits_sql(kind))
+            if self.scope:
+                targets.append(self.scope)
+                values.append(f"src.{self.scope}")
+        else:
+            # Separador invisível: um termo não casa "atravessando" dois campos
+            targets = ["object_id", "scope_id", "body", "digits", "vector"]
+            values = [
+                "src.id",
+                f"src.{self.scope}" if self.scope else "NULL",
+                f"concat_ws(chr(31), {', '.join(expressions)})",
+                self._digits_sql(kind) if self.digits else "''",
+                f"to_tsvector('{PG_TS_CONFIG}', concat_ws(' ', {', '.join(expressions)}))",
+            ]
+        return (
+            f"INSERT INTO {self.table} ({', '.join(targets)}) "
+            f"SELECT {', '.join(values)} FROM {self.source} WHERE {where}"
+        )
+
+    def _digits_sql(self, kind):
+        column = f"src.{self.digits_source}"
+        if kind == SQLITE:
+            return f"REPLACE(REPLACE(REPLACE(REPLACE({column}, '.', ''), '-', ''), '/', ''), ' ', '')"
+        return f"regexp_replace({column}, '[^0-9]', '', 'g')"
+
+    def refresh(self, pks=None, scope_id=None, connection=None):
+        """Reindexa os objetos `pks`, os do grupo `scope_id` ou, sem argumentos, todos."""
+        connection = connection or default_connection
+        kind = engine(connection)
+        if not kind:
+            return
+        key = self._key(kind)
+        if pks is not None:
+            pks = list(pks)
+            if not pks:
+                return
+            placeholders = ", ".join(["%s"] * len(pks))
+            delete, where, params = f"{key} IN ({placeholders})", f"src.id IN ({placeholders})", pks
+        elif scope_id is not None:
+            column = self.scope if kind == SQLITE else "scope_id"
+            delete, where, params = f"{column} = %s", f"src.{self.scope} = %s", [scope_id]
+        else:
+            delete, where, params = "1 = 1", "1 = 1", []
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {self.table} WHERE {delete}", params)
+            cursor.execute(self._insert_sql(kind, where), params)
+
+    def remove(self, pks, connection=None):
+        connection = connection or default_connection
+        kind = engine(connection)
+        pks = list(pks)
+        if not kind or not pks:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {self.table} WHERE {self._key(kind)} IN ({', '.join(['%s'] * len(pks))})", pks
+            )
+
+    # ---------- Consulta ----------
+
+    def filter(self, queryset, text, rank=False):
+        """
+        Restringe `queryset` aos objetos que contêm `text` em algum campo (ou,
+        se `text` for um número de documento, cujos dígitos o contêm). Com
+        `rank`, anota `search_rank` (maior = mais relevante). None se o índice
+        não se aplica (banco sem suporte ou termo curto demais).
+        """
+        text = (text or "").strip()
+        kind = engine(connections[queryset.db])
+        digits = query_digits(text) if self.digits else ""
+        if not kind or len(text) < MIN_QUERY_LENGTH or 0 < len(digits) < MIN_QUERY_LENGTH:
+            return None
+        table = self.table
+        outer = f'"{self.model._meta.db_table}"."id"'
+
+        if kind == SQLITE:
+            match = _fts_phrase(text)
+            if digits and digits != text:
+                match += f" OR {self.digits} : {_fts_phrase(digits)}"
+            if not rank:
+                return queryset.filter(pk__in=RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [match]))
+            # Junção com a tabela FTS: o bm25 (rank, negativo: menor = melhor) sai da própria busca,
+            # já que uma subconsulta correlacionada refaria o MATCH para cada linha. O "+" impede
+            # o rowid de servir de índice e força a FTS como laço externo; sem estatísticas o
+            # SQLite preferiria varrer as fazendas do usuário e sondar a FTS linha a linha.
+            return queryset.extra(
+                select={"search_rank": f"-{table}.rank"},
+                tables=[table],
+                where=[f"{table} MATCH %s", f"+{table}.rowid = {outer}"],
+                params=[match],
+            )
+
+        condition, params = f"{table}.body ILIKE %s", [f"%{_like_escape(text)}%"]
+        if digits:
+            condition += f" OR {table}.digits LIKE %s"
+            params.append(f"%{digits}%")
+        if not rank:
+            return queryset.filter(pk__in=RawSQL(f"SELECT object_id FROM {table} WHERE {condition}", params))
+        return queryset.extra(
+            select={"search_rank": (
+                f"ts_rank({table}.vector, plainto_tsquery('{PG_TS_CONFIG}', %s)) + word_similarity(%s, {table}.body)"
+            )},
+            select_params=[text, text],
+            tables=[table],
+            where=[f"({condition})", f"{table}.object_id = {outer}"],
+            params=params,
+        )
+
+
+def query_digits(text):
+    """Dígitos do termo se ele for um número de documento (só dígitos e . - / espaço), senão ''."""
+    if text and not text.strip(DOCUMENT_NUMBER_CHARS):
+        return only_digits(text)
+    return ""
+
+
+def _fts_phrase(text):
+    """Termo como frase FTS5 (aspas dobradas): casa a substring literal, sem operadores."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def _like_escape(text):
+    return text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+FARM_INDEX = SearchIndex(
+    Farm,
+    "farms_farm_search",
+    {
+        "nome": "src.nome",
+        "matricula": "src.matricula",
+        "car_recibo": "COALESCE(src.car_recibo, '')",
+        "proprietario_nome": "src.proprietario_nome",
+        "proprietario_cpf": "src.proprietario_cpf",
+    },
+    digits=("cpf_digits", "proprietario_cpf"),
+)
+
+DOCUMENT_INDEX = SearchIndex(
+    Document,
+    "farms_document_search",
+    {
+        "nome": "src.nome",
+        "tipo": "src.tipo",
+        "farm_nome": "farm.nome",
+        "farm_matricula": "farm.matricula",
+        "notify_email": "src.notify_email",
+        "notify_whatsapp": "src.notify_whatsapp",
+    },
+    source=f"{Document._meta.db_table} AS src JOIN {Farm._meta.db_table} AS farm ON farm.id = src.farm_id",
+    scope="farm_id",
+)
+
+INDEXES = (FARM_INDEX, DOCUMENT_INDEX)
+
+
+def install(connection=None):
+    """Cria as tabelas do índice e indexa o que já existe (usado pela migração)."""
+    connection = connection or default_connection
+    for index in INDEXES:
+        index.create(connection)
+        index.refresh(connection=connection)
+
+
+def uninstall(connection=None):
+    connection = connection or default_connection
+    for index in INDEXES:
+        index.drop(connection)
+
+
+def rebuild(connection=None):
+    for index in INDEXES:
+        index.refresh(connection=connection)
@@ -0,0 +1,205 @@
+""" farms/services/fake_providers.py """
+
+"""
+Provedores falsos locais para medir o pipeline de notificações sem
+credenciais reais (usados pelo comando bench_notifications).
+
+- SmtpSink: servidor SMTP mínimo que aceita e descarta as mensagens.
+- FakeTwilioServer: stand-in HTTP da API de mensagens do Twilio
+  (POST .../Messages.json), apontado via settings.TWILIO_API_BASE_URL.
+
+Ambos simulam latência por mensagem, falhas (SMTP 554 / HTTP 500) e
+throttling (SMTP 451 / HTTP 429 com Retry-After, em segundos) em taxas configuráveis, e
+contam o que receberam. Escutam só em 127.0.0.1, em porta livre.
+"""
+
+import itertools
+import json
+import random
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeProviderStats:
+    """Contadores thread-safe de um provedor falso."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.connections = 0
+        self.messages = 0
+        self.errors = 0
+        self.throttled = 0
+
+    def incr(self, field):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + 1)
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "connections": self.connections,
+                "messages": self.messages,
+                "errors": self.errors,
+                "throttled": self.throttled,
+            }
+
+
+class _FakeProvider:
+    """Base: thread do servidor, sorteio de falhas/throttling e uso como context manager."""
+
+    def __init__(self, latency=0.0, error_rate=0.0, throttle_rate=0.0, seed=None, retry_after=1):
+        self.latency = latency
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.stats = FakeProviderStats()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._server = None
+
+    def outcome(self):
+        """'ok', 'error' ou 'throttled' para a próxima mensagem."""
+        with self._random_lock:
+            roll = self._random.random()
+        if roll < self.throttle_rate:
+            return "throttled"
+        if roll < self.throttle_rate + self.error_rate:
+            return "error"
+        return "ok"
+
+    def _make_server(self):
+        raise NotImplementedError
+
+    def start(self):
+        self._server = self._make_server()
+        self._server.daemon_threads = True
+        self._server.provider = self
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _SmtpHandler(socketserver.StreamRequestHandler):
+    # Respostas pequenas em sequência: sem Nagle, o ACK atrasado do cliente não entra na latência medida
+    disable_nagle_algorithm = True
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        provider = self.server.provider
+        provider.stats.incr("connections")
+        self.reply("220 localhost SmtpSink")
+        in_data = False
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            if in_data:
+                if line.rstrip(b"\r\n") != b".":
+                    continue
+                in_data = False
+                time.sleep(provider.latency)
+                outcome = provider.outcome()
+                if outcome == "throttled":
+                    provider.stats.incr("throttled")
+                    self.reply("451 4.7.1 SmtpSink: limite simulado, tente depois")
+                elif outcome == "error":
+                    provider.stats.incr("errors")
+                    self.reply("554 5.0.0 SmtpSink: falha simulada")
+                else:
+                    provider.stats.incr("messages")
+                    self.reply("250 2.0.0 OK")
+                continue
+            command = line[:4].upper()
+            if command in (b"EHLO", b"HELO"):
+                self.reply("250-localhost")
+                self.reply("250 8BITMIME")
+            elif command == b"DATA":
+                in_data = True
+                self.reply("354 Fim com <CRLF>.<CRLF>")
+            elif command == b"QUIT":
+                self.reply("221 2.0.0 Tchau")
+                return
+            else:  # MAIL, RCPT, RSET, NOOP...
+                self.reply("250 2.0.0 OK")
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+
+
+class SmtpSink(_FakeProvider):
+    """SMTP local sem TLS/autenticação: EMAIL_HOST=127.0.0.1, EMAIL_PORT=sink.port."""
+
+    def _make_server(self):
+        return _ThreadingTCPServer(("127.0.0.1", 0), _SmtpHandler)
+
+
+class _TwilioHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como a API real
+    disable_nagle_algorithm = True
+    _sids = itertools.count(1)
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        super().setup()
+        self.server.provider.stats.incr("connections")
+
+    def send_json(self, status, payload, headers=()):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        provider = self.server.provider
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if not self.path.endswith("/Messages.json"):
+            self.send_json(404, {"code": 20404, "message": "Not Found", "status": 404})
+            return
+        time.sleep(provider.latency)
+        outcome = provider.outcome()
+        if outcome == "throttled":
+            provider.stats.incr("throttled")
+            self.send_json(429, {"code": 20429, "message": "Too Many Requests", "status": 429}, [("Retry-After", str(provider.retry_after))])
+        elif outcome == "error":
+            provider.stats.incr("errors")
+            self.send_json(500, {"code": 20500, "message": "Falha simulada", "status": 500})
+        else:
+            provider.stats.incr("messages")
+            self.send_json(201, {"sid": f"SM{next(self._sids):032x}", "status": "queued"})
+
+
+class FakeTwilioServer(_FakeProvider):
+    """Stand-in da API do Twilio: TWILIO_API_BASE_URL=server.url (qualquer SID/token)."""
+
+    def _make_server(self):
+        return ThreadingHTTPServer(("127.0.0.1", 0), _TwilioHandler)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.port}"
@@ -0,0 +1,257 @@
+""" farms/services/metrics.py """
+
+"""
+Métricas do pipeline de notificações, acumuladas no processo.
+
+- Contadores de eventos (enviadas, falhas, puladas, adiadas...), opcionalmente
+  por canal.
+- Tempo acumulado por fase (varredura do banco, montagem das mensagens,
+  gravação do log...).
+- Latência de cada chamada ao provedor por canal: histograma cumulativo
+  (buckets fixos, para o Prometheus) e amostras recentes para p50/p95/p99.
+- Pico de memória do tracemalloc, quando ligado (custa CPU; só sob demanda).
+
+Os ganchos ficam em farms/services/notifications.py, então tudo que passa
+pelos provedores é medido. Ao fim de cada execução os comandos gravam um
+relatório JSON e um arquivo para o textfile collector do node_exporter em
+settings.NOTIFICATION_METRICS_DIR. O envio de teste da interface web usa um
+registro próprio (`test_metrics`, acumulado desde o início do processo) e
+grava o job TEST_SEND_JOB no mesmo diretório a cada envio; com vários
+workers web, o arquivo traz os números do último processo que enviou.
+"""
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Limites (s) dos buckets do histograma de latência
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Amostras mantidas por canal para os percentis (processos longos não crescem sem limite)
+MAX_SAMPLES = 10000
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Percentil por posto mais próximo de uma lista já ordenada."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class NotificationMetrics:
+    """Registro thread-safe de contadores, fases e latências."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = time.time()
+            self.counters = defaultdict(int)  # (evento, canal) -> n
+            self.phases = defaultdict(float)  # fase -> segundos
+            self.samples = defaultdict(lambda: deque(maxlen=MAX_SAMPLES))  # canal -> latências recentes
+            self.buckets = defaultdict(lambda: [0] * len(LATENCY_BUCKETS))  # canal -> contagem por bucket
+            self.latency_sum = defaultdict(float)
+            self.latency_count = defaultdict(int)
+
+    def incr(self, event, channel="", n=1):
+        if n:
+            with self._lock:
+                self.counters[(event, channel)] += n
+
+    def add_phase(self, name, seconds):
+        with self._lock:
+            self.phases[name] += seconds
+
+    @contextmanager
+    def phase(self, name):
+        """Acumula o tempo do bloco na fase `name`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase(name, time.perf_counter() - start)
+
+    def timed_iter(self, name, iterable):
+        """Repassa os itens de `iterable` somando à fase `name` o tempo gasto em cada next()."""
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_phase(name, time.perf_counter() - start)
+                return
+            self.add_phase(name, time.perf_counter() - start)
+            yield item
+
+    def observe(self, channel, seconds, ok=True):
+        """Registra uma chamada ao provedor do canal."""
+        with self._lock:
+            self.samples[channel].append(seconds)
+            self.latency_sum[channel] += seconds
+            self.latency_count[channel] += 1
+            counts = self.buckets[channel]
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if seconds <= bound:
+                    counts[i] += 1
+            self.counters[("provider_ok" if ok else "provider_error", channel)] += 1
+
+    @contextmanager
+    def track(self, channel):
+        """Mede a chamada ao provedor do bloco; exceção conta como erro e é repassada."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.observe(channel, time.perf_counter() - start, ok=False)
+            raise
+        self.observe(channel, time.perf_counter() - start)
+
+    def snapshot(self):
+        """Estado atual como dicionário serializável."""
+        with self._lock:
+            latency = {}
+            for channel, samples in self.samples.items():
+                ordered = sorted(samples)
+                latency[channel] = {
+                    "count": self.latency_count[channel],
+                    "sum": round(self.latency_sum[channel], 6),
+                    "max": round(ordered[-1], 6) if ordered else None,
+                    **{f"p{p}": round(percentile(ordered, p), 6) for p in PERCENTILES if ordered},
+                    "buckets": dict(zip(map(str, LATENCY_BUCKETS), self.buckets[channel])),
+                }
+            counters = defaultdict(dict)
+            for (event, channel), value in sorted(self.counters.items()):
+                counters[event][channel or "total"] = value
+            data = {
+                "started_at": self.started_at,
+                "finished_at": time.time(),
+                "counters": dict(counters),
+                "phases": {name: round(seconds, 6) for name, seconds in sorted(self.phases.items())},
+                "latency": latency,
+            }
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            data["tracemalloc"] = {"current_bytes": current, "peak_bytes": peak}
+        return data
+
+
+metrics = NotificationMetrics()
+# Envio de teste da interface web: fora do reset()/relatório das execuções dos comandos
+test_metrics = NotificationMetrics()
+TEST_SEND_JOB = "notification_test"
+
+
+def peak_rss_mb():
+    """Pico de memória residente do processo em MB (None se indisponível)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss vem em KB no Linux e em bytes no macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _atomic_write(path, content):
+    # Escreve num temporário do mesmo diretório e renomeia: o collector nunca lê arquivo pela metade
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as fh:
+            fh.write(content)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def prometheus_text(data, job, extra=None):
+    """Formato de exposição do Prometheus (textfile collector) para um snapshot()."""
+    job = _label(job)
+    lines = [
+        "# HELP agrodocs_notification_events Eventos da última execução (enviadas, falhas, puladas...).",
+        "# TYPE agrodocs_notification_events gauge",
+    ]
+    for event, by_channel in data["counters"].items():
+        for channel, value in by_channel.items():
+            lines.append(
+                f'agrodocs_notification_events{{job="{job}",event="{_label(event)}",channel="{_label(channel)}"}} {value}'
+            )
+    lines += [
+        "# HELP agrodocs_notification_phase_seconds Tempo acumulado por fase na última execução.",
+        "# TYPE agrodocs_notification_phase_seconds gauge",
+    ]
+    for name, seconds in data["phases"].items():
+        lines.append(f'agrodocs_notification_phase_seconds{{job="{job}",phase="{_label(name)}"}} {seconds}')
+    lines += [
+        "# HELP agrodocs_notification_provider_latency_seconds Latência das chamadas ao provedor por canal.",
+        "# TYPE agrodocs_notification_provider_latency_seconds histogram",
+    ]
+    for channel, stats in data["latency"].items():
+        labels = f'job="{job}",channel="{_label(channel)}"'
+        for bound, count in stats["buckets"].items():
+            lines.append(f'agrodocs_notification_provider_latency_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'agrodocs_notification_provider_latency_seconds_bucket{{{labels},le="+Inf"}} {stats["count"]}')
+        lines.append(f'agrodocs_notification_provider_latency_seconds_sum{{{labels}}} {stats["sum"]}')
+        lines.append(f'agrodocs_notification_provider_latency_seconds_count{{{labels}}} {stats["count"]}')
+    lines += [
+        "# HELP agrodocs_notification_provider_latency_quantile_seconds Percentis das amostras recentes de latência.",
+        "# TYPE agrodocs_notification_provider_latency_quantile_seconds gauge",
+    ]
+    for channel, stats in data["latency"].items():
+        for p in PERCENTILES:
+            if f"p{p}" in stats:
+                lines.append(
+                    f'agrodocs_notification_provider_latency_quantile_seconds'
+                    f'{{job="{job}",channel="{_label(channel)}",quantile="{p / 100}"}} {stats[f"p{p}"]}'
+                )
+    gauges = {
+        "agrodocs_notification_last_run_timestamp_seconds": data["finished_at"],
+        "agrodocs_notification_run_duration_seconds": data["finished_at"] - data["started_at"],
+    }
+    if "tracemalloc" in data:
+        gauges["agrodocs_notification_tracemalloc_peak_bytes"] = data["tracemalloc"]["peak_bytes"]
+    gauges.update(extra or {})
+    for name, value in gauges.items():
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f'{name}{{job="{job}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_run_metrics(job, directory=None, extra=None, registry=None):
+    """
+    Grava `<dir>/<job>.json` e `<dir>/<job>.prom` com o snapshot atual de
+    `registry` (padrão: `metrics`).
+    `directory` padrão: settings.NOTIFICATION_METRICS_DIR (vazio = não grava).
+    `extra` acrescenta gauges ao .prom (e ao JSON). Retorna o snapshot.
+    """
+    data = (registry or metrics).snapshot()
+    data["job"] = job
+    if extra:
+        data["gauges"] = extra
+    directory = directory or getattr(settings, "NOTIFICATION_METRICS_DIR", "")
+    if directory:
+        _atomic_write(os.path.join(directory, f"{job}.json"), json.dumps(data, indent=2))
+        _atomic_write(os.path.join(directory, f"{job}.prom"), prometheus_text(data, job, extra))
+    return data
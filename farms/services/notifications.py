@@ -2,14 +2,28 @@
 
 import logging
 import re
+import smtplib
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
 from typing import Optional
 
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage, get_connection, send_mail
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+from twilio.base.exceptions import TwilioRestException
+from twilio.http.http_client import TwilioHttpClient
 from twilio.rest import Client
 
+from .metrics import TEST_SEND_JOB, metrics, test_metrics, write_run_metrics
+from .throttle import ProviderThrottledError, call_with_rate_limit, get_rate_limiter, parse_retry_after, throttle_info
+
 logger = logging.getLogger(__name__)
 
 
@@ -21,40 +35,194 @@ class NotConfiguredError(NotificationError):
     """Indica que a integração não está configurada (ex.: credenciais do Twilio ausentes)."""
 
 
+class CircuitOpenError(NotificationError):
+    """O circuito do canal está aberto: o envio foi recusado sem chamar o provedor (adiado)."""
+
+    def __init__(self, channel: str, retry_after: float):
+        super().__init__(f"Canal {channel} temporariamente suspenso (circuito aberto).")
+        self.channel = channel
+        self.retry_after = retry_after
+
+
+CHANNEL_EMAIL = "email"
+CHANNEL_WHATSAPP = "whatsapp"
+
+
 # ==========
 # EXISTENTES
 # ==========
 
 def send_document_email(document, subject, message):
-    recipient = document.notify_email
-    send_mail(
+    """Envia um e-mail pelo mesmo caminho dos lotes (limitador de taxa e circuit breaker do canal)."""
+    error, = send_email_batch([build_document_email(document, subject, message)])
+    if error is not None:
+        raise error
+
+
+def build_document_email(document, subject, message) -> EmailMessage:
+    return EmailMessage(
         subject=subject,
-        message=message,
+        body=message,
         from_email=settings.DEFAULT_FROM_EMAIL,
-        recipient_list=[recipient],
-        fail_silently=False,
+        to=[document.notify_email],
     )
 
 
+# Falhas antes do DATA (conexão, HELO, MAIL): o servidor ainda não aceitou nada e reenviar é seguro.
+# Recusas explícitas do DATA ou do destinatário não adiantam repetir (throttling fica com o limitador).
+SMTP_NOT_RETRIED = (smtplib.SMTPRecipientsRefused, smtplib.SMTPDataError)
+
+
+def send_email_batch(messages, limiter=None):
+    """
+    Envia uma lista de EmailMessage reaproveitando UMA conexão SMTP
+    (get_connection() aberta no primeiro envio; send_messages() não reabre).
+    Depois de uma falha a conexão é descartada e o envio seguinte abre outra,
+    sempre dentro do circuit breaker. O envio só é repetido (uma vez,
+    pelo limitador) se a falha veio antes do DATA: uma queda depois dele pode
+    ter ocorrido após o 250 do servidor, e repetir duplicaria a mensagem.
+    Respostas de throttling do relay ficam a cargo do limitador do canal.
+    Retorna uma lista alinhada a `messages` com None (sucesso) ou a exceção.
+    """
+    limiter = limiter or get_rate_limiter(CHANNEL_EMAIL)
+    results = []
+    connection = get_connection(fail_silently=False)
+    # O smtplib passou ao DATA no envio corrente?
+    stage = {"data": False}
+
+    def open_connection():
+        connection.open()
+        smtp = getattr(connection, "connection", None)
+        if isinstance(smtp, smtplib.SMTP):
+            data = smtp.data
+
+            def tracked_data(msg):
+                stage["data"] = True
+                return data(msg)
+
+            smtp.data = tracked_data
+
+    def reconnect():
+        # Só descarta a conexão: a nova é aberta pelo próximo envio
+        nonlocal connection
+        try:
+            connection.close()
+        except Exception:
+            pass
+        connection = get_connection(fail_silently=False)
+
+    def send_one(msg):
+        stage["data"] = False
+        try:
+            if getattr(connection, "connection", False) is None:
+                # Primeiro envio do lote ou depois de uma falha: abre com o rastreio do DATA
+                open_connection()
+            with metrics.track(CHANNEL_EMAIL):
+                connection.send_messages([msg])
+        except Exception:
+            logger.warning("Falha no envio SMTP; reconectando", exc_info=True)
+            reconnect()
+            raise
+
+    def deliver(msg):
+        try:
+            return call_with_rate_limit(limiter, send_one, msg)
+        except Exception as e:
+            if stage["data"] or throttle_info(e)[0] or isinstance(e, SMTP_NOT_RETRIED) or not isinstance(e, OSError):
+                raise
+        # Nada foi aceito pelo servidor: nova tentativa, numa conexão nova
+        return call_with_rate_limit(limiter, send_one, msg)
+
+    breaker = get_circuit_breaker(CHANNEL_EMAIL)
+    try:
+        # A conexão é aberta no primeiro envio, dentro do breaker: com o circuito aberto nem
+        # conecta, e a prova do half_open só fecha o circuito se uma mensagem for aceita
+        for msg in messages:
+            try:
+                breaker.call(deliver, msg)
+            except Exception as e:
+                results.append(e)
+                continue
+            results.append(None)
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return results
+
+
 def send_document_whatsapp(document, message):
     if not settings.TWILIO_ACCOUNT_SID or not settings.TWILIO_AUTH_TOKEN:
         # Twilio não configurado; apenas ignore ou logue em produção
         return
-    client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
     to = normalize_phone_to_e164(document.notify_whatsapp, default_country_code="+55")
-    client.messages.create(
-        from_=settings.TWILIO_WHATSAPP_FROM,
-        to=f"whatsapp:{to}",
-        body=message
-    )
+    send_whatsapp_message(to, message)
+
+
+def send_whatsapp_message(to_e164, message):
+    """
+    Envia para um número já em E.164, dividindo corpos acima do limite do
+    WhatsApp. Cada parte passa pelo circuit breaker e pelo limitador de taxa
+    do canal.
+    """
+    client = get_twilio_client()
+    limiter = get_rate_limiter(CHANNEL_WHATSAPP)
+    breaker = get_circuit_breaker(CHANNEL_WHATSAPP)
+
+    def create(part):
+        with metrics.track(CHANNEL_WHATSAPP):
+            return client.messages.create(
+                from_=settings.TWILIO_WHATSAPP_FROM,
+                to=f"whatsapp:{to_e164}",
+                body=part
+            )
+
+    for part in split_whatsapp_body(message):
+        breaker.call(call_with_rate_limit, limiter, create, part)
+
+
+WHATSAPP_MAX_BODY = 1600
+
+
+def split_whatsapp_body(message, limit=WHATSAPP_MAX_BODY):
+    """Divide o texto em partes de até `limit` caracteres, preferindo quebras de linha."""
+    if len(message) <= limit:
+        return [message]
+    parts = []
+    current = ""
+    for line in message.splitlines(keepends=True):
+        while len(line) > limit:
+            # Linha maior que o limite: corta no limite
+            if current:
+                parts.append(current)
+                current = ""
+            parts.append(line[:limit])
+            line = line[limit:]
+        if len(current) + len(line) > limit:
+            parts.append(current)
+            current = ""
+        current += line
+    if current:
+        parts.append(current)
+    return parts
+
+
+def due_phrase(days):
+    """'vence em N dia(s)' / 'vence hoje' / 'venceu há N dia(s)' (envio atrasado depois do vencimento)."""
+    if days > 0:
+        return f'vence em {days} dia(s)'
+    if days == 0:
+        return 'vence hoje'
+    return f'venceu há {-days} dia(s)'
 
 
 def build_notification_messages(document, days_before):
-    subject = f'Lembrete: "{document.nome}" vence em {days_before} dia(s)'
+    subject = f'Lembrete: "{document.nome}" {due_phrase(days_before)}'
     message = (
         f'Olá,\n\n'
         f'O documento "{document.nome}" ({document.get_tipo_display()}) da fazenda "{document.farm.nome}" '
-        f'vence em {days_before} dia(s), na data {document.data_vencimento.strftime("%d/%m/%Y")}.\n\n'
+        f'{due_phrase(days_before)}, na data {document.data_vencimento.strftime("%d/%m/%Y")}.\n\n'
         f'Proprietário: {document.farm.proprietario_nome} (CPF: {document.farm.proprietario_cpf})\n'
         f'Matrícula: {document.farm.matricula}\n\n'
         f'AgroDocs'
@@ -62,12 +230,342 @@ def build_notification_messages(document, days_before):
     return subject, message
 
 
+def build_digest_messages(items):
+    """
+    Monta (subject, message) de um digest com vários (document, days_before)
+    do mesmo destinatário. Com um único item, usa a mensagem individual.
+    """
+    if len(items) == 1:
+        return build_notification_messages(*items[0])
+    items = sorted(items, key=lambda item: (item[0].data_vencimento, item[0].nome))
+    subject = f'Lembrete: {len(items)} documentos próximos do vencimento'
+    lines = [
+        f'- "{doc.nome}" ({doc.get_tipo_display()}) da fazenda "{doc.farm.nome}" (matrícula {doc.farm.matricula}): '
+        f'{due_phrase(days_before)}, na data {doc.data_vencimento.strftime("%d/%m/%Y")}.'
+        for doc, days_before in items
+    ]
+    message = (
+        'Olá,\n\n'
+        'Os seguintes documentos estão próximos do vencimento:\n\n'
+        + '\n'.join(lines)
+        + '\n\nAgroDocs'
+    )
+    return subject, message
+
+
+def split_digest_items(items, limit=WHATSAPP_MAX_BODY):
+    """
+    Divide os (key, document, days_before) de um digest em grupos cuja
+    mensagem cabe em `limit` caracteres. Cada grupo vira uma mensagem
+    completa, com resultado próprio: se uma falhar, só as chaves dela são
+    tentadas de novo (as das mensagens já entregues não se repetem).
+    """
+    items = sorted(items, key=lambda item: (item[1].data_vencimento, item[1].nome))
+    groups, current = [], []
+    for item in items:
+        candidate = [*current, item]
+        if current and len(build_digest_messages([(doc, days) for _key, doc, days in candidate])[1]) > limit:
+            groups.append(current)
+            candidate = [item]
+        current = candidate
+    if current:
+        groups.append(current)
+    return groups
+
+
 def notify_document(document, days_before):
     subject, message = build_notification_messages(document, days_before)
     send_document_email(document, subject, message)
     send_document_whatsapp(document, message)
 
 
+# ==========
+# CIRCUIT BREAKER
+# ==========
+
+class CircuitBreaker:
+    """
+    Circuit breaker de um canal de notificação.
+
+    - closed: envios normais; `failure_threshold` falhas consecutivas abrem o circuito.
+    - open: envios falham na hora com CircuitOpenError (sem esperar timeout do
+      provedor) até passar `reset_timeout` segundos.
+    - half_open: uma única chamada de prova; sucesso fecha, falha reabre.
+    Erros de dados do destinatário (NotificationError, destinatário recusado
+    pelo SMTP, 4xx do Twilio como número "To" inválido) não contam como falha
+    do provedor: uma lista de telefones ruins não abre o circuito de todos.
+    Cada transição fica em `transitions` como (datetime, de, para), para o
+    resumo dos comandos.
+    """
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    IGNORED_ERRORS = (NotificationError, smtplib.SMTPRecipientsRefused)
+    # 4xx do Twilio que são do provedor/conta, não do destinatário: credenciais, permissão, throttling
+    TWILIO_PROVIDER_STATUSES = (401, 403, 429)
+
+    @classmethod
+    def is_recipient_error(cls, exc):
+        """Erro causado pelo destinatário (ou pelos dados da mensagem), não pela saúde do provedor."""
+        if isinstance(exc, cls.IGNORED_ERRORS):
+            return True
+        return (
+            isinstance(exc, TwilioRestException)
+            and 400 <= (exc.status or 0) < 500
+            and exc.status not in cls.TWILIO_PROVIDER_STATUSES
+        )
+
+    def __init__(self, channel: str, failure_threshold: int = 5, reset_timeout: float = 60, clock=time.monotonic):
+        self.channel = channel
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.transitions = []
+        self._clock = clock
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        if state != self.state:
+            self.transitions.append((timezone.now(), self.state, state))
+            logger.warning("Circuito %s: %s -> %s", self.channel, self.state, state)
+            self.state = state
+
+    def retry_after(self) -> float:
+        """Segundos até o circuito aceitar uma nova tentativa (0 se fechado)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            return max(0.0, self._opened_at + self.reset_timeout - self._clock())
+
+    def before_call(self):
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - self._clock()
+                if remaining > 0:
+                    raise CircuitOpenError(self.channel, remaining)
+                self._set_state(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError(self.channel, self.reset_timeout)
+                self._probing = True
+
+    def on_success(self):
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            self._set_state(self.CLOSED)
+
+    def on_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+                self._set_state(self.OPEN)
+
+    def call(self, func, *args):
+        self.before_call()
+        try:
+            result = func(*args)
+        except Exception as e:
+            if self.is_recipient_error(e):
+                # Falha do destinatário, não do provedor: libera a prova sem mudar o estado
+                with self._lock:
+                    self._probing = False
+            else:
+                self.on_failure()
+            raise
+        self.on_success()
+        return result
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_circuit_breaker(channel: str) -> CircuitBreaker:
+    """Circuit breaker do canal, compartilhado pelo processo (recriado se a configuração mudar)."""
+    config = getattr(settings, "NOTIFICATION_CIRCUIT_BREAKER", {})
+    key = (config.get("failure_threshold", 5), config.get("reset_timeout", 60))
+    with _breakers_lock:
+        current = _breakers.get(channel)
+        if current is None or current[0] != key:
+            current = (key, CircuitBreaker(channel, *key))
+            _breakers[channel] = current
+        return current[1]
+
+
+# ==========
+# DESPACHO CONCORRENTE
+# ==========
+
+
+@dataclass
+class DeliveryResult:
+    """Resultado do envio de uma notificação em um canal."""
+    key: tuple  # (document_id, days_before)
+    channel: str
+    ok: bool
+    error: Optional[str] = None
+    # Recusado pelo circuit breaker: não chegou ao provedor e deve ser reenviado depois
+    deferred: bool = False
+
+
+class NotificationDispatcher:
+    """
+    Envia notificações em pools de threads separados por canal, de modo que a
+    latência de SMTP e Twilio se sobreponha em vez de somar.
+
+    - Cada canal tem sua própria concorrência máxima (um provedor lento não
+      ocupa os workers do outro).
+    - As mensagens são montadas na thread chamadora; os workers só falam com
+      os provedores (não acessam o banco).
+    - E-mails seguem em lotes de `email_batch_size`, cada lote por uma única
+      conexão SMTP (send_email_batch).
+    - Falhas não interrompem o lote: cada envio gera um DeliveryResult para
+      cada chave atendida pela mensagem (várias, no modo digest).
+    """
+
+    def __init__(self, email_concurrency: int = 4, whatsapp_concurrency: int = 4, email_batch_size: Optional[int] = None):
+        self.email_batch_size = email_batch_size or getattr(settings, "NOTIFICATION_EMAIL_BATCH_SIZE", 50)
+        self.email_concurrency = email_concurrency
+        if settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN:
+            # Garante um pool HTTP do tamanho da concorrência de WhatsApp
+            get_twilio_client(pool_size=whatsapp_concurrency)
+        self._pools = {
+            CHANNEL_EMAIL: ThreadPoolExecutor(max_workers=email_concurrency, thread_name_prefix="notify-email"),
+            CHANNEL_WHATSAPP: ThreadPoolExecutor(max_workers=whatsapp_concurrency, thread_name_prefix="notify-whatsapp"),
+        }
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
+
+    def _run_email_batch(self, key_groups, messages):
+        results = []
+        for keys, error in zip(key_groups, send_email_batch(messages)):
+            deferred = isinstance(error, CircuitOpenError)
+            if error is not None and not deferred:
+                logger.error("Falha ao enviar %s para %s: %s", CHANNEL_EMAIL, keys, error)
+            results.extend(
+                DeliveryResult(key, CHANNEL_EMAIL, error is None, None if error is None else str(error), deferred)
+                for key in keys
+            )
+        return results
+
+    def _run_whatsapp(self, keys, send, *args):
+        try:
+            send(*args)
+        except CircuitOpenError as e:
+            return [DeliveryResult(key, CHANNEL_WHATSAPP, False, str(e), deferred=True) for key in keys]
+        except Exception as e:
+            logger.exception("Falha ao enviar %s para %s", CHANNEL_WHATSAPP, keys)
+            return [DeliveryResult(key, CHANNEL_WHATSAPP, False, str(e)) for key in keys]
+        return [DeliveryResult(key, CHANNEL_WHATSAPP, True) for key in keys]
+
+    def _submit_emails(self, key_groups, messages):
+        # Divide os e-mails entre os workers, sem passar de email_batch_size por conexão
+        size = max(1, min(self.email_batch_size, -(-len(messages) // self.email_concurrency)))
+        return [
+            self._pools[CHANNEL_EMAIL].submit(
+                self._run_email_batch, key_groups[i:i + size], messages[i:i + size]
+            )
+            for i in range(0, len(messages), size)
+        ]
+
+    def _collect(self, results, futures):
+        for future in futures:
+            for result in future.result():
+                results[result.key].append(result)
+        return results
+
+    def dispatch(self, items, channels=None):
+        """
+        Envia (key, document, days_before) pelos canais e aguarda o lote.
+        `channels` opcional: {key: [canal, ...]} restringe os canais de uma
+        chave (ex.: reenvio só do canal que ficou adiado).
+        Métricas: montagem das mensagens em "message_build", envio e espera
+        pelos provedores em "dispatch" (fases disjuntas).
+        Retorna {key: [DeliveryResult, ...]} na ordem de `items`.
+        """
+        channels = channels or {}
+        results = {}
+        key_groups, email_messages = [], []
+        whatsapp_jobs = []
+        with metrics.phase("message_build"):
+            for key, document, days_before in items:
+                subject, message = build_notification_messages(document, days_before)
+                results[key] = []
+                wanted = channels.get(key) or (CHANNEL_EMAIL, CHANNEL_WHATSAPP)
+                if CHANNEL_EMAIL in wanted:
+                    key_groups.append([key])
+                    email_messages.append(build_document_email(document, subject, message))
+                if CHANNEL_WHATSAPP in wanted:
+                    whatsapp_jobs.append(([key], send_document_whatsapp, document, message))
+        with metrics.phase("dispatch"):
+            futures = [self._pools[CHANNEL_WHATSAPP].submit(self._run_whatsapp, *job) for job in whatsapp_jobs]
+            futures.extend(self._submit_emails(key_groups, email_messages))
+            return self._collect(results, futures)
+
+    def dispatch_digest(self, items):
+        """
+        Modo digest: agrupa (key, document, days_before) por e-mail e por
+        WhatsApp normalizado e envia UMA mensagem por destinatário e canal
+        (no WhatsApp, uma por bloco que caiba em WHATSAPP_MAX_BODY; ver
+        split_digest_items). O resultado de cada mensagem vale para as chaves
+        que ela lista. Fases de métricas como em dispatch().
+        Retorna {key: [DeliveryResult, ...]}, como dispatch().
+        """
+        results = {}
+        by_email = defaultdict(list)
+        by_whatsapp = defaultdict(list)
+        whatsapp_enabled = bool(settings.TWILIO_ACCOUNT_SID and settings.TWILIO_AUTH_TOKEN)
+        key_groups, email_messages = [], []
+        whatsapp_jobs = []
+        with metrics.phase("message_build"):
+            for key, document, days_before in items:
+                results[key] = []
+                by_email[document.notify_email.strip().lower()].append((key, document, days_before))
+                if not whatsapp_enabled:
+                    # Mesmo comportamento de send_document_whatsapp: sem Twilio, ignora o canal
+                    results[key].append(DeliveryResult(key, CHANNEL_WHATSAPP, True))
+                    continue
+                try:
+                    to = normalize_phone_to_e164(document.notify_whatsapp, default_country_code="+55")
+                except NotificationError as e:
+                    results[key].append(DeliveryResult(key, CHANNEL_WHATSAPP, False, str(e)))
+                    continue
+                by_whatsapp[to].append((key, document, days_before))
+
+            for recipient, group in by_email.items():
+                subject, message = build_digest_messages([(doc, days) for _key, doc, days in group])
+                key_groups.append([key for key, _doc, _days in group])
+                email_messages.append(EmailMessage(
+                    subject=subject, body=message, from_email=settings.DEFAULT_FROM_EMAIL, to=[recipient],
+                ))
+
+            for to, group in by_whatsapp.items():
+                # Digest longo: várias mensagens completas em vez de um texto cortado em partes
+                for part in split_digest_items(group):
+                    _subject, message = build_digest_messages([(doc, days) for _key, doc, days in part])
+                    whatsapp_jobs.append(([key for key, _doc, _days in part], send_whatsapp_message, to, message))
+
+        with metrics.phase("dispatch"):
+            futures = self._submit_emails(key_groups, email_messages)
+            futures.extend(self._pools[CHANNEL_WHATSAPP].submit(self._run_whatsapp, *job) for job in whatsapp_jobs)
+            return self._collect(results, futures)
+
+
 # ==========
 # NOVOS: NORMALIZAÇÃO E TESTES
 # ==========
@@ -107,6 +605,61 @@ def normalize_phone_to_e164(raw: str, default_country_code: str = "+55") -> str:
     return value
 
 
+class PooledTwilioHttpClient(TwilioHttpClient):
+    """TwilioHttpClient que converte HTTP 429 em ProviderThrottledError (com Retry-After)."""
+
+    def request(self, *args, **kwargs):
+        response = super().request(*args, **kwargs)
+        if response.status_code == 429:
+            raise ProviderThrottledError(
+                "Twilio: limite de requisições atingido (429).",
+                retry_after=parse_retry_after(response.headers.get("Retry-After")),
+            )
+        return response
+
+
+_twilio_lock = threading.Lock()
+_twilio_shared = None  # (config, pool_size, Client)
+
+
+def get_twilio_client(pool_size: Optional[int] = None) -> Client:
+    """
+    Cliente Twilio compartilhado pelo processo, criado sob demanda.
+
+    Usa uma única requests.Session com keep-alive, cujo pool de conexões tem
+    pelo menos `pool_size` conexões (padrão: settings.TWILIO_POOL_SIZE). O
+    cliente é recriado apenas se credenciais, timeout ou URL base mudarem, ou
+    se for pedido um pool maior que o atual. Seguro para uso entre threads.
+    """
+    global _twilio_shared
+    pool_size = pool_size or getattr(settings, "TWILIO_POOL_SIZE", 4)
+    config = (
+        settings.TWILIO_ACCOUNT_SID,
+        settings.TWILIO_AUTH_TOKEN,
+        getattr(settings, "TWILIO_TIMEOUT", 10),
+        getattr(settings, "TWILIO_MAX_RETRIES", 0),
+        getattr(settings, "TWILIO_API_BASE_URL", ""),
+    )
+    with _twilio_lock:
+        if _twilio_shared is not None:
+            current_config, current_pool, client = _twilio_shared
+            if current_config == config and current_pool >= pool_size:
+                return client
+            pool_size = max(pool_size, current_pool if current_config == config else 0)
+
+        sid, token, timeout, max_retries, base_url = config
+        http_client = PooledTwilioHttpClient(pool_connections=True, timeout=timeout)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=max_retries)
+        http_client.session.mount("https://", adapter)
+        http_client.session.mount("http://", adapter)
+        client = Client(sid, token, http_client=http_client)
+        if base_url:
+            # Permite apontar para um stand-in local da API (testes/benchmarks)
+            client.api.base_url = base_url
+        _twilio_shared = (config, pool_size, client)
+        return client
+
+
 def _twilio_client():
     sid = getattr(settings, "TWILIO_ACCOUNT_SID", None)
     token = getattr(settings, "TWILIO_AUTH_TOKEN", None)
@@ -115,7 +668,24 @@ def _twilio_client():
         raise NotConfiguredError(
             "Twilio não configurado. Defina TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN e TWILIO_WHATSAPP_FROM em settings."
         )
-    return Client(sid, token), from_whatsapp
+    return get_twilio_client(), from_whatsapp
+
+
+@contextmanager
+def _tracked_test_send(channel):
+    """Latência e resultado (test_sent/test_failed) do envio de teste, exportados a cada envio."""
+    try:
+        with test_metrics.track(channel):
+            yield
+        test_metrics.incr("test_sent", channel)
+    except Exception:
+        test_metrics.incr("test_failed", channel)
+        raise
+    finally:
+        try:
+            write_run_metrics(TEST_SEND_JOB, registry=test_metrics)
+        except OSError:
+            logger.warning("Não foi possível gravar as métricas do envio de teste", exc_info=True)
 
 
 def send_test_email(to_email: str, user, subject: Optional[str] = None, body: Optional[str] = None) -> str:
@@ -132,9 +702,10 @@ def send_test_email(to_email: str, user, subject: Optional[str] = None, body: Op
     from_email = getattr(settings, "DEFAULT_FROM_EMAIL", None)
 
     try:
-        sent = send_mail(subject, body, from_email, [to_email], fail_silently=False)
-        if sent <= 0:
-            raise NotificationError("Falha ao enviar o e-mail de teste.")
+        with _tracked_test_send(CHANNEL_EMAIL):
+            sent = send_mail(subject, body, from_email, [to_email], fail_silently=False)
+            if sent <= 0:
+                raise NotificationError("Falha ao enviar o e-mail de teste.")
         return f"ok-{sent}"
     except Exception as e:
         logger.exception("Falha ao enviar e-mail de teste")
@@ -160,7 +731,8 @@ def send_test_whatsapp(to_value: str, user, body: Optional[str] = None) -> str:
     body = body or f"Olá {user.get_username()}, esta é uma mensagem de teste WhatsApp do AgroDocs."
 
     try:
-        msg = client.messages.create(body=body, from_=from_whatsapp, to=f"whatsapp:{e164}")
+        with _tracked_test_send(CHANNEL_WHATSAPP):
+            msg = client.messages.create(body=body, from_=from_whatsapp, to=f"whatsapp:{e164}")
         return msg.sid
     except Exception as e:
         logger.exception("Falha ao enviar WhatsApp de teste")
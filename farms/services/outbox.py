@@ -0,0 +1,245 @@
+""" farms/services/outbox.py """
+
+"""
+Fila durável de notificações (NotificationOutbox).
+
+- enqueue(): insere pares (document_id, days_before) de um dia, idempotente
+  pela unique_together (document, days_before, sent_on).
+- claim_batch(): reserva um lote para um worker por tempo limitado (lease).
+  Em bancos com SKIP LOCKED (PostgreSQL, MySQL 8) as linhas são travadas com
+  SELECT ... FOR UPDATE SKIP LOCKED; no SQLite, que serializa escritas, um
+  UPDATE condicional faz o mesmo papel. Em ambos os casos só volta para o
+  worker o que ele efetivamente marcou com seu locked_by/locked_until.
+- claim_keys()/release(): reserva direta usada pelo envio fatiado
+  (send_due_notifications --shard), para que nós sobrepostos não enviem o
+  mesmo lembrete duas vezes. Uma reserva com lease vencido (nó que morreu)
+  é uma entrada pendente como as outras: o process_notification_outbox a
+  assume e envia.
+- mark_sent()/mark_failed(): concluem a entrada, gravando NotificationLog no
+  sucesso e reagendando com backoff exponencial (ou dead-letter) na falha.
+  As enviadas ficam como 'sent' até o fim do dia (barram uma reserva tardia
+  do mesmo lembrete) e são removidas por purge_sent() (compact_notification_logs).
+- defer()/mark_deferred(): canais recusados pelo circuit breaker voltam à
+  fila para depois da reabertura, sem contar tentativa.
+- retry_channels(): canais que falharam num envio direto em que outro canal
+  foi entregue; só eles são tentados de novo, com backoff.
+defer() e retry_channels() sobrescrevem a linha do mesmo lembrete se ela já
+existir (ex.: a reserva do --shard), em vez de descartar os canais pendentes.
+Vários processos podem consumir a fila ao mesmo tempo com segurança.
+"""
+
+import random
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from farms.models import NotificationOutbox
+from farms.services.reminders import record_sent
+
+
+def enqueue(keys, day):
+    """Enfileira pares (document_id, days_before) com sent_on=`day`."""
+    NotificationOutbox.objects.bulk_create(
+        [NotificationOutbox(document_id=doc_id, days_before=days, sent_on=day) for doc_id, days in keys],
+        ignore_conflicts=True,
+    )
+
+
+# Colunas sobrescritas quando o lembrete já tem linha na fila (defer/retry_channels)
+UPSERT_FIELDS = ['status', 'channels', 'attempts', 'available_at', 'locked_by', 'locked_until', 'last_error', 'updated_at']
+
+
+def _upsert(entries):
+    """INSERT ... ON CONFLICT (document, days_before, sent_on) DO UPDATE: a linha existente recebe os canais pendentes."""
+    NotificationOutbox.objects.bulk_create(
+        entries,
+        update_conflicts=True,
+        unique_fields=['document', 'days_before', 'sent_on'],
+        update_fields=UPSERT_FIELDS,
+    )
+
+
+def defer(channels_by_key, day, available_at):
+    """
+    Enfileira, para envio a partir de `available_at`, só os canais que ficaram
+    adiados (circuito aberto) de cada par: {(document_id, days_before): [canal, ...]}.
+    """
+    _upsert([
+        NotificationOutbox(
+            document_id=doc_id, days_before=days, sent_on=day,
+            channels=','.join(sorted(channels)), available_at=available_at,
+        )
+        for (doc_id, days), channels in channels_by_key.items()
+    ])
+
+
+def retry_channels(failures, day, backoff_base=60):
+    """
+    Enfileira, após `backoff_base` segundos, só os canais que falharam de cada
+    par, já contando a primeira tentativa: {(document_id, days_before): (canais, erro)}.
+    Usado quando outro canal do lembrete foi entregue (e registrado no log).
+    """
+    available_at = timezone.now() + timedelta(seconds=backoff_base)
+    _upsert([
+        NotificationOutbox(
+            document_id=doc_id, days_before=days, sent_on=day,
+            channels=','.join(sorted(channels)), attempts=1,
+            available_at=available_at, last_error=str(error)[:2000],
+        )
+        for (doc_id, days), (channels, error) in failures.items()
+    ])
+
+
+def claim_keys(keys, day, worker_id, lease_seconds=300):
+    """
+    Reserva pares (document_id, days_before) de `day` para envio direto por
+    `worker_id`, usando a unique_together da fila como trava entre nós: só o
+    processo cuja linha foi inserida a recebe de volta; linhas já na fila
+    (reservadas por outro nó, enfileiradas ou reagendadas) ficam de fora.
+    Retorna {(document_id, days_before): NotificationOutbox}.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    lease_until = timezone.now() + timedelta(seconds=lease_seconds)
+    NotificationOutbox.objects.bulk_create(
+        [
+            NotificationOutbox(
+                document_id=doc_id, days_before=days, sent_on=day,
+                locked_by=worker_id, locked_until=lease_until,
+            )
+            for doc_id, days in keys
+        ],
+        ignore_conflicts=True,
+    )
+    owned = NotificationOutbox.objects.filter(
+        sent_on=day,
+        document_id__in={doc_id for doc_id, _days in keys},
+        status=NotificationOutbox.STATUS_PENDING,
+        locked_by=worker_id,
+        locked_until=lease_until,
+    )
+    wanted = set(keys)
+    return {
+        (e.document_id, e.days_before): e
+        for e in owned
+        if (e.document_id, e.days_before) in wanted
+    }
+
+
+def release(entries):
+    """Desfaz reservas de claim_keys() cujo envio falhou (nada é registrado no log)."""
+    if entries:
+        NotificationOutbox.objects.filter(pk__in=[e.pk for e in entries]).delete()
+
+
+def claim_batch(worker_id, limit=50, lease_seconds=300):
+    """
+    Reserva até `limit` entradas pendentes e disponíveis para `worker_id`.
+    Entradas com lease vencido (worker que morreu) voltam a ser elegíveis.
+    """
+    now = timezone.now()
+    lease_until = now + timedelta(seconds=lease_seconds)
+    ready = NotificationOutbox.objects.filter(
+        Q(locked_until__isnull=True) | Q(locked_until__lt=now),
+        status=NotificationOutbox.STATUS_PENDING,
+        available_at__lte=now,
+    )
+
+    candidates = ready.order_by('available_at', 'pk')
+    if connection.features.has_select_for_update_skip_locked:
+        with transaction.atomic():
+            ids = list(candidates.select_for_update(skip_locked=True).values_list('pk', flat=True)[:limit])
+            ready.filter(pk__in=ids).update(locked_by=worker_id, locked_until=lease_until)
+    else:
+        # Sem SKIP LOCKED (SQLite): SELECT e UPDATE em autocommit. As condições
+        # de `ready` são reavaliadas no UPDATE, então linhas reservadas por
+        # outro worker nesse meio-tempo ficam de fora.
+        ids = list(candidates.values_list('pk', flat=True)[:limit])
+        if ids:
+            ready.filter(pk__in=ids).update(locked_by=worker_id, locked_until=lease_until)
+    if not ids:
+        return []
+
+    return list(
+        NotificationOutbox.objects
+        .filter(pk__in=ids, locked_by=worker_id, locked_until=lease_until)
+        .select_related('document', 'document__farm')
+        .order_by('pk')
+    )
+
+
+def mark_sent(entries):
+    """Conclui as entradas enviadas e registra os envios em NotificationLog."""
+    if not entries:
+        return
+    by_day = defaultdict(list)
+    for entry in entries:
+        by_day[entry.sent_on].append((entry.document_id, entry.days_before))
+    with transaction.atomic():
+        for day, keys in by_day.items():
+            record_sent(keys, day)
+        NotificationOutbox.objects.filter(pk__in=[e.pk for e in entries]).update(
+            status=NotificationOutbox.STATUS_SENT,
+            locked_by='',
+            locked_until=None,
+            last_error='',
+            updated_at=timezone.now(),
+        )
+
+
+def purge_sent(before, batch_size=5000):
+    """
+    Remove, em lotes, as entradas 'sent' de dias anteriores a `before` (o
+    NotificationLog já registra o envio). Retorna quantas foram removidas.
+    """
+    sent = NotificationOutbox.objects.filter(status=NotificationOutbox.STATUS_SENT, sent_on__lt=before)
+    removed = 0
+    while True:
+        pks = list(sent.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return removed
+        removed += NotificationOutbox.objects.filter(pk__in=pks).delete()[0]
+
+
+def mark_deferred(entry, channels, available_at):
+    """
+    Devolve a entrada à fila sem contar tentativa (circuito do canal aberto),
+    mantendo apenas os canais ainda pendentes.
+    """
+    NotificationOutbox.objects.filter(pk=entry.pk).update(
+        status=NotificationOutbox.STATUS_PENDING,
+        channels=','.join(sorted(channels)),
+        available_at=available_at,
+        locked_by='',
+        locked_until=None,
+        updated_at=timezone.now(),
+    )
+
+
+def mark_failed(entry, error, max_attempts=5, backoff_base=60, channels=None):
+    """
+    Registra uma falha. Até `max_attempts` tentativas a entrada volta para a
+    fila após backoff_base * 2^(tentativas-1) segundos (com jitter de até 10%);
+    depois disso vai para dead-letter (status 'dead'). `channels` restringe a
+    próxima tentativa aos canais que não foram entregues.
+    Retorna True se a entrada foi descartada.
+    """
+    attempts = entry.attempts + 1
+    dead = attempts >= max_attempts
+    delay = backoff_base * (2 ** (attempts - 1))
+    delay += random.uniform(0, delay * 0.1)
+    NotificationOutbox.objects.filter(pk=entry.pk).update(
+        attempts=attempts,
+        status=NotificationOutbox.STATUS_DEAD if dead else NotificationOutbox.STATUS_PENDING,
+        available_at=timezone.now() + timedelta(seconds=delay),
+        locked_by='',
+        locked_until=None,
+        last_error=str(error)[:2000],
+        channels=','.join(sorted(channels)) if channels else entry.channels,
+        updated_at=timezone.now(),
+    )
+    return dead
@@ -0,0 +1,134 @@
+""" farms/services/reminders.py """
+
+"""
+Seleção dos lembretes que devem disparar em um dia.
+
+A consulta é resolvida inteiramente no banco, em uma única ida:
+- DocumentReminder.fire_on (data_vencimento - days_before, desnormalizado e
+  indexado) é consultado direto pelo índice, o que vale para qualquer offset,
+  inclusive os personalizados fora de DocumentReminder.OPTIONS;
+- pares (documento, offset) já registrados em NotificationLog no dia do
+  disparo, ou com entrada pendente em NotificationOutbox (fila ou reserva de
+  outro nó), são excluídos via NOT EXISTS.
+Assim o custo do job diário acompanha o número de lembretes devidos, e não o
+tamanho total da tabela de lembretes.
+"""
+
+from itertools import islice
+
+from django.db.models import Exists, OuterRef
+from django.db.models.functions import Mod
+from django.utils import timezone
+
+from farms.models import DocumentReminder, NotificationLog, NotificationOutbox
+
+# Colunas lidas pelo envio (build_notification_messages e provedores); o resto não é carregado
+MESSAGE_FIELDS = (
+    'document_id', 'days_before', 'fire_on',
+    'document__nome', 'document__tipo', 'document__data_vencimento',
+    'document__notify_email', 'document__notify_whatsapp', 'document__farm_id',
+    'document__farm__nome', 'document__farm__matricula',
+    'document__farm__proprietario_nome', 'document__farm__proprietario_cpf',
+)
+
+
+def due_reminders(day=None, shard=None, since=None):
+    """
+    Retorna o queryset de DocumentReminder que disparam em `day` (padrão: hoje)
+    e ainda não foram registrados em NotificationLog no dia do disparo nem
+    estão pendentes na fila (quem os entrega é o process_notification_outbox).
+    `since` amplia a busca para todo o intervalo [since, day] (recuperação de
+    dias perdidos), numa única varredura do índice de fire_on.
+    `shard=(index, count)` restringe aos documentos com document_id % count == index.
+    Só as colunas de MESSAGE_FIELDS são carregadas; para percorrer volumes
+    grandes use .iterator(chunk_size=...) em vez de avaliar o queryset.
+    """
+    day = day or timezone.localdate()
+
+    already_sent = NotificationLog.objects.filter(
+        document_id=OuterRef('document_id'),
+        days_before=OuterRef('days_before'),
+        sent_on=OuterRef('fire_on'),
+    )
+
+    queued = NotificationOutbox.objects.filter(
+        document_id=OuterRef('document_id'),
+        days_before=OuterRef('days_before'),
+        sent_on=OuterRef('fire_on'),
+        status=NotificationOutbox.STATUS_PENDING,
+    )
+
+    qs = (
+        DocumentReminder.objects.filter(fire_on__range=(since or day, day))
+        .filter(~Exists(already_sent), ~Exists(queued))
+    )
+    if shard is not None:
+        index, count = shard
+        qs = qs.annotate(shard_bucket=Mod('document_id', count)).filter(shard_bucket=index)
+    return (
+        qs.select_related('document', 'document__farm')
+        .only(*MESSAGE_FIELDS)
+        .order_by('fire_on', 'document_id', 'days_before')
+    )
+
+
+def days_left(document, days_before, day, today=None):
+    """
+    Offset mostrado na mensagem de um lembrete que dispara em `day`: no próprio
+    dia, o days_before configurado; atrasado (--since, fila), os dias que de
+    fato faltam até o vencimento em `today` (negativo se já venceu). O log
+    continua gravado com o days_before original.
+    """
+    today = today or timezone.localdate()
+    if day == today:
+        return days_before
+    return (document.data_vencimento - today).days
+
+
+def parse_shard(value):
+    """Converte 'INDEX/COUNT' em (index, count), validando 0 <= index < count."""
+    try:
+        index, count = (int(part) for part in value.split('/'))
+    except (AttributeError, ValueError):
+        raise ValueError('Use o formato INDEX/COUNT, ex.: 0/4.')
+    if count < 1 or not 0 <= index < count:
+        raise ValueError('Shard inválido: é preciso 0 <= INDEX < COUNT.')
+    return index, count
+
+
+def chunked(iterable, size):
+    """Agrupa um iterável em listas de até `size` itens."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def logged_keys(reminders, day):
+    """
+    Pares (document_id, days_before) de `reminders` que já constam em
+    NotificationLog no dia `day`. Uma única consulta para o lote inteiro.
+    """
+    doc_ids = {r.document_id for r in reminders}
+    if not doc_ids:
+        return set()
+    return set(
+        NotificationLog.objects
+        .filter(sent_on=day, document_id__in=doc_ids)
+        .values_list('document_id', 'days_before')
+    )
+
+
+def record_sent(keys, day):
+    """
+    Registra em NotificationLog os pares (document_id, days_before) enviados em
+    `day` com um único INSERT. Conflitos com a unique_together
+    (document, days_before, sent_on) são ignorados, o que torna a gravação
+    idempotente entre execuções concorrentes.
+    """
+    NotificationLog.objects.bulk_create(
+        [NotificationLog(document_id=doc_id, days_before=days, sent_on=day) for doc_id, days in keys],
+        ignore_conflicts=True,
+    )
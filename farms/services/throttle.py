@@ -0,0 +1,157 @@
+""" farms/services/throttle.py """
+
+"""
+Controle de taxa de saída por canal de notificação (e-mail e WhatsApp).
+
+- TokenBucket: balde de fichas thread-safe, compartilhado pelos workers de um
+  canal. A taxa é adaptativa: cai pela metade a cada resposta de throttling do
+  provedor (429 do Twilio, 421/45x do SMTP) e se recupera aos poucos a cada
+  envio bem-sucedido, até o teto configurado.
+- Retry-After é respeitado: o balde fica bloqueado até o instante indicado.
+- call_with_rate_limit(): consome uma ficha, chama o provedor e, em caso de
+  throttling, espera e tenta de novo (até NOTIFICATION_THROTTLE_MAX_RETRIES).
+
+Taxas em settings.NOTIFICATION_RATE_LIMITS (mensagens/segundo; 0 = sem limite).
+"""
+
+import smtplib
+import threading
+import time
+from typing import Optional
+
+from django.conf import settings
+
+from twilio.base.exceptions import TwilioRestException
+
+# Códigos SMTP usados por relays para sinalizar excesso de envio/conexões
+SMTP_THROTTLE_CODES = {421, 450, 451, 452}
+
+
+class ProviderThrottledError(Exception):
+    """O provedor recusou o envio por excesso de taxa (ex.: HTTP 429)."""
+
+    def __init__(self, message: str = "", retry_after: Optional[float] = None):
+        super().__init__(message or "Limite de envio do provedor atingido.")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value) -> Optional[float]:
+    """Retry-After em segundos (aceita apenas o formato numérico)."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def throttle_info(exc):
+    """Retorna (é_throttling, retry_after) para uma exceção de provedor."""
+    if isinstance(exc, ProviderThrottledError):
+        return True, exc.retry_after
+    if isinstance(exc, TwilioRestException) and exc.status == 429:
+        return True, None
+    if isinstance(exc, smtplib.SMTPResponseException) and exc.smtp_code in SMTP_THROTTLE_CODES:
+        return True, None
+    # Relays que limitam por destinatário recusam o RCPT TO com 450/451/452
+    if isinstance(exc, smtplib.SMTPRecipientsRefused) and any(
+        code in SMTP_THROTTLE_CODES for code, _ in exc.recipients.values()
+    ):
+        return True, None
+    return False, None
+
+
+class TokenBucket:
+    """
+    Balde de fichas com taxa adaptativa (redução multiplicativa em throttling,
+    aumento aditivo em sucesso). `rate` em fichas/segundo; None/0 = sem limite,
+    mas Retry-After e pausas de throttling continuam valendo.
+    """
+
+    def __init__(self, rate: Optional[float], burst: Optional[float] = None, min_rate: Optional[float] = None,
+                 recovery: float = 0.05, clock=time.monotonic, sleep=time.sleep):
+        self.max_rate = rate or None
+        self.rate = self.max_rate
+        self.min_rate = min_rate or (self.max_rate / 20 if self.max_rate else None)
+        self.capacity = burst or (max(1.0, self.max_rate) if self.max_rate else None)
+        self.recovery = recovery
+        self.tokens = self.capacity or 0.0
+        self.throttled = 0
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Bloqueia até haver uma ficha disponível (e o balde não estar pausado)."""
+        while True:
+            with self._lock:
+                now = self._clock()
+                self._refill(now)
+                if now < self._blocked_until:
+                    wait = self._blocked_until - now
+                elif not self.rate:
+                    return
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            self._sleep(wait)
+
+    def on_success(self):
+        if self.rate:
+            with self._lock:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * self.recovery)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Reduz a taxa pela metade e pausa o balde (Retry-After ou 1 intervalo)."""
+        with self._lock:
+            self.throttled += 1
+            now = self._clock()
+            if self.rate:
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = 0.0
+            pause = retry_after if retry_after is not None else (1 / self.rate if self.rate else 1.0)
+            self._blocked_until = max(self._blocked_until, now + pause)
+            self._updated = now
+
+
+def call_with_rate_limit(bucket: TokenBucket, func, *args, max_retries: Optional[int] = None):
+    """Chama func(*args) respeitando o balde; repete em caso de throttling do provedor."""
+    if max_retries is None:
+        max_retries = getattr(settings, "NOTIFICATION_THROTTLE_MAX_RETRIES", 3)
+    attempt = 0
+    while True:
+        bucket.acquire()
+        try:
+            result = func(*args)
+        except Exception as e:
+            throttled, retry_after = throttle_info(e)
+            if not throttled or attempt >= max_retries:
+                raise
+            attempt += 1
+            bucket.on_throttle(retry_after)
+            continue
+        bucket.on_success()
+        return result
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(channel: str) -> TokenBucket:
+    """Balde do canal, compartilhado pelo processo (recriado se a configuração mudar)."""
+    config = getattr(settings, "NOTIFICATION_RATE_LIMITS", {}).get(channel) or {}
+    key = (config.get("rate"), config.get("burst"))
+    with _limiters_lock:
+        current = _limiters.get(channel)
+        if current is None or current[0] != key:
+            current = (key, TokenBucket(rate=config.get("rate"), burst=config.get("burst")))
+            _limiters[channel] = current
+        return current[1]
@@ -0,0 +1,67 @@
+""" farms/signals.py """
+
+"""
+Sinais do app Farms, conectados em FarmsConfig.ready():
+- mantêm o índice de busca (farms/search.py) em dia a cada save/delete de
+  Farm e Document;
+- invalidam as contagens em cache das listagens do dono (farms/pagination.py)
+  após o commit.
+"""
+
+from django.db import connections, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Document, Farm
+from .pagination import bump_count_version
+from .search import DOCUMENT_INDEX, FARM_INDEX
+
+
+@receiver(post_save, sender=Farm, dispatch_uid="farms_search_farm_saved")
+def index_farm(sender, instance, raw=False, using=None, **kwargs):
+    if raw:  # loaddata: o índice é refeito com rebuild_search_index
+        return
+    connection = connections[using]
+    FARM_INDEX.refresh([instance.pk], connection=connection)
+    # Os documentos indexam nome e matrícula da fazenda: só reindexa se mudaram (Farm.save compara)
+    if getattr(instance, "_documents_reindex", False):
+        DOCUMENT_INDEX.refresh(scope_id=instance.pk, connection=connection)
+
+
+@receiver(post_delete, sender=Farm, dispatch_uid="farms_search_farm_deleted")
+def unindex_farm(sender, instance, using=None, **kwargs):
+    FARM_INDEX.remove([instance.pk], connection=connections[using])
+
+
+@receiver(post_save, sender=Document, dispatch_uid="farms_search_document_saved")
+def index_document(sender, instance, raw=False, using=None, **kwargs):
+    if raw:
+        return
+    DOCUMENT_INDEX.refresh([instance.pk], connection=connections[using])
+
+
+@receiver(post_delete, sender=Document, dispatch_uid="farms_search_document_deleted")
+def unindex_document(sender, instance, using=None, **kwargs):
+    DOCUMENT_INDEX.remove([instance.pk], connection=connections[using])
+
+
+# ---------- Contagens das listagens ----------
+
+
+def _invalidate_counts(using, *user_ids):
+    # Depois do commit: uma contagem feita antes dele não fica em cache com a versão nova
+    for user_id in {u for u in user_ids if u is not None}:
+        transaction.on_commit(lambda user_id=user_id: bump_count_version(user_id), using=using)
+
+
+@receiver(post_save, sender=Farm, dispatch_uid="farms_counts_farm_saved")
+@receiver(post_delete, sender=Farm, dispatch_uid="farms_counts_farm_deleted")
+def farm_counts_changed(sender, instance, using=None, **kwargs):
+    # Fazenda trocando de dono (Farm.save guarda o anterior): as listagens dele também mudam
+    _invalidate_counts(using, instance.owner_id, getattr(instance, "_previous_owner_id", None))
+
+
+@receiver(post_save, sender=Document, dispatch_uid="farms_counts_document_saved")
+@receiver(post_delete, sender=Document, dispatch_uid="farms_counts_document_deleted")
+def document_counts_changed(sender, instance, using=None, **kwargs):
+    _invalidate_counts(using, instance.owner_id)
@@ -11,6 +11,7 @@ def querystring(params, **kwargs):
     Retorna a querystring atual substituindo/removendo chaves.
     Uso no template:
       href="?{% querystring request.GET sort='nome' dir='asc' page=None %}"
+      href="?{% querystring request.GET cursor=page_obj.next_cursor page=None %}"
 
     Regras:
     - Valores None ou "" removem a chave da querystring.
@@ -0,0 +1,545 @@
+""" farms/tests.py """
+
+import itertools
+import json
+import os
+import smtplib
+import tempfile
+import threading
+from unittest import skipUnless
+from concurrent.futures import ThreadPoolExecutor
+from datetime import time, timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core import mail
+from django.core.management import call_command
+from django.db import connection
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from twilio.base.exceptions import TwilioRestException
+
+from farms.management.commands import run_notification_scheduler
+from farms.models import Document, DocumentReminder, Farm, NotificationLog, NotificationOutbox
+from farms.pagination import COUNT_CAPPED, CachedCountPaginator, CursorPaginator, ResultCount, count_cache_enabled
+from farms.services import notifications, outbox, throttle
+from farms.services.metrics import TEST_SEND_JOB, test_metrics
+from farms.services.fake_providers import FakeTwilioServer, SmtpSink
+from farms.views import DocumentListView, FarmListView
+
+TWILIO_TEST_SID = 'AC' + '0' * 32
+
+
+def twilio_settings(server, **extra):
+    """Settings que apontam o cliente Twilio para o stand-in local, sem limite de taxa."""
+    return override_settings(
+        TWILIO_ACCOUNT_SID=TWILIO_TEST_SID,
+        TWILIO_AUTH_TOKEN='test',
+        TWILIO_API_BASE_URL=server.url,
+        NOTIFICATION_RATE_LIMITS={},
+        **extra,
+    )
+
+
+def smtp_settings(sink, **extra):
+    """Settings que apontam o envio de e-mail para o SmtpSink local."""
+    return override_settings(
+        EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+        EMAIL_HOST='127.0.0.1',
+        EMAIL_PORT=sink.port,
+        EMAIL_HOST_USER='',
+        EMAIL_HOST_PASSWORD='',
+        EMAIL_USE_TLS=False,
+        EMAIL_USE_SSL=False,
+        **extra,
+    )
+
+
+def create_documents(count, days_before=7):
+    """`count` documentos de um usuário, cada um com um lembrete que dispara hoje."""
+    user = get_user_model().objects.create(username='dono')
+    farm = Farm.objects.create(
+        owner=user, nome='Fazenda Teste', matricula='T-1', proprietario_nome='Dono', proprietario_cpf='00000000000',
+    )
+    today = timezone.localdate()
+    documents = []
+    for i in range(count):
+        document = Document.objects.create(
+            farm=farm, created_by=user, nome=f'Documento {i}', tipo=Document.TIPO_OUTRO,
+            data_emissao=today - timedelta(days=365), data_vencimento=today + timedelta(days=days_before),
+            notify_email=f'doc{i}@example.com', notify_whatsapp=f'+55119{i:08d}',
+        )
+        DocumentReminder.objects.create(document=document, days_before=days_before)
+        documents.append(document)
+    return documents
+
+
+# Só e-mail, em memória (django.core.mail.outbox); WhatsApp sem Twilio é ignorado
+EMAIL_ONLY = dict(
+    EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend', TWILIO_ACCOUNT_SID='', TWILIO_AUTH_TOKEN='',
+    NOTIFICATION_RATE_LIMITS={}, NOTIFICATION_METRICS_DIR='',
+)
+
+
+class ProviderStateMixin:
+    """Limitadores e circuit breakers são globais do processo: cada teste começa do zero."""
+
+    def setUp(self):
+        super().setUp()
+        throttle._limiters.clear()
+        notifications._breakers.clear()
+
+
+class TwilioPoolTests(ProviderStateMixin, SimpleTestCase):
+    """Cliente Twilio compartilhado: as mensagens reaproveitam as conexões do pool (keep-alive)."""
+
+    POOL_SIZE = 4
+    SENDS = 40
+
+    def test_sequential_sends_reuse_one_connection(self):
+        with FakeTwilioServer() as server, twilio_settings(server, TWILIO_POOL_SIZE=self.POOL_SIZE):
+            for i in range(self.SENDS):
+                notifications.send_whatsapp_message('+5511999990000', f'Mensagem {i}')
+        self.assertEqual(server.stats.messages, self.SENDS)
+        self.assertEqual(server.stats.connections, 1)
+
+    def test_concurrent_sends_stay_within_pool_size(self):
+        with FakeTwilioServer(latency=0.005) as server, twilio_settings(server, TWILIO_POOL_SIZE=self.POOL_SIZE):
+            with ThreadPoolExecutor(max_workers=self.POOL_SIZE) as pool:
+                list(pool.map(
+                    lambda i: notifications.send_whatsapp_message('+5511999990000', f'Mensagem {i}'),
+                    range(self.SENDS),
+                ))
+        self.assertEqual(server.stats.messages, self.SENDS)
+        self.assertLessEqual(server.stats.connections, self.POOL_SIZE)
+
+
+class ThrottlingTests(ProviderStateMixin, TestCase):
+    """
+    Provedores falsos que respondem com throttling (SMTP 451 / HTTP 429): o
+    limitador do canal recua a cada resposta e repete o envio, sem perder nem
+    duplicar mensagens.
+    """
+
+    DOCS = 30
+    RATE_LIMITS = {'email': {'rate': 500}, 'whatsapp': {'rate': 500}}
+
+    def provider_settings(self, sink, server):
+        return smtp_settings(
+            sink,
+            TWILIO_ACCOUNT_SID=TWILIO_TEST_SID,
+            TWILIO_AUTH_TOKEN='test',
+            TWILIO_API_BASE_URL=server.url,
+            NOTIFICATION_RATE_LIMITS=self.RATE_LIMITS,
+            NOTIFICATION_THROTTLE_MAX_RETRIES=20,
+            NOTIFICATION_METRICS_DIR='',
+        )
+
+    def limiters(self):
+        # Dentro do override_settings: fora dele get_rate_limiter() recriaria os baldes
+        return {channel: throttle.get_rate_limiter(channel) for channel in self.RATE_LIMITS}
+
+    def test_send_due_notifications_backs_off_without_loss_or_duplicates(self):
+        create_documents(self.DOCS)
+        with SmtpSink(throttle_rate=0.2, seed=1) as sink, \
+                FakeTwilioServer(throttle_rate=0.2, seed=2, retry_after=0.01) as server, \
+                self.provider_settings(sink, server), self.assertLogs(notifications.logger, 'WARNING'):
+            call_command('send_due_notifications', workers=4, stdout=StringIO())
+            limiters = self.limiters()
+
+        for channel, provider in ((notifications.CHANNEL_EMAIL, sink), (notifications.CHANNEL_WHATSAPP, server)):
+            with self.subTest(channel=channel):
+                self.assertGreater(provider.stats.throttled, 0)
+                # Cada resposta de throttling reduziu a taxa e pausou o balde do canal
+                self.assertEqual(limiters[channel].throttled, provider.stats.throttled)
+                self.assertEqual(provider.stats.messages, self.DOCS)
+                self.assertEqual(provider.stats.errors, 0)
+        self.assertEqual(NotificationLog.objects.count(), self.DOCS)
+        self.assertFalse(NotificationOutbox.objects.exists())
+
+    def test_notify_document_goes_through_the_limiter(self):
+        documents = create_documents(self.DOCS)
+        with SmtpSink(throttle_rate=0.2, seed=3) as sink, \
+                FakeTwilioServer(throttle_rate=0.2, seed=4, retry_after=0.01) as server, \
+                self.provider_settings(sink, server), self.assertLogs(notifications.logger, 'WARNING'):
+            for document in documents:
+                notifications.notify_document(document, 7)
+            limiters = self.limiters()
+
+        for channel, provider in ((notifications.CHANNEL_EMAIL, sink), (notifications.CHANNEL_WHATSAPP, server)):
+            with self.subTest(channel=channel):
+                self.assertGreater(provider.stats.throttled, 0)
+                self.assertEqual(limiters[channel].throttled, provider.stats.throttled)
+                self.assertEqual(provider.stats.messages, self.DOCS)
+
+
+class ThrottleInfoTests(SimpleTestCase):
+    """Recusas de destinatário com código de throttling (45x) são repetidas, as definitivas não."""
+
+    def test_recipient_refusals_with_throttle_codes_are_throttling(self):
+        for code in (450, 451, 452):
+            with self.subTest(code=code):
+                exc = smtplib.SMTPRecipientsRefused({'a@example.com': (code, b'4.7.1 try later')})
+                self.assertEqual(throttle.throttle_info(exc), (True, None))
+        refused = smtplib.SMTPRecipientsRefused({'a@example.com': (550, b'5.1.1 no such user')})
+        self.assertEqual(throttle.throttle_info(refused), (False, None))
+
+    def test_call_with_rate_limit_retries_throttled_recipient_refusals(self):
+        now = [0.0]
+        bucket = throttle.TokenBucket(None, clock=lambda: now[0], sleep=lambda seconds: now.__setitem__(0, now[0] + seconds))
+        replies = iter([smtplib.SMTPRecipientsRefused({'a@example.com': (452, b'4.5.3 too many recipients')})])
+
+        def send():
+            exc = next(replies, None)
+            if exc:
+                raise exc
+            return 1
+
+        self.assertEqual(throttle.call_with_rate_limit(bucket, send, max_retries=1), 1)
+        self.assertEqual(bucket.throttled, 1)
+        self.assertGreater(now[0], 0)  # esperou a pausa do balde antes de repetir
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """Só falhas do provedor abrem o circuito; erros do destinatário não contam."""
+
+    def call_failing(self, breaker, exc):
+        def send():
+            raise exc
+        with self.assertRaises(type(exc)):
+            breaker.call(send)
+
+    def test_twilio_recipient_errors_keep_the_circuit_closed(self):
+        breaker = notifications.CircuitBreaker(notifications.CHANNEL_WHATSAPP, failure_threshold=2)
+        for _ in range(5):
+            # 21211: número "To" inválido
+            self.call_failing(breaker, TwilioRestException(400, '/Messages.json', 'invalid To', code=21211))
+        self.assertEqual(breaker.state, notifications.CircuitBreaker.CLOSED)
+
+    def test_twilio_provider_errors_open_the_circuit(self):
+        for status in (500, 429, 401):
+            with self.subTest(status=status):
+                breaker = notifications.CircuitBreaker(notifications.CHANNEL_WHATSAPP, failure_threshold=2)
+                for _ in range(2):
+                    self.call_failing(breaker, TwilioRestException(status, '/Messages.json', 'erro'))
+                self.assertEqual(breaker.state, notifications.CircuitBreaker.OPEN)
+
+
+class SchedulerTests(ProviderStateMixin, TestCase):
+    """run_notification_scheduler: novas tentativas só dos canais que faltam e virada do dia sem perdas."""
+
+    # Abaixo do failure_threshold do circuit breaker: as falhas do teste não abrem o circuito
+    DOCS = 4
+
+    def scheduler(self, dispatcher, **options):
+        # O estado que handle() monta antes do laço principal
+        command = run_notification_scheduler.Command(stdout=StringIO())
+        command.options = {'batch_size': 20, 'max_attempts': 5, 'backoff_base': 60, 'refresh': 300, **options}
+        command.window = (time.min, time.max)
+        command.stop = threading.Event()
+        command.queue = []
+        command.seq = itertools.count()
+        command.day = timezone.localdate()
+        command.scheduled = set()
+        command.attempts = {}
+        command.sent = command.failed = 0
+        command.dispatcher = dispatcher
+        return command
+
+    def provider_settings(self, sink, server):
+        return smtp_settings(
+            sink,
+            TWILIO_ACCOUNT_SID=TWILIO_TEST_SID,
+            TWILIO_AUTH_TOKEN='test',
+            TWILIO_API_BASE_URL=server.url,
+            NOTIFICATION_RATE_LIMITS={},
+            NOTIFICATION_METRICS_DIR='',
+        )
+
+    def queue_documents(self, command, documents, when):
+        for document in documents:
+            key = (document.pk, 7)
+            command.scheduled.add((command.day, key))
+            command.push(when, run_notification_scheduler.SEND, (command.day, key))
+
+    def test_partial_delivery_is_logged_and_queues_the_failed_channel(self):
+        documents = create_documents(self.DOCS)
+        now = timezone.now()
+        with SmtpSink() as sink, FakeTwilioServer(error_rate=1.0) as server, \
+                self.provider_settings(sink, server), notifications.NotificationDispatcher() as dispatcher, \
+                self.assertLogs(notifications.logger, 'ERROR'):
+            command = self.scheduler(dispatcher, backoff_base=0)
+            self.queue_documents(command, documents, now)
+            self.assertEqual(command.send_batch(now), self.DOCS)
+            # E-mail entregue já está no log (um reinício não o repete); o WhatsApp foi para a fila
+            self.assertEqual(NotificationLog.objects.count(), self.DOCS)
+            self.assertEqual(
+                set(NotificationOutbox.objects.values_list('channels', flat=True)), {notifications.CHANNEL_WHATSAPP},
+            )
+            self.assertEqual(command.queue, [])
+
+            server.error_rate = 0.0
+            call_command('process_notification_outbox', stdout=StringIO())
+
+        self.assertEqual(sink.stats.messages, self.DOCS)
+        self.assertEqual(server.stats.messages, self.DOCS)
+        self.assertEqual(command.attempts, {})
+
+    def test_give_up_hands_the_reminder_to_the_outbox(self):
+        documents = create_documents(self.DOCS)
+        now = timezone.now()
+        with SmtpSink(error_rate=1.0) as sink, FakeTwilioServer(error_rate=1.0) as server, \
+                self.provider_settings(sink, server), notifications.NotificationDispatcher() as dispatcher, \
+                self.assertLogs(notifications.logger, 'ERROR'):
+            command = self.scheduler(dispatcher, max_attempts=1)
+            self.queue_documents(command, documents, now)
+            command.send_batch(now)
+
+        self.assertEqual(command.failed, self.DOCS)
+        self.assertFalse(NotificationLog.objects.exists())
+        self.assertEqual(
+            sorted(NotificationOutbox.objects.values_list('document_id', 'channels')),
+            [(document.pk, 'email,whatsapp') for document in documents],
+        )
+
+    def test_entries_of_the_previous_day_survive_the_rollover(self):
+        documents = create_documents(self.DOCS)
+        now = timezone.now()
+        with SmtpSink() as sink, FakeTwilioServer() as server, \
+                self.provider_settings(sink, server), notifications.NotificationDispatcher() as dispatcher:
+            command = self.scheduler(dispatcher)
+            self.queue_documents(command, documents, now)
+            # Meia-noite: o refresh do dia seguinte chega antes de a fila de ontem esvaziar
+            tomorrow = now + timedelta(days=1)
+            command.refresh(tomorrow)
+            self.assertEqual(len(command.scheduled), self.DOCS)
+            self.assertEqual(command.send_batch(tomorrow), self.DOCS)
+
+        self.assertEqual(sink.stats.messages, self.DOCS)
+        self.assertEqual(
+            set(NotificationLog.objects.values_list('sent_on', flat=True)), {timezone.localdate(now)},
+        )
+
+
+class FarmSearchIndexTests(TestCase):
+    """O índice de busca dos documentos repete nome e matrícula da fazenda: só esses campos o reindexam."""
+
+    def setUp(self):
+        self.farm = create_documents(3)[0].farm
+
+    def document_index_queries(self, **changes):
+        for field, value in changes.items():
+            setattr(self.farm, field, value)
+        with CaptureQueriesContext(connection) as queries:
+            self.farm.save()
+        return [q['sql'] for q in queries if 'farms_document_search' in q['sql']]
+
+    def test_unrelated_change_keeps_document_index(self):
+        self.assertEqual(self.document_index_queries(proprietario_nome='Outro Dono'), [])
+
+    def test_name_change_reindexes_documents(self):
+        self.assertNotEqual(self.document_index_queries(nome='Fazenda Renomeada'), [])
+
+
+class CountedPaginationTests(TestCase):
+    """Total limitado/estimado: a navegação não depende do total, e o cache da contagem exige um cache compartilhado."""
+
+    def test_capped_count_pages_by_extra_row(self):
+        create_documents(25)
+        queryset = Document.objects.order_by('pk')
+        paginator = CachedCountPaginator(queryset, 10, counter=ResultCount(queryset, limit=10))
+        self.assertEqual(paginator.count_kind, COUNT_CAPPED)
+
+        # O total parou em 10 (uma página), mas há mais linhas: a página 2 existe e tem próxima
+        pages = [paginator.page(number) for number in (1, 2, 3)]
+        self.assertEqual([page.has_next() for page in pages], [True, True, False])
+        self.assertEqual([len(page) for page in pages], [10, 10, 5])
+        self.assertEqual(pages[2].end_index(), 25)
+
+    def test_count_cache_needs_a_shared_cache(self):
+        self.assertFalse(count_cache_enabled())  # LocMem padrão: um processo não vê a versão do outro
+        with tempfile.TemporaryDirectory() as directory, override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory,
+        }}):
+            self.assertTrue(count_cache_enabled())
+
+
+@skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN é do SQLite')
+class ListQueryPlanTests(TestCase):
+    """
+    Cada ordenação das listagens lê pelo índice composto do dono, sem ordenar em
+    memória (USE TEMP B-TREE), na primeira página e nas páginas por cursor.
+    """
+
+    DOCUMENT_INDEXES = {
+        'nome': 'doc_owner_nome_idx',
+        'data_emissao': 'doc_owner_emissao_idx',
+        'data_vencimento': 'doc_owner_vencimento_idx',
+        # 'fazenda' (farm__nome) fica de fora: a coluna é de outra tabela e nenhum índice de Document a cobre
+    }
+    # matricula usa a UniqueConstraint (owner, matricula), que no SQLite aparece como autoindex da tabela
+    FARM_INDEXES = {
+        'nome': r'farm_owner_nome_idx',
+        'matricula': r'(uniq_owner_matricula|sqlite_autoindex_farms_farm_\d+)',
+    }
+
+    def setUp(self):
+        document = create_documents(3)[0]
+        self.user = document.created_by
+        for i in range(2):
+            Farm.objects.create(
+                owner=self.user, nome=f'Fazenda {i}', matricula=f'M-{i}', proprietario_nome='Dono', proprietario_cpf='00000000000',
+            )
+
+    def page_plans(self, view_class, sort, direction):
+        """Planos das consultas da primeira página e das páginas seguinte e anterior por cursor."""
+        request = RequestFactory().get('/', {'sort': sort, 'dir': direction})
+        request.user = self.user
+        view = view_class()
+        view.setup(request)
+        paginator = CursorPaginator(view.get_queryset(), 1)
+        statements = []
+
+        def capture(execute, sql, params, many, context):
+            statements.append((sql, params))
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(capture):
+            last = paginator.page(paginator.page(paginator.page().next_cursor).next_cursor)
+            paginator.page(last.previous_cursor)
+        # Primeira página, duas para a frente e uma para trás: as três últimas partem de um cursor
+        self.assertEqual(len({sql for sql, _params in statements}), 3)
+        plans = []
+        with connection.cursor() as cursor:
+            for sql, params in statements:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plans.append([row[-1] for row in cursor.fetchall()])
+        return plans
+
+    def assert_plans_use_index(self, view_class, indexes, table):
+        for sort, index in indexes.items():
+            for direction in ('asc', 'desc'):
+                for plan in self.page_plans(view_class, sort, direction):
+                    with self.subTest(sort=sort, direction=direction, plan=plan):
+                        self.assertRegex(plan[0], rf'^SEARCH {table} USING INDEX {index} \(owner_id=\?')
+                        self.assertFalse([step for step in plan if 'USE TEMP B-TREE' in step])
+
+    def test_document_list_sorts_use_owner_indexes(self):
+        self.assert_plans_use_index(DocumentListView, self.DOCUMENT_INDEXES, 'farms_document')
+
+    def test_farm_list_sorts_use_owner_indexes(self):
+        self.assert_plans_use_index(FarmListView, self.FARM_INDEXES, 'farms_farm')
+
+
+@override_settings(**EMAIL_ONLY)
+class CatchUpTests(ProviderStateMixin, TestCase):
+    """send_due_notifications --since: lembretes atrasados dizem quanto falta de fato."""
+
+    def test_late_reminder_reports_days_left_and_skips_expired(self):
+        today = timezone.localdate()
+        on_time, expired = create_documents(2)
+        # Lembrete de 7 dias que deveria ter saído há 3: o documento vence em 4
+        on_time.data_vencimento = today + timedelta(days=4)
+        on_time.save()
+        # Lembrete de 2 dias, também de 3 dias atrás: o documento venceu ontem
+        expired.reminders.all().delete()
+        expired.data_vencimento = today - timedelta(days=1)
+        expired.save()
+        DocumentReminder.objects.create(document=expired, days_before=2)
+
+        out = StringIO()
+        call_command('send_due_notifications', since=str(today - timedelta(days=3)), stdout=out)
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertIn('vence em 4 dia(s)', mail.outbox[0].subject)
+        self.assertIn('vence em 4 dia(s)', mail.outbox[0].body)
+        # O log segue com a chave original e o dia do disparo
+        self.assertEqual(
+            list(NotificationLog.objects.values_list('document_id', 'days_before', 'sent_on')),
+            [(on_time.pk, 7, today - timedelta(days=3))],
+        )
+        self.assertIn('Atrasadas ignoradas (documento já vencido): 1', out.getvalue())
+
+
+@override_settings(**EMAIL_ONLY)
+class OutboxTests(ProviderStateMixin, TestCase):
+    """Fila: o envio direto respeita as entradas pendentes e os canais pendentes sobrescrevem a reserva."""
+
+    def test_enqueue_then_direct_run_sends_once(self):
+        create_documents(3)
+        call_command('send_due_notifications', enqueue=True, stdout=StringIO())
+        call_command('send_due_notifications', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 0)
+
+        call_command('process_notification_outbox', stdout=StringIO())
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(NotificationLog.objects.count(), 3)
+
+    def test_pending_channels_overwrite_the_claim(self):
+        document = create_documents(1)[0]
+        key = (document.pk, 7)
+        today = timezone.localdate()
+        outbox.claim_keys([key], today, 'no-1')
+        outbox.retry_channels({key: ([notifications.CHANNEL_WHATSAPP], 'falhou')}, today)
+
+        entry = NotificationOutbox.objects.get()
+        self.assertEqual(entry.channels, notifications.CHANNEL_WHATSAPP)
+        self.assertEqual((entry.attempts, entry.last_error, entry.locked_by, entry.locked_until), (1, 'falhou', '', None))
+        self.assertEqual(entry.status, NotificationOutbox.STATUS_PENDING)
+
+    def test_sent_entries_are_purged_after_their_day(self):
+        document = create_documents(1)[0]
+        today = timezone.localdate()
+        for day in (today - timedelta(days=1), today):
+            outbox.mark_sent(list(outbox.claim_keys([(document.pk, 7)], day, 'no-1').values()))
+        self.assertEqual(outbox.purge_sent(today), 1)
+        self.assertEqual(list(NotificationOutbox.objects.values_list('sent_on', flat=True)), [today])
+
+
+class TestSendMetricsTests(TestCase):
+    """O envio de teste da interface é medido num registro próprio e exportado a cada envio."""
+
+    def setUp(self):
+        test_metrics.reset()
+        self.user = get_user_model().objects.create(username='dono')
+
+    def test_test_email_is_tracked_and_exported(self):
+        with tempfile.TemporaryDirectory() as directory, \
+                override_settings(**{**EMAIL_ONLY, 'NOTIFICATION_METRICS_DIR': directory}):
+            notifications.send_test_email('dono@example.com', self.user)
+            with self.assertRaises(notifications.NotificationError):
+                notifications.send_test_email('invalido', self.user)
+            with open(os.path.join(directory, f'{TEST_SEND_JOB}.json')) as fh:
+                data = json.load(fh)
+            self.assertTrue(os.path.exists(os.path.join(directory, f'{TEST_SEND_JOB}.prom')))
+
+        self.assertEqual(data['latency'][notifications.CHANNEL_EMAIL]['count'], 1)
+        self.assertEqual(data['counters']['test_sent'], {notifications.CHANNEL_EMAIL: 1})
+        # Endereço inválido é recusado antes de chegar ao provedor
+        self.assertNotIn('test_failed', data['counters'])
+
+
+@override_settings(
+    **EMAIL_ONLY, RATELIMIT_ENABLED=True, RATELIMITS={'notification_test': '2/m'},
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'ratelimit-tests'}},
+)
+class NotificationTestRateLimitTests(TestCase):
+    """O limite do envio de teste só conta requisições válidas (por usuário e canal)."""
+
+    def setUp(self):
+        self.client.force_login(get_user_model().objects.create(username='dono'))
+
+    def post(self, payload):
+        return self.client.post(reverse('farms:notification_test'), json.dumps(payload), content_type='application/json')
+
+    def test_invalid_payloads_do_not_spend_the_limit(self):
+        for payload in ({'channel': 'sms', 'value': 'x'}, {'channel': 'email', 'value': ''}) * 3:
+            self.assertEqual(self.post(payload).status_code, 400)
+        for _ in range(2):
+            self.assertEqual(self.post({'channel': 'email', 'value': 'dono@example.com'}).status_code, 200)
+        response = self.post({'channel': 'email', 'value': 'dono@example.com'})
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(len(mail.outbox), 2)
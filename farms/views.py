@@ -2,26 +2,36 @@
 
 """
 Views do app Farms com:
-- Listagens com filtros e paginação (fazendas e documentos)
+- Listagens com filtros e paginação por cursor/keyset, total em cache (fazendas e documentos; farms/pagination.py)
 - CRUD com escopo por usuário (owner) e mensagens de sucesso
 - Otimizações: select_related, ordering dinâmico (sort/dir), querystring no contexto
-- Endpoint para testar notificações (email/whatsapp)
+- Busca `q` pelo índice textual (farms/search.py), com ordenação opcional por relevância
+- Endpoint para testar notificações (email/whatsapp), assíncrono
 """
 
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
 from django.contrib.messages.views import SuccessMessageMixin
-from django.core.cache import cache
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError as DjangoValidationError
-from django.db.models import F, Q, Value as V
-from django.db.models.functions import Replace
+from django.db.models import Q
 from django.http import JsonResponse
 from django.urls import reverse_lazy
 from django.views import View
 from django.views.generic import CreateView, DeleteView, ListView, UpdateView
 
+from accounts.ratelimit import check_ratelimit
+
 from .forms import DocumentFilterForm, DocumentForm, FarmFilterForm, FarmForm
 from .models import Document, Farm
+from .normalization import phone_query, prefix_q
+from .pagination import CursorPaginationMixin
+from .search import DOCUMENT_INDEX, FARM_INDEX, query_digits
 from .services.notifications import (
     NotificationError,
     NotConfiguredError,
@@ -29,16 +39,21 @@ from .services.notifications import (
     send_test_whatsapp,
 )
 
+# Valor de `sort` que ordena o resultado da busca por relevância
+SORT_RELEVANCE = "relevancia"
+
 # =============================
 # Fazendas
 # =============================
 
 
-class FarmListView(LoginRequiredMixin, ListView):
+class FarmListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = Farm
     template_name = "farms/farm_list.html"
     context_object_name = "farms"
     paginate_by = 20
+    # Total em cache; acima de 10 mil resultados mostra "mais de 10000"
+    count_limit = 10000
 
     SORT_MAP = {"nome": "nome", "matricula": "matricula"}
 
@@ -46,17 +61,10 @@ class FarmListView(LoginRequiredMixin, ListView):
         sort = (self.request.GET.get("sort") or "nome").strip()
         direction = (self.request.GET.get("dir") or "asc").strip().lower()
         field = self.SORT_MAP.get(sort, "nome")
-        return (f"-{field}", "pk") if direction == "desc" else (field, "pk")
+        return (f"-{field}", "-pk") if direction == "desc" else (field, "pk")
 
     def get_queryset(self):
         qs = Farm.objects.filter(owner=self.request.user)
-        qs = qs.annotate(
-            cpf_digits=Replace(
-                Replace(Replace(F("proprietario_cpf"), V("."), V("")), V("-"), V("")),
-                V("/"),
-                V(""),
-            )
-        )
         form = FarmFilterForm(self.request.GET or None)
         self.filter_form = form
         if form.is_valid():
@@ -66,22 +74,32 @@ class FarmListView(LoginRequiredMixin, ListView):
             if cd.get("matricula"):
                 qs = qs.filter(matricula__icontains=cd["matricula"])
             if cd.get("car_recibo"):
-                qs = qs.filter(car_recibo__icontains=cd["car_recibo"])
+                qs = qs.filter(prefix_q("car_recibo_norm", cd["car_recibo"]))
             if cd.get("proprietario_nome"):
                 qs = qs.filter(proprietario_nome__icontains=cd["proprietario_nome"])
             if cd.get("proprietario_cpf"):
-                qs = qs.filter(cpf_digits__icontains=cd["proprietario_cpf"])
+                qs = qs.filter(prefix_q("proprietario_cpf_digits", cd["proprietario_cpf"]))
             q = cd.get("q")
             if q:
-                q_digits = "".join(ch for ch in q if ch.isdigit())
-                qs = qs.filter(
-                    Q(nome__icontains=q)
-                    | Q(matricula__icontains=q)
-                    | Q(car_recibo__icontains=q)
-                    | Q(proprietario_nome__icontains=q)
-                    | Q(proprietario_cpf__icontains=q)
-                    | Q(cpf_digits__icontains=q_digits)
-                )
+                ranked = self.request.GET.get("sort") == SORT_RELEVANCE
+                searched = FARM_INDEX.filter(qs, q, rank=ranked)
+                if searched is not None:
+                    if ranked:
+                        return searched.order_by("-search_rank", "pk")
+                    qs = searched
+                else:
+                    # Sem índice (banco sem suporte ou termo curto)
+                    q_digits = query_digits(q)
+                    cond = (
+                        Q(nome__icontains=q)
+                        | Q(matricula__icontains=q)
+                        | Q(car_recibo__icontains=q)
+                        | Q(proprietario_nome__icontains=q)
+                        | Q(proprietario_cpf__icontains=q)
+                    )
+                    if q_digits:
+                        cond |= prefix_q("proprietario_cpf_digits", q_digits)
+                    qs = qs.filter(cond)
         return qs.order_by(*self.get_ordering())
 
     def get_context_data(self, **kwargs):
@@ -130,11 +148,14 @@ class FarmDeleteView(LoginRequiredMixin, SuccessMessageMixin, DeleteView):
 # =============================
 
 
-class DocumentListView(LoginRequiredMixin, ListView):
+class DocumentListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
     model = Document
     template_name = "farms/document_list.html"
     context_object_name = "documents"
     paginate_by = 20
+    # Total em cache; acima de 10 mil, estimativa do planejador (PostgreSQL) ou "mais de 10000"
+    count_limit = 10000
+    count_estimate = True
 
     SORT_MAP = {
         "nome": "nome",
@@ -147,10 +168,10 @@ class DocumentListView(LoginRequiredMixin, ListView):
         sort = (self.request.GET.get("sort") or "data_vencimento").strip()
         direction = (self.request.GET.get("dir") or "asc").strip().lower()
         field = self.SORT_MAP.get(sort, "data_vencimento")
-        return (f"-{field}", "pk") if direction == "desc" else (field, "pk")
+        return (f"-{field}", "-pk") if direction == "desc" else (field, "pk")
 
     def get_queryset(self):
-        qs = Document.objects.filter(farm__owner=self.request.user).select_related("farm")
+        qs = Document.objects.filter(owner=self.request.user).select_related("farm")
         form = DocumentFilterForm(self.request.GET or None)
         self.filter_form = form
         if form.is_valid():
@@ -174,15 +195,27 @@ class DocumentListView(LoginRequiredMixin, ListView):
             if ate:
                 qs = qs.filter(data_vencimento__lte=ate)
             q = cd.get("q")
-            if q:
-                qs = qs.filter(
-                    Q(nome__icontains=q)
-                    | Q(tipo__icontains=q)
-                    | Q(farm__nome__icontains=q)
-                    | Q(farm__matricula__icontains=q)
-                    | Q(notify_email__icontains=q)
-                    | Q(notify_whatsapp__icontains=q)
-                )
+            phone = phone_query(q)
+            if phone:
+                # Telefone completo: igualdade no E.164 gravado (com índice), em qualquer formato digitado
+                qs = qs.filter(notify_whatsapp_e164=phone)
+            elif q:
+                ranked = self.request.GET.get("sort") == SORT_RELEVANCE
+                searched = DOCUMENT_INDEX.filter(qs, q, rank=ranked)
+                if searched is not None:
+                    if ranked:
+                        return searched.order_by("-search_rank", "pk")
+                    qs = searched
+                else:
+                    # Sem índice (banco sem suporte ou termo curto)
+                    qs = qs.filter(
+                        Q(nome__icontains=q)
+                        | Q(tipo__icontains=q)
+                        | Q(farm__nome__icontains=q)
+                        | Q(farm__matricula__icontains=q)
+                        | Q(notify_email__icontains=q)
+                        | Q(notify_whatsapp__icontains=q)
+                    )
         return qs.order_by(*self.get_ordering())
 
     def get_context_data(self, **kwargs):
@@ -214,7 +247,7 @@ class DocumentUpdateView(LoginRequiredMixin, SuccessMessageMixin, UpdateView):
     success_message = "Documento atualizado com sucesso."
 
     def get_queryset(self):
-        return Document.objects.filter(farm__owner=self.request.user).select_related("farm")
+        return Document.objects.filter(owner=self.request.user).select_related("farm")
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
@@ -229,23 +262,40 @@ class DocumentDeleteView(LoginRequiredMixin, SuccessMessageMixin, DeleteView):
     success_message = "Documento removido com sucesso."
 
     def get_queryset(self):
-        return Document.objects.filter(farm__owner=self.request.user)
+        return Document.objects.filter(owner=self.request.user)
 
 
 # =============================
 # API: Teste de Notificações
 # =============================
 
-class NotificationTestView(LoginRequiredMixin, View):
+# Envios de teste rodam fora do event loop, num pool próprio e limitado: uma
+# rajada de cliques espera aqui sem prender workers nem o loop do servidor ASGI.
+_test_send_executor = ThreadPoolExecutor(
+    max_workers=settings.NOTIFICATION_TEST_CONCURRENCY, thread_name_prefix="notification-test"
+)
+
+
+def _test_ratelimited(request, retry_after):
+    return JsonResponse(
+        {"ok": False, "error": "Muitas tentativas. Tente novamente em instantes.", "retry_after": retry_after},
+        status=429,
+    )
+
+
+class NotificationTestView(View):
     """
-    Endpoint para enviar teste de notificação.
+    Endpoint (async) para enviar teste de notificação.
     POST JSON: {"channel": "email"|"whatsapp", "value": "<destino>"}
-    Throttle: 5 req/min por usuário e canal.
+    Limite: settings.RATELIMITS["notification_test"] (padrão 5/min) por usuário e canal.
+    Sob ASGI (agrodocs/asgi.py) a chamada ao SMTP/Twilio não ocupa o worker.
     """
-    THROTTLE_LIMIT = 5  # por minuto
 
-    def post(self, request, *args, **kwargs):
-        import json
+    async def post(self, request, *args, **kwargs):
+        # LoginRequiredMixin é síncrono (request.user acessaria o banco dentro do loop)
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
 
         try:
             payload = json.loads(request.body.decode("utf-8"))
@@ -260,12 +310,12 @@ class NotificationTestView(LoginRequiredMixin, View):
         if not value:
             return JsonResponse({"ok": False, "error": "Informe um destino."}, status=400)
 
-        # Throttle por usuário e canal
-        key = f"notify_test:{request.user.id}:{channel}"
-        count = cache.get(key, 0)
-        if count >= self.THROTTLE_LIMIT:
-            return JsonResponse({"ok": False, "error": "Muitas tentativas. Tente novamente em instantes."}, status=429)
-        cache.set(key, count + 1, timeout=60)  # 1 minuto
+        # Conta só requisições válidas, por usuário e canal: payload malformado não gasta o limite
+        limited = await sync_to_async(check_ratelimit)(
+            request, user, "notification_test", key=channel, response=_test_ratelimited
+        )
+        if limited is not None:
+            return limited
 
         try:
             if channel == "email":
@@ -273,12 +323,16 @@ class NotificationTestView(LoginRequiredMixin, View):
                     validate_email(value)
                 except DjangoValidationError:
                     return JsonResponse({"ok": False, "error": "E-mail inválido."}, status=400)
-                ident = send_test_email(value, request.user)
+                ident = await sync_to_async(send_test_email, thread_sensitive=False, executor=_test_send_executor)(
+                    value, user
+                )
                 return JsonResponse({"ok": True, "channel": "email", "sent_to": value, "id": ident})
 
             else:  # whatsapp
                 # Delega a normalização/validação para o serviço, que aceita formatos variados
-                sid = send_test_whatsapp(value, request.user)
+                sid = await sync_to_async(send_test_whatsapp, thread_sensitive=False, executor=_test_send_executor)(
+                    value, user
+                )
                 return JsonResponse({"ok": True, "channel": "whatsapp", "sent_to": value, "id": sid})
 
         except NotConfiguredError as e: